@@ -26,6 +26,7 @@ from mailman.app import (
     domain, membership, moderator, registrar, subscriptions)
 from mailman.core import i18n, switchboard
 from mailman.languages import manager as language_manager
+from mailman.model import recipients
 from mailman.styles import manager as style_manager
 from mailman.utilities import passwords
 from zope import event
@@ -41,6 +42,8 @@ def initialize():
         membership.handle_SubscriptionEvent,
         moderator.handle_ListDeletingEvent,
         passwords.handle_ConfigurationUpdatedEvent,
+        recipients.handle_MembershipChangeEvent,
+        recipients.handle_PreferencesChangedEvent,
         registrar.handle_ConfirmationNeededEvent,
         style_manager.handle_ConfigurationUpdatedEvent,
         subscriptions.handle_ListDeletingEvent,
@@ -33,11 +33,12 @@ import logging
 from datetime import timedelta
 from enum import Enum
 from flufl.lock import Lock, NotLockedError, TimeOutError
-from lazr.config import as_boolean
+from lazr.config import ConfigSchema, as_boolean
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
 from mailman.utilities.options import Options
+from pkg_resources import resource_filename
 
 
 DOT = '.'
@@ -71,7 +72,9 @@ and SIGUSR1 all cause a runner to exit cleanly.  The master will restart
 runners that have exited due to a SIGUSR1 or some kind of other exit condition
 (say because of an uncaught exception).  SIGHUP causes the master and the
 runners to close their log files, and reopen then upon the next printed
-message.
+message.  The master also re-reads the number of instances of each runner
+from the configuration file, and restarts the runners whose number of
+instances has changed.
 
 The master also responds to SIGINT, SIGTERM, SIGUSR1 and SIGHUP, which it
 simply passes on to the runners.  Note that the master will close and reopen
@@ -290,6 +293,29 @@ class PIDWatcher:
         """
         return self._pids.pop(pid, None)
 
+    def get(self, pid):
+        """Return existing process information.
+
+        :param pid: The process id.
+        :type pid: int
+        :return: The process information, or None if the process id is not
+            being tracked.
+        :rtype: 4-tuple consisting of
+            (runner-name, slice-number, slice-count, restart-count)
+        """
+        return self._pids.get(pid)
+
+    def runner_pids(self, name):
+        """Return the process ids of the instances of a runner.
+
+        :param name: The runner name.
+        :type name: str
+        :return: The process ids.
+        :rtype: list of int
+        """
+        return [pid for pid, info in list(self._pids.items())
+                if info[0] == name]
+
 
 
 class Loop:
@@ -300,6 +326,10 @@ class Loop:
         self._restartable = restartable
         self._config_file = config_file
         self._kids = PIDWatcher()
+        # Maps the names of the runners being resized to their new number of
+        # instances.  The new instances are started once the old ones have
+        # all exited.
+        self._resizing = {}
 
     def install_signal_handlers(self):
         """Install various signals handlers for control from the master."""
@@ -318,6 +348,7 @@ class Loop:
             for pid in self._kids:
                 os.kill(pid, signal.SIGHUP)
             log.info('Master watcher caught SIGHUP.  Re-opening log files.')
+            self.resize_runners()
         signal.signal(signal.SIGHUP, sighup_handler)
         # SIGUSR1 is used by 'mailman restart'.
         def sigusr1_handler(signum, frame):
@@ -418,14 +449,72 @@ class Loop:
             count = int(runner_config.instances)
             assert (count & (count - 1)) == 0, (
                 'Runner "{0}", not a power of 2: {1}'.format(name, count))
-            for slice_number in range(count):
-                # runner name, slice #, # of slices, restart count
-                info = (name, slice_number, count, 0)
-                spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
-                pid = self._start_runner(spec)
-                log = logging.getLogger('mailman.runner')
-                log.debug('[{0:d}] {1}'.format(pid, spec))
-                self._kids.add(pid, info)
+            self._start_instances(name, count)
+
+    def _start_instances(self, name, count):
+        """Start all the instances of a runner.
+
+        :param name: The runner name.
+        :type name: str
+        :param count: The number of instances, i.e. slices, to start.
+        :type count: int
+        """
+        for slice_number in range(count):
+            # runner name, slice #, # of slices, restart count
+            info = (name, slice_number, count, 0)
+            spec = '{0}:{1:d}:{2:d}'.format(name, slice_number, count)
+            pid = self._start_runner(spec)
+            log = logging.getLogger('mailman.runner')
+            log.debug('[{0:d}] {1}'.format(pid, spec))
+            self._kids.add(pid, info)
+
+    def _read_instances(self):
+        """Read the number of instances of each runner from the configuration.
+
+        :return: A mapping from runner names to their number of instances.
+        :rtype: dict
+        """
+        schema = ConfigSchema(
+            resource_filename('mailman.config', 'schema.cfg'))
+        lazr_config = schema.load(
+            resource_filename('mailman.config', 'mailman.cfg'))
+        config_file = (config.filename if self._config_file is None
+                       else self._config_file)
+        if config_file is not None:
+            with open(config_file, 'r', encoding='utf-8') as fp:
+                lazr_config.push(config_file, fp.read())
+        return {section.name[7:]: int(section.instances)
+                for section in lazr_config.getByCategory('runner', [])}
+
+    def resize_runners(self):
+        """Restart the runners whose number of instances has changed.
+
+        The running instances of such a runner are stopped, and once they
+        have all exited, the new number of instances is started.
+        """
+        log = logging.getLogger('mailman.runner')
+        try:
+            instances = self._read_instances()
+        except Exception:
+            log.exception('Cannot re-read the number of runner instances')
+            return
+        running = {}
+        for pid in self._kids:
+            info = self._kids.get(pid)
+            if info is not None:
+                running.setdefault(info[0], info[2])
+        for name, count in sorted(instances.items()):
+            if (name not in running or running[name] == count or
+                    name in self._resizing):
+                continue
+            if count < 1 or (count & (count - 1)) != 0:
+                log.error('Runner "%s", not a power of 2: %s', name, count)
+                continue
+            log.info('Changing the number of %s runners from %d to %d',
+                     name, running[name], count)
+            self._resizing[name] = count
+            for pid in self._kids.runner_pids(name):
+                os.kill(pid, signal.SIGTERM)
 
     def _pause(self):
         """Sleep until a signal is received."""
@@ -469,6 +558,14 @@ class Loop:
             # runaway restarts (e.g.  if the subprocess had a syntax error!)
             rname, slice_number, count, restarts = self._kids.pop(pid)
             config_name = 'runner.' + rname
+            if rname in self._resizing:
+                # The runner is being stopped to change its number of
+                # instances.  Once the last one is gone, start the new ones.
+                log.debug('Stopped runner {0}, slice {1:d}/{2:d}'.format(
+                    rname, slice_number + 1, count))
+                if len(self._kids.runner_pids(rname)) == 0:
+                    self._start_instances(rname, self._resizing.pop(rname))
+                continue
             restart = False
             if why == signal.SIGUSR1 and self._restartable:
                 restart = True
@@ -19,16 +19,19 @@
 
 __all__ = [
     'TestMasterLock',
+    'TestResizeRunners',
     ]
 
 
 import os
 import errno
+import signal
 import tempfile
 import unittest
 
 from flufl.lock import Lock
 from mailman.bin import master
+from unittest.mock import patch
 
 
 
@@ -68,3 +71,60 @@ class TestMasterLock(unittest.TestCase):
             my_lock.unlock()
         self.assertEqual(state, master.WatcherState.conflict)
         # XXX test stale_lock and host_mismatch states.
+
+
+
+
+class TestResizeRunners(unittest.TestCase):
+    def setUp(self):
+        fd, self._config_file = tempfile.mkstemp()
+        os.close(fd)
+        self._loop = master.Loop(config_file=self._config_file)
+        self._loop._kids.add(101, ('out', 0, 1, 0))
+        self._loop._kids.add(102, ('in', 0, 1, 0))
+
+    def tearDown(self):
+        os.remove(self._config_file)
+
+    def _set_instances(self, count):
+        with open(self._config_file, 'w') as fp:
+            print('[runner.out]', file=fp)
+            print('instances: {}'.format(count), file=fp)
+
+    def test_read_instances(self):
+        self._set_instances(4)
+        instances = self._loop._read_instances()
+        self.assertEqual(instances['out'], 4)
+        self.assertEqual(instances['in'], 1)
+
+    def test_unchanged(self):
+        self._set_instances(1)
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop.resize_runners()
+        self.assertEqual(kill.call_count, 0)
+
+    def test_not_a_power_of_two(self):
+        self._set_instances(3)
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop.resize_runners()
+        self.assertEqual(kill.call_count, 0)
+
+    def test_resize(self):
+        # The running instances are stopped, and once they're all gone, the
+        # new number of instances is started.
+        self._set_instances(2)
+        with patch('mailman.bin.master.os.kill') as kill:
+            self._loop.resize_runners()
+        kill.assert_called_once_with(101, signal.SIGTERM)
+        exits = [(101, signal.SIGTERM), OSError(errno.ECHILD, 'No child')]
+        new_pids = [201, 202]
+        with patch('mailman.bin.master.os.wait', side_effect=exits), \
+                patch.object(self._loop, '_pause'), \
+                patch.object(self._loop, '_start_runner',
+                             side_effect=new_pids) as start_runner:
+            self._loop.loop()
+        self.assertEqual(
+            [call[0][0] for call in start_runner.call_args_list],
+            ['out:0:2', 'out:1:2'])
+        self.assertEqual(self._loop._kids.runner_pids('out'), new_pids)
+        self.assertEqual(self._loop._kids.get(202), ('out', 1, 2, 0))
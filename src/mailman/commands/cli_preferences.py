@@ -0,0 +1,58 @@
+# Copyright (C) 2009-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The 'preferences' command."""
+
+__all__ = [
+    'Preferences',
+    ]
+
+
+from mailman.core.i18n import _
+from mailman.database.transaction import transactional
+from mailman.interfaces.command import ICLISubCommand
+from mailman.interfaces.preferences import IEffectivePreferencesManager
+from zope.component import getUtility
+from zope.interface import implementer
+
+
+
+@implementer(ICLISubCommand)
+class Preferences:
+    """Maintain the members' resolved preferences."""
+
+    name = 'preferences'
+
+    def add(self, parser, command_parser):
+        """See `ICLISubCommand`."""
+        self.parser = parser
+        command_parser.add_argument(
+            '-r', '--rebuild',
+            default=False, action='store_true',
+            help=_("""\
+            Resolve every member's preferences again from scratch.  This is
+            only needed when the table of resolved preferences was changed
+            outside of Mailman."""))
+
+    @transactional
+    def process(self, args):
+        """See `ICLISubCommand`."""
+        if not args.rebuild:
+            self.parser.error(_('Nothing to do'))
+            return
+        count = getUtility(IEffectivePreferencesManager).rebuild()
+        print(_('Resolved the preferences of $count members'))
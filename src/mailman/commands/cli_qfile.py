@@ -22,8 +22,9 @@ __all__ = [
     ]
 
 
-import pickle
-
+from mailman.config import config
+from mailman.core import queuefile
+from mailman.core.blobstore import BlobStore
 from mailman.core.i18n import _
 from mailman.interfaces.command import ICLISubCommand
 from mailman.utilities.interact import interact
@@ -69,11 +70,9 @@ class QFile:
         printer = PrettyPrinter(indent=4)
         assert len(args.qfile) == 1, 'Wrong number of positional arguments'
         with open(args.qfile[0], 'rb') as fp:
-            while True:
-                try:
-                    m.append(pickle.load(fp))
-                except EOFError:
-                    break
+            # The message object and the metadata dictionary.  The message
+            # body may be kept in the blob store.
+            m.extend(queuefile.load(fp, BlobStore(config.BLOB_DIR)))
         if args.doprint:
             print(_('[----- start pickle -----]'))
             for i, obj in enumerate(m):
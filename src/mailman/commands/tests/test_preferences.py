@@ -0,0 +1,73 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the `preferences` command line subcommand."""
+
+__all__ = [
+    'TestPreferences',
+    ]
+
+
+import unittest
+
+from io import StringIO
+from mailman.app.lifecycle import create_list
+from mailman.commands.cli_preferences import Preferences
+from mailman.interfaces.usermanager import IUserManager
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+from zope.component import getUtility
+
+
+class FakeArgs:
+    rebuild = False
+
+
+class FakeParser:
+    def __init__(self):
+        self.message = None
+
+    def error(self, message):
+        self.message = message
+        raise SystemExit
+
+
+
+class TestPreferences(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._command = Preferences()
+        self._command.parser = FakeParser()
+        self._args = FakeArgs()
+
+    def test_nothing_to_do(self):
+        with self.assertRaises(SystemExit):
+            self._command.process(self._args)
+        self.assertEqual(self._command.parser.message, 'Nothing to do')
+
+    def test_rebuild(self):
+        mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        for email in ('anne@example.com', 'bart@example.com'):
+            mlist.subscribe(user_manager.create_address(email))
+        self._args.rebuild = True
+        output = StringIO()
+        with patch('sys.stdout', output):
+            self._command.process(self._args)
+        self.assertEqual(output.getvalue(),
+                         'Resolved the preferences of 2 members\n')
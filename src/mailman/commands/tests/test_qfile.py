@@ -0,0 +1,74 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the `qfile` command line subcommand."""
+
+__all__ = [
+    'TestQFile',
+    ]
+
+
+import os
+import unittest
+
+from io import StringIO
+from mailman.commands import cli_qfile
+from mailman.commands.cli_qfile import QFile
+from mailman.config import config
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+class FakeArgs:
+    doprint = True
+    interactive = False
+    qfile = []
+
+
+
+class TestQFile(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._command = QFile()
+        self._args = FakeArgs()
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""" + 'A big message.\\n' * 100)
+        self.addCleanup(cli_qfile.m.clear)
+
+    def test_blob_stored_body(self):
+        # Queue files whose message body is kept in the blob store can be
+        # dumped, including the ones preserved in the bad queue.
+        switchboard = config.switchboards['in']
+        with configuration('mailman', blob_threshold=1000):
+            filebase = switchboard.enqueue(self._msg)
+        switchboard.dequeue(filebase)
+        switchboard.finish(filebase, preserve=True)
+        bad_dir = config.switchboards['bad'].queue_directory
+        self._args.qfile = [os.path.join(bad_dir, filebase + '.psv')]
+        output = StringIO()
+        with patch('sys.stdout', output):
+            self._command.process(self._args)
+        msg, msgdata = cli_qfile.m
+        self.assertEqual(msg.get_payload(), self._msg.get_payload())
+        self.assertIn('A big message.', output.getvalue())
@@ -171,6 +171,7 @@ class Configuration:
             argv                    = bin_dir,
             # Directories.
             bin_dir                 = category.bin_dir,
+            blob_dir                = category.blob_dir,
             data_dir                = category.data_dir,
             etc_dir                 = category.etc_dir,
             ext_dir                 = category.ext_dir,
@@ -180,6 +181,7 @@ class Configuration:
             messages_dir            = category.messages_dir,
             archive_dir             = category.archive_dir,
             queue_dir               = category.queue_dir,
+            stats_dir               = category.stats_dir,
             var_dir                 = var_dir,
             template_dir            = (
                 os.path.dirname(mailman.templates.__file__)
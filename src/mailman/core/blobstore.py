@@ -0,0 +1,129 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A content addressed store for message bodies shared by queue files.
+
+As a message makes its way through the queues, it is written into a new queue
+file at every hop.  For big messages, most of that is the unchanged body.
+Queue files can instead refer to a copy of the body in the blob store, which
+is written only once.
+
+Each blob is stored in a file named after the SHA1 hex digest of its
+contents.  Every queue file referring to the blob gets its own reference,
+which is a hard link to the blob's file, so the file system keeps count of
+the references.  When the last reference is released, the blob is deleted.
+"""
+
+__all__ = [
+    'BlobStore',
+    ]
+
+
+import os
+import uuid
+import hashlib
+
+from mailman.utilities.filesystem import makedirs
+
+
+
+class BlobStore:
+    """A store of reference counted blobs."""
+
+    def __init__(self, directory):
+        """Create a blob store.
+
+        :param directory: The directory holding the blobs.  It is created
+            when the first blob is stored.
+        :type directory: str
+        """
+        self.directory = directory
+
+    def put(self, data):
+        """Store a blob, or add a reference to an identical stored blob.
+
+        :param data: The contents of the blob.
+        :type data: bytes
+        :return: The new reference to the blob.
+        :rtype: str
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        reference = '{}.{}'.format(digest, uuid.uuid4().hex)
+        blob_path = os.path.join(self.directory, digest)
+        path = os.path.join(self.directory, reference)
+        try:
+            os.link(blob_path, path)
+        except FileNotFoundError:
+            # This is the first copy of the blob, or the last reference to it
+            # was just released.
+            makedirs(self.directory, 0o770)
+            tmpfile = path + '.tmp'
+            with open(tmpfile, 'wb') as fp:
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+            try:
+                os.link(tmpfile, blob_path)
+            except FileExistsError:
+                # Another process stored the same blob in the meantime.  Our
+                # reference will just have its own copy.
+                pass
+            os.rename(tmpfile, path)
+        return reference
+
+    def get(self, reference):
+        """Return the contents of a blob.
+
+        :param reference: A reference returned by `put()`.
+        :type reference: str
+        :return: The contents of the blob.
+        :rtype: bytes
+        """
+        with open(os.path.join(self.directory, reference), 'rb') as fp:
+            return fp.read()
+
+    def release(self, reference):
+        """Release a reference, deleting the blob if it was the last one.
+
+        :param reference: A reference returned by `put()`.
+        :type reference: str
+        """
+        digest = reference.split('.', 1)[0]
+        blob_path = os.path.join(self.directory, digest)
+        try:
+            os.unlink(os.path.join(self.directory, reference))
+        except FileNotFoundError:
+            pass
+        try:
+            # If another process adds a reference between the check and the
+            # unlink, that reference still links to the contents.  The blob
+            # will just be written again when it is next stored.
+            if os.stat(blob_path).st_nlink == 1:
+                os.unlink(blob_path)
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, reference):
+        return os.path.exists(os.path.join(self.directory, reference))
+
+    def __len__(self):
+        """The number of distinct blobs in the store."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        return sum(1 for name in names if '.' not in name)
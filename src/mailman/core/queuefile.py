@@ -0,0 +1,425 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reading and writing queue files.
+
+A queue file holds a message and its metadata dictionary.  It starts with a
+fixed size header:
+
+ * the magic bytes `MMQF`;
+ * the format version, currently 1, as one byte;
+ * how the message is stored, as one byte (see below);
+ * the length of the metadata which follows, as a 4 byte big endian integer.
+
+The metadata is a JSON object, with the message metadata dictionary under the
+`msgdata` key and any extra attributes of the message object under the
+`attributes` key.  Sets, tuples, dates and other values which JSON can't
+represent directly are encoded as tagged JSON objects, and anything else is
+pickled.  `CompactRecipients` keep their compressed form.  The rest of the
+file is the message, which is normally stored as its raw RFC 5322 bytes, so
+that reading the message back only needs to parse its headers.  The body is
+parsed when it is first used.  Messages which can't be faithfully represented
+as bytes (e.g. because they contain `Header` instances or unencoded non-ASCII
+text) are pickled instead.
+
+Big message bodies can also be kept in a shared `BlobStore`.  The queue file
+then holds the blob reference on a line of its own, followed by the message
+headers.
+
+Queue files written by older versions of Mailman contain two pickles instead:
+the message and then the metadata.  These can still be read.
+"""
+
+__all__ = [
+    'blob_reference',
+    'dumps',
+    'load',
+    'load_metadata',
+    'rewrite_metadata',
+    ]
+
+
+import io
+import json
+import uuid
+import email
+import base64
+import pickle
+import struct
+import datetime
+
+from email.generator import BytesGenerator
+from email.policy import compat32
+from mailman.email.message import BLANK_LINE, LazyMessage, Message
+from mailman.utilities.recipients import CompactRecipients
+
+
+MAGIC = b'MMQF'
+FORMAT_VERSION = 1
+# magic, format version, message storage, metadata length
+HEADER = struct.Struct('>4sBBI')
+
+# How the message is stored.
+RAW = 0
+TEXT = 1
+PICKLE = 2
+BLOB = 3
+
+# The key marking a JSON object as an encoded Python value.
+TAG = '__qfile__'
+
+# Message attributes which are restored by parsing the message bytes, or
+# which only keep track of the message's flattened form.
+PARSED_ATTRIBUTES = frozenset((
+    'policy', '_headers', '_payload', '_charset', 'preamble', 'epilogue',
+    'defects', '_raw', '_body_offset', '_generation', '_flattened',
+    ))
+# The rest of the attributes of a freshly created message.
+MISSING = object()
+DEFAULT_ATTRIBUTES = {
+    key: value for key, value in vars(LazyMessage()).items()
+    if key not in PARSED_ATTRIBUTES
+    }
+
+
+
+def _encode(value):
+    """Turn a value into something which can be serialized as JSON."""
+    kind = type(value)
+    if value is None or kind in (bool, int, float, str):
+        return value
+    if kind is list:
+        return [_encode(item) for item in value]
+    if kind is dict:
+        if TAG not in value and all(type(key) is str for key in value):
+            return {key: _encode(item) for key, item in value.items()}
+        return {TAG: 'dict',
+                'items': [[_encode(key), _encode(item)]
+                          for key, item in value.items()]}
+    if kind in (tuple, set, frozenset):
+        return {TAG: kind.__name__, 'items': [_encode(item) for item in value]}
+    if kind is bytes:
+        return {TAG: 'bytes', 'value': base64.b64encode(value).decode('ascii')}
+    if kind is datetime.datetime and value.tzinfo is None:
+        return {TAG: 'datetime',
+                'value': [value.year, value.month, value.day, value.hour,
+                          value.minute, value.second, value.microsecond]}
+    if kind is datetime.timedelta:
+        return {TAG: 'timedelta',
+                'value': [value.days, value.seconds, value.microseconds]}
+    if kind is uuid.UUID:
+        return {TAG: 'uuid', 'value': value.hex}
+    if kind is CompactRecipients:
+        return {TAG: 'recipients',
+                'value': base64.b64encode(value.data).decode('ascii')}
+    pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    return {TAG: 'pickle', 'value': base64.b64encode(pickled).decode('ascii')}
+
+
+
+def _decode(obj):
+    """The JSON object hook undoing `_encode()`."""
+    kind = obj.get(TAG)
+    if kind is None:
+        return obj
+    if kind == 'dict':
+        return {key: value for key, value in obj['items']}
+    if kind == 'tuple':
+        return tuple(obj['items'])
+    if kind == 'set':
+        return set(obj['items'])
+    if kind == 'frozenset':
+        return frozenset(obj['items'])
+    if kind == 'bytes':
+        return base64.b64decode(obj['value'])
+    if kind == 'datetime':
+        return datetime.datetime(*obj['value'])
+    if kind == 'timedelta':
+        return datetime.timedelta(*obj['value'])
+    if kind == 'uuid':
+        return uuid.UUID(hex=obj['value'])
+    if kind == 'recipients':
+        return CompactRecipients.from_bytes(base64.b64decode(obj['value']))
+    if kind == 'pickle':
+        return pickle.loads(base64.b64decode(obj['value']))
+    raise ValueError('Unknown queue file value type: {}'.format(kind))
+
+
+
+def _is_raw(text):
+    """Can the text be written out as is, i.e. is it ASCII or raw bytes?"""
+    try:
+        text.encode('ascii', 'surrogateescape')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+
+def _extra_attributes(part):
+    """Return the attributes which parsing the message won't bring back."""
+    return {key: value for key, value in vars(part).items()
+            if (key not in PARSED_ATTRIBUTES and
+                DEFAULT_ATTRIBUTES.get(key, MISSING) != value)}
+
+
+
+def _faithful(part):
+    """Will the message part's headers survive being flattened and reparsed?"""
+    if part.policy is not compat32 or part.get_charset() is not None:
+        return False
+    for name, value in part.raw_items():
+        if type(value) is not str or not _is_raw(value):
+            return False
+    return True
+
+
+
+def _generate(msg):
+    """Flatten the message to bytes like `str(msg)` flattens it to text."""
+    fp = io.BytesIO()
+    BytesGenerator(fp, mangle_from_=False, maxheaderlen=0).flatten(msg)
+    return fp.getvalue()
+
+
+
+def _flatten(msg):
+    """Return the message's bytes, or None if they can't stand in for it."""
+    if not _faithful(msg):
+        return None
+    body = getattr(msg, 'unparsed_body', None)
+    if body is not None:
+        # The body hasn't been touched since it was read from a queue file,
+        # so only the headers need to be generated.
+        headers = Message()
+        for name, value in msg.raw_items():
+            headers[name] = value
+        headers.set_payload('')
+        return _generate(headers) + body
+    for part in msg.walk():
+        if part is not msg:
+            # Only the attributes of the message itself are stored.  The
+            # parser sets the default type of the parts of digests.
+            attributes = _extra_attributes(part)
+            attributes.pop('_default_type', None)
+            if not _faithful(part) or len(attributes) > 0:
+                return None
+        # get_payload() would decode any raw bytes in the payload.
+        payload = part._payload
+        if isinstance(payload, str):
+            if not _is_raw(payload):
+                return None
+        elif payload is not None and not isinstance(payload, list):
+            return None
+    try:
+        return _generate(msg)
+    except (TypeError, UnicodeError, LookupError):
+        return None
+
+
+
+def dumps(msg, msgdata, plaintext=False, blobs=None, blob_threshold=0):
+    """Return the contents of a queue file.
+
+    :param msg: The message.
+    :type msg: `email.message.Message`
+    :param msgdata: The message metadata.
+    :type msgdata: dict
+    :param plaintext: Store the message as its string representation, i.e. as
+        the `_plaintext` metadata key asks for.
+    :type plaintext: bool
+    :param blobs: The blob store for big message bodies, or None.
+    :type blobs: `BlobStore`
+    :param blob_threshold: Message bodies of at least this many bytes are put
+        in the blob store.  Zero disables the blob store.
+    :type blob_threshold: int
+    :return: The queue file contents.
+    :rtype: bytes
+    """
+    attributes = {}
+    if plaintext:
+        storage = TEXT
+        message_bytes = str(msg).encode('utf-8', 'surrogateescape')
+    else:
+        message_bytes = _flatten(msg)
+        if message_bytes is None:
+            storage = PICKLE
+            message_bytes = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        else:
+            storage = RAW
+            # Remember the attributes which were set directly on the message
+            # object, such as `original_size`.
+            attributes = _extra_attributes(msg)
+            match = BLANK_LINE.search(message_bytes)
+            if (blobs is not None and blob_threshold > 0 and
+                    match is not None and
+                    len(message_bytes) - match.end() >= blob_threshold):
+                storage = BLOB
+                reference = blobs.put(message_bytes[match.end():])
+                message_bytes = b''.join((reference.encode('ascii'), b'\n',
+                                          message_bytes[:match.end()]))
+    metadata = json.dumps(
+        dict(msgdata=_encode(msgdata), attributes=_encode(attributes)),
+        separators=(',', ':')).encode('ascii')
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, storage, len(metadata))
+    return header + metadata + message_bytes
+
+
+
+def _read_fixed_header(fp):
+    """Read the fixed size part of the queue file header.
+
+    :return: The message storage and the length of the metadata, or None if
+        this is an old style pickle queue file.
+    """
+    fp.seek(0)
+    header = fp.read(HEADER.size)
+    if header[:len(MAGIC)] != MAGIC:
+        fp.seek(0)
+        return None
+    magic, version, storage, length = HEADER.unpack(header)
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported queue file version: {}'.format(version))
+    return storage, length
+
+
+
+def _read_header(fp):
+    """Read the queue file header.
+
+    :return: The message storage and the metadata, or None if this is an old
+        style pickle queue file.
+    """
+    header = _read_fixed_header(fp)
+    if header is None:
+        return None
+    storage, length = header
+    metadata = json.loads(fp.read(length).decode('ascii'),
+                          object_hook=_decode)
+    return storage, metadata
+
+
+
+def load(fp, blobs=None):
+    """Read a queue file.
+
+    :param fp: The open queue file, in binary mode.
+    :param blobs: The blob store holding the message body, if any.
+    :type blobs: `BlobStore`
+    :return: The message and the metadata dictionary.
+    :rtype: 2-tuple of (`Message`, dict)
+    """
+    header = _read_header(fp)
+    if header is None:
+        msg = pickle.load(fp)
+        msgdata = pickle.load(fp)
+        if msgdata.get('_parsemsg'):
+            storage = TEXT
+            message_bytes = None
+        else:
+            return msg, msgdata
+    else:
+        storage, metadata = header
+        msgdata = metadata['msgdata']
+        message_bytes = fp.read()
+    if storage == BLOB:
+        if blobs is None:
+            raise ValueError('No blob store for the message body')
+        reference, newline, headers = message_bytes.partition(b'\n')
+        storage = RAW
+        message_bytes = headers + blobs.get(reference.decode('ascii'))
+    if storage == RAW:
+        msg = LazyMessage.from_bytes(message_bytes)
+        vars(msg).update(metadata['attributes'])
+    elif storage == TEXT:
+        if message_bytes is not None:
+            msg = message_bytes.decode('utf-8', 'surrogateescape')
+        # Calculate the original size of the text now so that we won't have
+        # to generate the message later when we do size restriction checking.
+        original_size = len(msg)
+        msg = email.message_from_string(msg, Message)
+        msg.original_size = original_size
+        msgdata['original_size'] = original_size
+    elif storage == PICKLE:
+        msg = pickle.loads(message_bytes)
+    else:
+        raise ValueError('Unknown message storage: {}'.format(storage))
+    return msg, msgdata
+
+
+
+def load_metadata(fp):
+    """Read just the metadata dictionary from a queue file.
+
+    :param fp: The open queue file, in binary mode.
+    :return: The metadata dictionary.
+    :rtype: dict
+    """
+    header = _read_header(fp)
+    if header is None:
+        # Throw away the message object.
+        pickle.load(fp)
+        return pickle.load(fp)
+    storage, metadata = header
+    return metadata['msgdata']
+
+
+
+def rewrite_metadata(fp, msgdata):
+    """Replace the metadata dictionary in a queue file.
+
+    :param fp: The queue file, open for reading and writing in binary mode.
+    :param msgdata: The new metadata dictionary.
+    :type msgdata: dict
+    """
+    header = _read_header(fp)
+    if header is None:
+        pickle.load(fp)
+        fp.truncate(fp.tell())
+        protocol = (0 if msgdata.get('_parsemsg') else 1)
+        pickle.dump(msgdata, fp, protocol)
+        return
+    storage, metadata = header
+    message_bytes = fp.read()
+    metadata = json.dumps(
+        dict(msgdata=_encode(msgdata),
+             attributes=_encode(metadata['attributes'])),
+        separators=(',', ':')).encode('ascii')
+    fp.seek(0)
+    fp.write(HEADER.pack(MAGIC, FORMAT_VERSION, storage, len(metadata)))
+    fp.write(metadata)
+    fp.write(message_bytes)
+    fp.truncate()
+
+
+
+def blob_reference(fp):
+    """Return the reference to the blob holding the message body, if any.
+
+    :param fp: The open queue file, in binary mode.
+    :return: The blob reference, or None if the message body is stored in
+        the queue file itself.
+    :rtype: str
+    """
+    header = _read_fixed_header(fp)
+    if header is None:
+        return None
+    storage, length = header
+    if storage != BLOB:
+        return None
+    fp.seek(length, io.SEEK_CUR)
+    return fp.readline().rstrip(b'\n').decode('ascii')
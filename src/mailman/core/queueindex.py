@@ -0,0 +1,422 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""An incrementally maintained index of the files in a queue directory.
+
+Listing a queue directory, parsing every file name and sorting the results on
+every pass through a runner's main loop gets expensive when the queue holds
+hundreds of thousands of files.  The index remembers the files it has already
+seen, so rescanning the directory only needs to parse the names of new files,
+and the oldest files in the queue can be handed out without sorting the whole
+queue again.
+
+Queue file bases have the form `<time>+<digest>+<priority>+<key>`, where the
+key identifies the mailing list the message belongs to.  Older file bases
+only have the time and the digest parts.  Besides handing out files in FIFO
+order, the index can hand out higher priority files first, taking turns
+between the mailing lists within each priority.  Files which were recovered
+after a crash have a fifth part counting the number of times they were
+recovered.
+
+The time of a file base is the time at which the file is due to be processed.
+That is normally when it was enqueued, but files can also be enqueued with a
+time in the future, and the index can leave them out until they are due.
+"""
+
+__all__ = [
+    'QueueIndex',
+    'directory_mtime',
+    'parse_filebase',
+    'recovered_filebase',
+    'recovery_count',
+    ]
+
+
+import os
+import time
+
+from bisect import insort
+from collections import OrderedDict
+from heapq import merge
+
+
+# Directory modification times have a limited granularity, so a file added in
+# the same clock tick as our last scan, or as one of our own changes, could go
+# unnoticed.  When the directory was modified within this many seconds of the
+# last scan, or when we changed it ourselves, it is scanned once more after
+# this many seconds have passed.
+RACY_WINDOW = 1.0
+
+
+
+def directory_mtime(directory):
+    """Return the modification time of a directory.
+
+    :param directory: The directory.
+    :type directory: str
+    :return: The modification time, or None if the directory doesn't exist.
+    :rtype: float
+    """
+    try:
+        return os.stat(directory).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+def parse_filebase(filebase):
+    """Split a queue file base into its parts.
+
+    :param filebase: The file base, i.e. the file name without its extension.
+    :type filebase: str
+    :return: The time the file was enqueued, the hex digest, the priority and
+        the fairness key.
+    :rtype: 4-tuple of (float, str, int, str)
+    """
+    parts = filebase.split('+')
+    priority = (int(parts[2]) if len(parts) > 2 else 0)
+    key = (parts[3] if len(parts) > 3 else '')
+    return float(parts[0]), parts[1], priority, key
+
+
+def recovery_count(filebase):
+    """Return the number of times a queue file was recovered.
+
+    :param filebase: The file base, i.e. the file name without its extension.
+    :type filebase: str
+    :return: The recovery count.
+    :rtype: int
+    """
+    parts = filebase.split('+')
+    return (int(parts[4]) if len(parts) > 4 else 0)
+
+
+def recovered_filebase(filebase):
+    """Return the file base of a queue file once it is recovered again.
+
+    :param filebase: The file base, i.e. the file name without its extension.
+    :type filebase: str
+    :return: The file base with its recovery count incremented.
+    :rtype: str
+    """
+    parts = filebase.split('+')[:4]
+    if len(parts) < 4:
+        # Older file bases get the default priority and fairness key.
+        when, digest, priority, key = parse_filebase(filebase)
+        parts = parts[:2] + [str(priority), key]
+    return '+'.join(parts + [str(recovery_count(filebase) + 1)])
+
+
+
+class QueueIndex:
+    """A time-ordered index of the .pck files in a queue directory slice."""
+
+    def __init__(self, directory, in_slice, refresh_interval=0, fair=False):
+        """Create an index.
+
+        :param directory: The queue directory to index.
+        :type directory: str
+        :param in_slice: Predicate which is passed the hex digest part of a
+            file base and returns whether the file belongs to this index's
+            slice of the queue.
+        :type in_slice: callable
+        :param refresh_interval: While the index still has files in it, the
+            directory is rescanned at most this often, in seconds.  When zero,
+            the directory is rescanned whenever it has changed.
+        :type refresh_interval: float
+        :param fair: When true, `head()` returns higher priority files first,
+            and within each priority takes turns between the fairness keys.
+            Otherwise, files are returned in FIFO order.
+        :type fair: bool
+        """
+        self._directory = directory
+        self._in_slice = in_slice
+        self._refresh_interval = refresh_interval
+        # A sorted list of (time, filebase) entries.  Entries are not removed
+        # from this list when their files go away; instead they are dropped
+        # from the _live dictionary, which maps file bases to the exact entry
+        # object that is current for them.  Dead entries are skipped and
+        # periodically compacted away.
+        self._entries = []
+        self._head = 0
+        self._live = {}
+        # File bases which belong to another slice.  Remembering these saves
+        # us from parsing their digests on every scan.
+        self._foreign = set()
+        self._mtime = None
+        self._scanned_at = None
+        # When the directory has to be scanned again even if its modification
+        # time hasn't changed; see RACY_WINDOW.
+        self._verify_at = None
+        # For fair scheduling, the entries are also kept in per-priority
+        # lanes.  Each lane is an ordered dictionary mapping the fairness keys
+        # to a sorted list of entries and the index of its first live entry.
+        # The order of the keys is the order in which they take turns.
+        self._fair = fair
+        self._lanes = {}
+        # The backup files of this slice seen by the last scan, i.e. the
+        # files which were being processed at the time.
+        self.backups = set()
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, filebase):
+        return filebase in self._live
+
+    def add(self, filebase):
+        """Add a file base to the index.
+
+        File bases which do not belong to this index's slice are ignored.
+
+        :param filebase: The file base, i.e. the file name without its
+            extension.
+        :type filebase: str
+        :return: True if the file base was added.
+        :rtype: bool
+        """
+        if filebase in self._live or filebase in self._foreign:
+            return False
+        entry = self._make_entry(filebase)
+        if entry is None:
+            return False
+        insort(self._entries, entry, self._head)
+        return True
+
+    def discard(self, filebase):
+        """Remove a file base from the index, if it is present."""
+        self._live.pop(filebase, None)
+
+    def _make_entry(self, filebase):
+        """Parse a file base and mark it live if it's in our slice."""
+        when, digest, priority, key = parse_filebase(filebase)
+        if not self._in_slice(digest):
+            self._foreign.add(filebase)
+            return None
+        entry = (when, filebase)
+        self._live[filebase] = entry
+        if self._fair:
+            lane = self._lanes.setdefault(priority, OrderedDict())
+            queue = lane.get(key)
+            if queue is None:
+                lane[key] = [[entry], 0]
+            else:
+                insort(queue[0], entry, queue[1])
+        return entry
+
+    def _is_live(self, entry):
+        return self._live.get(entry[1]) is entry
+
+    def _changed(self):
+        """Has the directory changed since the last scan?"""
+        mtime = directory_mtime(self._directory)
+        if mtime is None:
+            return False
+        if mtime != self._mtime:
+            return True
+        return self._verify_at is not None and time.time() >= self._verify_at
+
+    def absorb(self, before, after):
+        """Account for a change the caller made to the queue directory.
+
+        The caller keeps the index up to date about the files it adds and
+        removes, so its own changes to the directory don't need a rescan.  If
+        nobody else changed the directory since the last scan, the new
+        modification time is taken as already seen.
+
+        :param before: The modification time of the directory before the
+            change, as returned by `directory_mtime()`.
+        :type before: float
+        :param after: The modification time of the directory after the
+            change.
+        :type after: float
+        """
+        if (self._scanned_at is None or before is None or after is None or
+                before != self._mtime):
+            return
+        self._mtime = after
+        # Someone else could have changed the directory at the same time,
+        # within the same clock tick.  Don't postpone a pending check though,
+        # so that a busy queue still gets checked once in a while.
+        if self._verify_at is None:
+            self._verify_at = after + RACY_WINDOW
+
+    def refresh(self):
+        """Rescan the queue directory if necessary."""
+        if self._scanned_at is not None:
+            if (len(self._live) > 0 and
+                    time.time() - self._scanned_at < self._refresh_interval):
+                return
+            if not self._changed():
+                return
+        self.rescan()
+
+    def rescan(self):
+        """Reconcile the index with the contents of the queue directory."""
+        scanned_at = time.time()
+        mtime = directory_mtime(self._directory)
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            mtime = None
+            names = []
+        seen = set()
+        backups = set()
+        new_entries = []
+        for name in names:
+            # By ignoring anything that doesn't end in .pck, we ignore
+            # tempfiles and avoid a race condition.
+            filebase, ext = os.path.splitext(name)
+            if ext == '.bak':
+                if self._in_slice(parse_filebase(filebase)[1]):
+                    backups.add(filebase)
+                continue
+            elif ext != '.pck':
+                continue
+            seen.add(filebase)
+            if filebase in self._live or filebase in self._foreign:
+                continue
+            entry = self._make_entry(filebase)
+            if entry is not None:
+                new_entries.append(entry)
+        # Forget about the files which have gone away.
+        for filebase in set(self._live) - seen:
+            del self._live[filebase]
+        self._foreign &= seen
+        # Queue files are named after the time they were created, so new
+        # files almost always sort after everything we already know about.
+        new_entries.sort()
+        if len(self._entries) > 2 * len(self._live) + len(new_entries):
+            # There are many dead entries; rebuild the list from scratch.
+            self._entries = [entry for entry in self._entries[self._head:]
+                             if self._is_live(entry)]
+            self._head = 0
+        if (len(new_entries) == 0 or
+                len(self._entries) == 0 or
+                new_entries[0] >= self._entries[-1]):
+            self._entries.extend(new_entries)
+        else:
+            self._entries = list(merge(self._entries[self._head:],
+                                       new_entries))
+            self._head = 0
+        self.backups = backups
+        self._mtime = mtime
+        self._scanned_at = scanned_at
+        if mtime is not None and mtime >= scanned_at - RACY_WINDOW:
+            self._verify_at = mtime + RACY_WINDOW
+        else:
+            self._verify_at = None
+
+    def _skip_dead(self):
+        """Skip over the dead entries at the front of the list."""
+        entries = self._entries
+        while (self._head < len(entries) and
+               not self._is_live(entries[self._head])):
+            self._head += 1
+        if self._head > len(entries) // 2:
+            del entries[:self._head]
+            self._head = 0
+
+    def earliest(self):
+        """Return the time of the earliest file in the index.
+
+        :return: The time at which the earliest file is due, or None if the
+            index is empty.
+        :rtype: float or None
+        """
+        self._skip_dead()
+        if self._head == len(self._entries):
+            return None
+        return self._entries[self._head][0]
+
+    def head(self, count=None, until=None):
+        """Return the file bases which are next in line.
+
+        :param count: The maximum number of file bases to return, or None to
+            return all of them.
+        :type count: int or None
+        :param until: If given, only return the file bases which are due at
+            this time, in seconds since the epoch.
+        :type until: float or None
+        :return: The file bases, in FIFO order or, for fair scheduling, in
+            order of priority, taking turns between the fairness keys.
+        :rtype: list of str
+        """
+        if self._fair:
+            return self._fair_head(count, until)
+        self._skip_dead()
+        entries = self._entries
+        filebases = []
+        for index in range(self._head, len(entries)):
+            if count is not None and len(filebases) >= count:
+                break
+            entry = entries[index]
+            if until is not None and entry[0] > until:
+                # The entries are sorted, so none of the rest are due either.
+                break
+            if self._is_live(entry):
+                filebases.append(entry[1])
+        return filebases
+
+    def _fair_head(self, count, until):
+        filebases = []
+        for priority in sorted(self._lanes, reverse=True):
+            lane = self._lanes[priority]
+            # Find the first live entry for each key, dropping the keys which
+            # have nothing left.
+            cursors = []
+            for key in list(lane):
+                queue = lane[key]
+                entries, start = queue
+                while (start < len(entries) and
+                       not self._is_live(entries[start])):
+                    start += 1
+                if start == len(entries):
+                    del lane[key]
+                    continue
+                if start > len(entries) // 2:
+                    del entries[:start]
+                    start = 0
+                queue[1] = start
+                cursors.append([key, entries, start])
+            if len(lane) == 0:
+                del self._lanes[priority]
+            # Take one file per key in turn.
+            served = []
+            while (len(cursors) > 0 and
+                   (count is None or len(filebases) < count)):
+                for cursor in list(cursors):
+                    if count is not None and len(filebases) >= count:
+                        break
+                    key, entries, index = cursor
+                    while (index < len(entries) and
+                           not self._is_live(entries[index])):
+                        index += 1
+                    if (index == len(entries) or
+                            (until is not None and entries[index][0] > until)):
+                        cursors.remove(cursor)
+                        continue
+                    if index == lane[key][1]:
+                        served.append(key)
+                    filebases.append(entries[index][1])
+                    cursor[2] = index + 1
+            # The keys which were just served go to the back of the line, so
+            # that the others get the first turns next time.
+            for key in served:
+                lane.move_to_end(key)
+            if count is not None and len(filebases) >= count:
+                break
+        return filebases
@@ -0,0 +1,309 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Queue latency and throughput statistics.
+
+Every queue runner process counts the files it processes and shunts, and
+keeps histograms of how long files waited in the queue, how long they took to
+process, how old their messages were, and how many files it found on each
+pass through its queue.  The runner periodically saves its statistics in a
+file in the stats directory, named after the runner and its slice.  Anybody
+can then collect the statistics of all the running runners, e.g. to show them
+through the REST API.
+"""
+
+__all__ = [
+    'Histogram',
+    'RunnerStats',
+    'collect',
+    'render_text',
+    ]
+
+
+import os
+import json
+import bisect
+
+from mailman.utilities.filesystem import makedirs
+
+
+# The upper bounds of the histogram buckets for durations, in seconds.
+TIME_BUCKETS = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600,
+    14400, 86400)
+# The upper bounds of the histogram buckets for file counts.
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+
+class Histogram:
+    """A histogram with fixed buckets."""
+
+    def __init__(self, bounds):
+        """Create an empty histogram.
+
+        :param bounds: The increasing upper bounds of the buckets.  Values
+            greater than the last bound land in an extra, unbounded bucket.
+        :type bounds: sequence of numbers
+        """
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """Add a value to the histogram.
+
+        :param value: The value.
+        :type value: int or float
+        """
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Add the values of another histogram with the same buckets."""
+        if other.bounds != self.bounds:
+            raise ValueError('Histogram buckets differ')
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def cumulative(self):
+        """Return the number of values in each bucket or any lower one.
+
+        :return: (bound, count) pairs, in increasing order of bound.  The
+            bound of the unbounded bucket is None.
+        :rtype: list of 2-tuples
+        """
+        pairs = []
+        total = 0
+        for bound, count in zip(self.bounds + (None,), self.buckets):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def as_dict(self):
+        return dict(bounds=list(self.bounds), buckets=list(self.buckets),
+                    count=self.count, sum=self.sum)
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['bounds'])
+        if len(data['buckets']) != len(histogram.buckets):
+            raise ValueError('Bad histogram buckets')
+        histogram.buckets = list(data['buckets'])
+        histogram.count = data['count']
+        histogram.sum = data['sum']
+        return histogram
+
+
+
+class RunnerStats:
+    """The statistics of the runners of one queue."""
+
+    # The counters and their descriptions.
+    COUNTERS = dict(
+        processed='Queue files processed',
+        shunted='Messages shunted after processing failed',
+        passes='Passes through the queue',
+        )
+
+    # The histograms, their buckets and their descriptions.
+    HISTOGRAMS = dict(
+        dequeue_latency=(TIME_BUCKETS,
+                         'Seconds a file waited in the queue once it was due'),
+        dispose_time=(TIME_BUCKETS, 'Seconds spent processing a message'),
+        message_age=(TIME_BUCKETS,
+                     'Seconds since the message was first enqueued'),
+        files_per_pass=(COUNT_BUCKETS,
+                        'Files found on each pass through the queue'),
+        )
+
+    def __init__(self, name):
+        """Create empty statistics.
+
+        :param name: The name of the queue.
+        :type name: str
+        """
+        self.name = name
+        self.counters = {counter: 0 for counter in self.COUNTERS}
+        self.histograms = {
+            histogram: Histogram(bounds)
+            for histogram, (bounds, description) in self.HISTOGRAMS.items()
+            }
+
+    def count(self, counter, amount=1):
+        """Increment a counter.
+
+        :param counter: The name of the counter.
+        :type counter: str
+        :param amount: The amount to add to the counter.
+        :type amount: int
+        """
+        self.counters[counter] += amount
+
+    def observe(self, histogram, value):
+        """Add a value to a histogram.
+
+        :param histogram: The name of the histogram.
+        :type histogram: str
+        :param value: The value.
+        :type value: int or float
+        """
+        self.histograms[histogram].observe(value)
+
+    def merge(self, other):
+        """Add the statistics of another runner of the same queue."""
+        for counter, value in other.counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+        for name, histogram in other.histograms.items():
+            if name in self.histograms:
+                self.histograms[name].merge(histogram)
+            else:
+                self.histograms[name] = histogram
+
+    def as_dict(self):
+        """Return the statistics as a JSON compatible dictionary.
+
+        :return: The counters and histograms, by name.
+        :rtype: dict
+        """
+        data = dict(self.counters)
+        for name, histogram in self.histograms.items():
+            data[name] = histogram.as_dict()
+        return data
+
+    def save(self, path):
+        """Save the statistics, replacing the file atomically.
+
+        :param path: The path of the statistics file.
+        :type path: str
+        """
+        makedirs(os.path.dirname(path), 0o770)
+        data = dict(name=self.name,
+                    counters=self.counters,
+                    histograms={name: histogram.as_dict()
+                                for name, histogram
+                                in self.histograms.items()})
+        tmpfile = path + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump(data, fp)
+        os.rename(tmpfile, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load statistics saved by `save()`.
+
+        :param path: The path of the statistics file.
+        :type path: str
+        :return: The statistics.
+        :rtype: `RunnerStats`
+        :raises ValueError: when the file is corrupt.
+        """
+        with open(path) as fp:
+            data = json.load(fp)
+        try:
+            stats = cls(data['name'])
+            stats.counters.update(data['counters'])
+            for name, histogram in data['histograms'].items():
+                stats.histograms[name] = Histogram.from_dict(histogram)
+        except (KeyError, TypeError, AttributeError) as error:
+            raise ValueError('Bad statistics file: {}'.format(path)) from error
+        return stats
+
+
+
+def collect(directory):
+    """Collect the statistics saved by all the runners.
+
+    :param directory: The stats directory.
+    :type directory: str
+    :return: The combined statistics of the runners of each queue, by queue
+        name.
+    :rtype: dict
+    """
+    queues = {}
+    try:
+        filenames = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return queues
+    for filename in filenames:
+        if not filename.endswith('.json'):
+            continue
+        try:
+            stats = RunnerStats.load(os.path.join(directory, filename))
+        except (OSError, ValueError):
+            # The runner went away, or the file is corrupt.
+            continue
+        if stats.name in queues:
+            queues[stats.name].merge(stats)
+        else:
+            queues[stats.name] = stats
+    return queues
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text(depths, stats):
+    """Render queue statistics in the Prometheus text exposition format.
+
+    :param depths: The number of files in each queue and the age in seconds
+        of the oldest one, by queue name.
+    :type depths: dict of 2-tuples
+    :param stats: The statistics of each queue, as returned by `collect()`.
+    :type stats: dict
+    :return: The text.
+    :rtype: str
+    """
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append('# HELP mailman_queue_{} {}'.format(name, description))
+        lines.append('# TYPE mailman_queue_{} {}'.format(name, kind))
+        for suffix, labels, value in samples:
+            lines.append('mailman_queue_{}{}{{{}}} {}'.format(
+                name, suffix,
+                ','.join('{}="{}"'.format(*label) for label in labels),
+                _format(value)))
+    metric('depth', 'gauge', 'Files in the queue', [
+        ('', [('queue', name)], depths[name][0]) for name in sorted(depths)])
+    metric('oldest_age_seconds', 'gauge', 'Age of the oldest due file', [
+        ('', [('queue', name)], depths[name][1]) for name in sorted(depths)])
+    for counter, description in sorted(RunnerStats.COUNTERS.items()):
+        metric(counter + '_total', 'counter', description, [
+            ('', [('queue', name)], stats[name].counters.get(counter, 0))
+            for name in sorted(stats)])
+    for histogram, (bounds, description) in sorted(
+            RunnerStats.HISTOGRAMS.items()):
+        unit = ('_seconds' if bounds is TIME_BUCKETS else '')
+        samples = []
+        for name in sorted(stats):
+            values = stats[name].histograms.get(histogram)
+            if values is None:
+                continue
+            for bound, count in values.cumulative():
+                bound = ('+Inf' if bound is None else _format(bound))
+                samples.append(
+                    ('_bucket', [('queue', name), ('le', bound)], count))
+            samples.append(('_sum', [('queue', name)], values.sum))
+            samples.append(('_count', [('queue', name)], values.count))
+        metric(histogram + unit, 'histogram', description, samples)
+    return '\n'.join(lines) + '\n'
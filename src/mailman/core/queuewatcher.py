@@ -0,0 +1,161 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Wait for new files to show up in a queue directory.
+
+Switchboards enqueue a file by writing it under a temporary name and then
+renaming it to its final .pck name.  On Linux, an idle runner can ask the
+kernel (via inotify) to tell it about those renames, so it wakes up as soon
+as there is work to do instead of sleeping for its full sleep time.  Where
+inotify is not available, waiting falls back to plain sleeping.
+"""
+
+__all__ = [
+    'QueueWatcher',
+    ]
+
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+
+# From <sys/inotify.h>.
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+# The fixed size part of a struct inotify_event.
+EVENT_HEADER = struct.Struct('iIII')
+
+log = logging.getLogger('mailman.runner')
+
+
+
+def _load_libc():
+    """Return the C library if it supports inotify, otherwise None."""
+    library = ctypes.util.find_library('c')
+    if library is None:
+        return None
+    try:
+        libc = ctypes.CDLL(library, use_errno=True)
+        # Raise AttributeError if the functions don't exist.
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+
+class QueueWatcher:
+    """Wait for files to be enqueued into a queue directory."""
+
+    def __init__(self, directory):
+        """Start watching a queue directory.
+
+        :param directory: The queue directory to watch.
+        :type directory: str
+        """
+        self.directory = directory
+        self._fd = None
+        libc = _load_libc()
+        if libc is None:
+            return
+        # The inotify flags have the same values as the file flags.
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            log.info('Cannot watch %s, inotify error: %s',
+                     directory, os.strerror(ctypes.get_errno()))
+            return
+        watch = libc.inotify_add_watch(
+            fd, os.fsencode(directory), IN_MOVED_TO)
+        if watch < 0:
+            log.info('Cannot watch %s, inotify error: %s',
+                     directory, os.strerror(ctypes.get_errno()))
+            os.close(fd)
+            return
+        self._fd = fd
+
+    @property
+    def is_watching(self):
+        """Whether waiting is event driven rather than plain sleeping."""
+        return self._fd is not None
+
+    def _read_events(self):
+        """Drain the pending events.
+
+        :return: True if a queue file was enqueued or events were lost.
+        :rtype: bool
+        """
+        enqueued = False
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return enqueued
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(
+                    data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                    # Either events were lost or the directory went away.
+                    # Either way, the runner had better look for itself.
+                    enqueued = True
+                elif name.endswith(b'.pck'):
+                    enqueued = True
+
+    def wait(self, timeout):
+        """Wait until a file is enqueued or the timeout expires.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float
+        :return: True if a file was (possibly) enqueued, False if the
+            timeout expired.
+        :rtype: bool
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return False
+        deadline = time.time() + timeout
+        while True:
+            remaining = max(deadline - time.time(), 0)
+            readable, writable, exceptional = select.select(
+                [self._fd], [], [], remaining)
+            if not readable:
+                return False
+            # Our own renames of .pck files to .bak files generate events
+            # too; keep waiting unless a new queue file showed up.
+            if self._read_events():
+                return True
+            if remaining == 0:
+                return False
+
+    def close(self):
+        """Stop watching the queue directory."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -22,6 +22,7 @@ __all__ = [
     ]
 
 
+import os
 import time
 import signal
 import logging
@@ -32,7 +33,10 @@ from lazr.config import as_boolean, as_timedelta
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
-from mailman.core.switchboard import Switchboard
+from mailman.core.queueindex import parse_filebase
+from mailman.core.queuestats import RunnerStats
+from mailman.core.queuewatcher import QueueWatcher
+from mailman.core.switchboard import GroupCommit, Switchboard
 from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.runner import IRunner, RunnerCrashEvent
@@ -52,29 +56,67 @@ rlog = logging.getLogger('mailman.runner')
 class Runner:
     is_queue_runner = True
 
-    def __init__(self, name, slice=None):
+    def __init__(self, name, slice=None, numslices=None):
         """Create a runner.
 
         :param slice: The slice number for this runner.  This is passed
             directly to the underlying `ISwitchboard` object.  This is ignored
             for runners that don't manage a queue.
         :type slice: int or None
+        :param numslices: The number of slices the queue is split into.  If
+            not given, this is the number of instances configured for the
+            runner.
+        :type numslices: int or None
         """
         # Grab the configuration section.
         self.name = name
         section = getattr(config, 'runner.' + name)
         substitutions = config.paths
         substitutions['name'] = name
-        numslices = int(section.instances)
+        if numslices is None:
+            numslices = int(section.instances)
+        # The maximum number of files to process in one pass through the main
+        # loop.  Zero means all the files in our slice.
+        self.max_files_per_pass = int(section.max_files_per_pass)
+        # Whether the files enqueued while processing one queue file are
+        # synced to disk together.
+        self.group_commit = as_boolean(section.group_commit)
+        # Whether to help out with the other slices of the queue when there's
+        # nothing to do in our own.  The files we take on are claimed for a
+        # while, so that their owner doesn't recover them under our feet.
+        self.steal_work = as_boolean(section.steal_work)
+        claim_lease = (as_timedelta(section.claim_lease).total_seconds()
+                       if self.steal_work else 0)
+        # The maximum number of queue files, and the time in seconds, to
+        # spend in one database transaction.
+        self.batch_size = int(section.batch_size)
+        self.batch_time = as_timedelta(section.batch_time).total_seconds()
+        self._batching = False
+        # The statistics of the work done by this runner, and how often in
+        # seconds they are saved in the stats directory.
+        self.stats = RunnerStats(name)
+        self.stats_interval = as_timedelta(
+            section.stats_interval).total_seconds()
+        self._stats_file = os.path.join(config.STATS_DIR, '{}.{}.json'.format(
+            name, (0 if slice is None else slice)))
+        self._stats_saved = None
         # Check whether the runner is queue runner or not; non-queue runner
         # should not have queue_directory or switchboard instance.
         if self.is_queue_runner:
             self.queue_directory = expand(section.path, substitutions)
             self.switchboard = Switchboard(
-                name, self.queue_directory, slice, numslices, True)
+                name, self.queue_directory, slice, numslices, True,
+                as_timedelta(section.index_refresh).total_seconds(),
+                section.scheduling, int(section.priority), self.steal_work,
+                claim_lease)
         else:
             self.queue_directory = None
             self.switchboard= None
+        # When there's nothing to do, queue runners can wait for new files to
+        # show up in their queue directory instead of sleeping blindly.
+        self._watcher = None
+        if self.is_queue_runner and as_boolean(section.watch_queue):
+            self._watcher = QueueWatcher(self.queue_directory)
         self.sleep_time = as_timedelta(section.sleep_time)
         # sleep_time is a timedelta; turn it into a float for time.sleep().
         self.sleep_float = (86400 * self.sleep_time.days +
@@ -139,71 +181,189 @@ class Runner:
         """See `IRunner`."""
         me = self.__class__.__name__
         dlog.debug('[%s] starting oneloop', me)
-        # List all the files in our queue directory.  The switchboard is
-        # guaranteed to hand us the files in FIFO order.
-        files = self.switchboard.files
-        for filebase in files:
-            dlog.debug('[%s] processing filebase: %s', me, filebase)
-            try:
-                # Ask the switchboard for the message and metadata objects
-                # associated with this queue file.
-                msg, msgdata = self.switchboard.dequeue(filebase)
-            except Exception as error:
-                # This used to just catch email.Errors.MessageParseError, but
-                # other problems can occur in message parsing, e.g.
-                # ValueError, and exceptions can occur in unpickling too.  We
-                # don't want the runner to die, so we just log and skip this
-                # entry, but preserve it for analysis.
-                self._log(error)
-                elog.error('Skipping and preserving unparseable message: %s',
-                           filebase)
-                self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
-                continue
-            try:
-                dlog.debug('[%s] processing onefile', me)
+        # List the files in our queue directory which are due.  The
+        # switchboard hands us the files in its scheduling order.
+        files = self.switchboard.get_files(
+            count=(self.max_files_per_pass or None), until=time.time())
+        self.stats.count('passes')
+        self.stats.observe('files_per_pass', len(files))
+        if self.batch_size > 1:
+            # Process the files in batches, each in one transaction.
+            position = 0
+            while position < len(files):
+                position += self._process_batch(
+                    files[position:position + self.batch_size])
+                dlog.debug('[%s] checking short circuit', me)
+                if self._short_circuit():
+                    dlog.debug('[%s] short circuiting', me)
+                    break
+        else:
+            for filebase in files:
+                self._process_queue_file(filebase)
+                # Other work we want to do each time through the loop.
+                dlog.debug('[%s] doing periodic', me)
+                self._do_periodic()
+                dlog.debug('[%s] committing transaction', me)
+                config.db.commit()
+                dlog.debug('[%s] checking short circuit', me)
+                if self._short_circuit():
+                    dlog.debug('[%s] short circuiting', me)
+                    break
+        if len(files) == 0 and self.steal_work:
+            # Pick up the files in our slice which were claimed by another
+            # runner that has since gone away.
+            self.switchboard.recover_backup_files()
+        self._save_stats()
+        dlog.debug('[%s] ending oneloop: %s', me, len(files))
+        return len(files)
+
+    def _process_queue_file(self, filebase):
+        """Process one queue file and finish it.
+
+        If processing the message fails, the message is shunted and the
+        database transaction is aborted.  Otherwise, the transaction is left
+        for the caller to commit.
+
+        :param filebase: The base name of the queue file.
+        :type filebase: str
+        """
+        me = self.__class__.__name__
+        dlog.debug('[%s] processing filebase: %s', me, filebase)
+        try:
+            # Ask the switchboard for the message and metadata objects
+            # associated with this queue file.
+            msg, msgdata = self.switchboard.dequeue(filebase)
+        except FileNotFoundError:
+            # The file went away after the switchboard last scanned the
+            # queue directory, e.g. because it was deleted through the
+            # REST API.  There's nothing left to do with it.
+            dlog.debug('[%s] vanished filebase: %s', me, filebase)
+            return
+        except Exception as error:
+            # This used to just catch email.Errors.MessageParseError, but
+            # other problems can occur in message parsing, e.g.
+            # ValueError, and exceptions can occur in unpickling too.  We
+            # don't want the runner to die, so we just log and skip this
+            # entry, but preserve it for analysis.
+            self._log(error)
+            elog.error('Skipping and preserving unparseable message: %s',
+                       filebase)
+            self.switchboard.finish(filebase, preserve=True)
+            config.db.abort()
+            return
+        self._record_dequeue(filebase, msg)
+        try:
+            dlog.debug('[%s] processing onefile', me)
+            if self.group_commit:
+                with GroupCommit():
+                    self._process_one_file(msg, msgdata)
+            else:
                 self._process_one_file(msg, msgdata)
-                dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            self.switchboard.finish(filebase)
+            self.stats.count('processed')
+        except Exception as error:
+            # All runners that implement _dispose() must guarantee that
+            # exceptions are caught and dealt with properly.  Still, there
+            # may be a bug in the infrastructure, and we do not want those
+            # to cause messages to be lost.  Any uncaught exceptions will
+            # cause the message to be stored in the shunt queue for human
+            # intervention.
+            self._log(error)
+            # Put a marker in the metadata for unshunting.
+            msgdata['whichq'] = self.switchboard.name
+            # It is possible that shunting can throw an exception, e.g. a
+            # permissions problem or a MemoryError due to a really large
+            # message.  Try to be graceful.
+            try:
+                shunt = config.switchboards['shunt']
+                new_filebase = shunt.enqueue(msg, msgdata)
+                elog.error('SHUNTING: %s', new_filebase)
+                self.stats.count('shunted')
                 self.switchboard.finish(filebase)
             except Exception as error:
-                # All runners that implement _dispose() must guarantee that
-                # exceptions are caught and dealt with properly.  Still, there
-                # may be a bug in the infrastructure, and we do not want those
-                # to cause messages to be lost.  Any uncaught exceptions will
-                # cause the message to be stored in the shunt queue for human
-                # intervention.
+                # The message wasn't successfully shunted.  Log the
+                # exception and try to preserve the original queue entry
+                # for possible analysis.
                 self._log(error)
-                # Put a marker in the metadata for unshunting.
-                msgdata['whichq'] = self.switchboard.name
-                # It is possible that shunting can throw an exception, e.g. a
-                # permissions problem or a MemoryError due to a really large
-                # message.  Try to be graceful.
+                elog.error(
+                    'SHUNTING FAILED, preserving original entry: %s',
+                    filebase)
+                self.switchboard.finish(filebase, preserve=True)
+            config.db.abort()
+
+    def _process_batch(self, files):
+        """Process several queue files in one database transaction.
+
+        The queue files enqueued while processing the batch only show up once
+        the whole batch has succeeded.  If processing any of the messages
+        fails, the whole batch is rolled back and its files are processed
+        again one at a time, so that the failing message is shunted on its
+        own.
+
+        :param files: The base names of the queue files to process.  Fewer
+            files are processed if the batch runs out of time.
+        :type files: list of str
+        :return: The number of files which were processed.
+        :rtype: int
+        """
+        me = self.__class__.__name__
+        deadline = time.time() + self.batch_time
+        dequeued = []
+        count = 0
+        group_commit = GroupCommit()
+        self._batching = True
+        try:
+            with group_commit:
                 try:
-                    shunt = config.switchboards['shunt']
-                    new_filebase = shunt.enqueue(msg, msgdata)
-                    elog.error('SHUNTING: %s', new_filebase)
-                    self.switchboard.finish(filebase)
-                except Exception as error:
-                    # The message wasn't successfully shunted.  Log the
-                    # exception and try to preserve the original queue entry
-                    # for possible analysis.
-                    self._log(error)
-                    elog.error(
-                        'SHUNTING FAILED, preserving original entry: %s',
-                        filebase)
-                    self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
-            # Other work we want to do each time through the loop.
-            dlog.debug('[%s] doing periodic', me)
-            self._do_periodic()
-            dlog.debug('[%s] committing transaction', me)
-            config.db.commit()
-            dlog.debug('[%s] checking short circuit', me)
-            if self._short_circuit():
-                dlog.debug('[%s] short circuiting', me)
-                break
-        dlog.debug('[%s] ending oneloop: %s', me, len(files))
-        return len(files)
+                    for filebase in files:
+                        if count > 0 and time.time() > deadline:
+                            break
+                        count += 1
+                        dlog.debug('[%s] processing filebase: %s',
+                                   me, filebase)
+                        try:
+                            msg, msgdata = self.switchboard.dequeue(filebase)
+                        except FileNotFoundError:
+                            dlog.debug('[%s] vanished filebase: %s',
+                                       me, filebase)
+                            continue
+                        except Exception as error:
+                            self._log(error)
+                            elog.error(
+                                'Skipping and preserving unparseable '
+                                'message: %s', filebase)
+                            self.switchboard.finish(filebase, preserve=True)
+                            continue
+                        dequeued.append(filebase)
+                        self._record_dequeue(filebase, msg)
+                        self._process_one_file(msg, msgdata)
+                except Exception:
+                    # Throw away everything the batch enqueued.
+                    group_commit.discard()
+                    raise
+        except Exception as error:
+            self._batching = False
+            config.db.abort()
+            elog.error('Batch of %d files failed, processing them one at a '
+                       'time: %s', len(dequeued), error)
+            for filebase in dequeued:
+                self.switchboard.restore(filebase)
+            for filebase in dequeued:
+                self._process_queue_file(filebase)
+                self._do_periodic()
+                config.db.commit()
+            return count
+        self._batching = False
+        for filebase in dequeued:
+            dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            self.switchboard.finish(filebase)
+            self.stats.count('processed')
+        dlog.debug('[%s] doing periodic', me)
+        self._do_periodic()
+        dlog.debug('[%s] committing transaction', me)
+        config.db.commit()
+        return count
 
     def _process_one_file(self, msg, msgdata):
         """See `IRunner`."""
@@ -235,6 +395,7 @@ class Runner:
                 '%s runner "%s" shunting message for missing list: %s',
                 msg['message-id'], self.name, identifier)
             config.switchboards['shunt'].enqueue(msg, msgdata)
+            self.stats.count('shunted')
             return
         # Now process this message.  We also want to set up the language
         # context for this message.  The context will be the preferred
@@ -254,15 +415,57 @@ class Runner:
             language = mlist.preferred_language
         with _.using(language.code):
             msgdata['lang'] = language.code
+            start = time.time()
             try:
                 keepqueued = self._dispose(mlist, msg, msgdata)
             except Exception as error:
-                # Trigger the Zope event and re-raise
-                notify(RunnerCrashEvent(self, mlist, msg, msgdata, error))
+                # Trigger the Zope event and re-raise.  When processing a
+                # batch, the message is processed again on its own, and the
+                # event is triggered then.
+                if not self._batching:
+                    notify(RunnerCrashEvent(self, mlist, msg, msgdata, error))
                 raise
+            finally:
+                self.stats.observe('dispose_time', time.time() - start)
         if keepqueued:
             self.switchboard.enqueue(msg, msgdata)
 
+    def _record_dequeue(self, filebase, msg):
+        """Record how long a dequeued file waited, and how old its message is.
+
+        :param filebase: The base name of the queue file.
+        :type filebase: str
+        :param msg: The dequeued message.
+        :type msg: `Message`
+        """
+        now = time.time()
+        when = parse_filebase(filebase)[0]
+        self.stats.observe('dequeue_latency', max(0, now - when))
+        # The switchboards stamp each message with the queues it passed
+        # through, and when.
+        hops = getattr(msg, 'queue_hops', None)
+        if hops:
+            self.stats.observe('message_age', max(0, now - hops[0][1]))
+
+    def _save_stats(self, force=False):
+        """Save the statistics if they haven't been saved for a while.
+
+        :param force: Save the statistics even if they were saved recently.
+        :type force: bool
+        """
+        if not self.is_queue_runner or self.stats_interval <= 0:
+            return
+        now = time.time()
+        if (not force and self._stats_saved is not None and
+                now - self._stats_saved < self.stats_interval):
+            return
+        try:
+            self.stats.save(self._stats_file)
+        except OSError as error:
+            elog.error('Cannot save %s runner statistics: %s',
+                       self.name, error)
+        self._stats_saved = now
+
     def _log(self, exc):
         elog.error('Uncaught runner exception: %s', exc)
         s = StringIO()
@@ -271,7 +474,13 @@ class Runner:
 
     def _clean_up(self):
         """See `IRunner`."""
-        pass
+        if self._watcher is not None:
+            self._watcher.close()
+        # Our statistics go away with us.
+        try:
+            os.remove(self._stats_file)
+        except FileNotFoundError:
+            pass
 
     def _dispose(self, mlist, msg, msgdata):
         """See `IRunner`."""
@@ -285,7 +494,17 @@ class Runner:
         """See `IRunner`."""
         if filecnt or self.sleep_float <= 0:
             return
-        time.sleep(self.sleep_float)
+        timeout = self.sleep_float
+        if self.is_queue_runner:
+            # Don't sleep past the time the next deferred file becomes due.
+            due = self.switchboard.next_due()
+            if due is not None:
+                timeout = max(0, min(timeout, due - time.time()))
+        if self._watcher is None:
+            time.sleep(timeout)
+        else:
+            # Sleep, but wake up early if a file gets enqueued.
+            self._watcher.wait(timeout)
 
     def _short_circuit(self):
         """See `IRunner`."""
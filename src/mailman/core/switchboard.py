@@ -15,16 +15,16 @@
 # You should have received a copy of the GNU General Public License along with
 # GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Queuing and dequeuing message/metadata pickle files.
+"""Queuing and dequeuing message/metadata files.
 
 Messages are represented as email.message.Message objects (or an instance ofa
 subclass).  Metadata is represented as a Python dictionary.  For every
-message/metadata pair in a queue, a single file containing two pickles is
-written.  First, the message is written to the pickle, then the metadata
-dictionary is written.
+message/metadata pair in a queue, a single file containing both is written.
+See `mailman.core.queuefile` for the format of these files.
 """
 
 __all__ = [
+    'GroupCommit',
     'Switchboard',
     'handle_ConfigurationUpdatedEvent',
     ]
@@ -32,16 +32,25 @@ __all__ = [
 
 import os
 import time
-import email
-import pickle
 import hashlib
 import logging
+import threading
 
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from lazr.config import as_timedelta
 from mailman.config import config
-from mailman.email.message import Message
+from mailman.core import queuefile
+from mailman.core.blobstore import BlobStore
+from mailman.core.queueindex import (
+    QueueIndex, directory_mtime, parse_filebase, recovered_filebase,
+    recovery_count)
 from mailman.interfaces.configuration import ConfigurationUpdatedEvent
 from mailman.interfaces.switchboard import ISwitchboard
-from mailman.utilities.filesystem import makedirs
+from mailman.utilities.filesystem import (
+    fsync_directory, makedirs, sync_filesystem)
+from mailman.utilities.recipients import CompactRecipients
 from mailman.utilities.string import expand
 from zope.interface import implementer
 
@@ -56,9 +65,117 @@ DELTA = .0001
 # In order to prevent loops and a message flood, when the count reaches this
 # value, we move the file to the bad queue as a .psv.
 MAX_BAK_COUNT = 3
+# The number of queue hops remembered in a message's hop history.
+MAX_HOPS = 10
+# The extension of the files in which the progress made with a queue file is
+# checkpointed.
+CHECKPOINT_EXTENSION = '.dlv'
 
 elog = logging.getLogger('mailman.error')
 
+# Tracks the active group commit, if any.
+_state = threading.local()
+
+
+
+class GroupCommit:
+    """Write several queue files, syncing them to disk only once.
+
+    Inside this context manager, `Switchboard.enqueue()` writes its queue
+    files under their temporary names without syncing each of them.  When the
+    outermost context exits, the contents of all the files are flushed to disk
+    together, the files are renamed to their final names, and the affected
+    queue directories are synced.  As with individual enqueues, a queue file
+    only becomes visible to the runners once its contents are on disk.
+    Nested contexts join the outermost one.
+    """
+
+    def __init__(self):
+        self._files = []
+        self._outermost = False
+
+    @staticmethod
+    def current():
+        """Return the active group commit, or None."""
+        return getattr(_state, 'group_commit', None)
+
+    def __enter__(self):
+        if self.current() is None:
+            _state.group_commit = self
+            self._outermost = True
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._outermost:
+            _state.group_commit = None
+            self._outermost = False
+            # Files which were enqueued before an exception occurred are
+            # still committed, just as they would have been without the group
+            # commit.
+            self.commit()
+        # Do not suppress exceptions.
+        return False
+
+    def add(self, switchboard, filebase, tmpfile, filename):
+        """Add a written, but not yet synced, queue file to the group."""
+        self._files.append((switchboard, filebase, tmpfile, filename))
+
+    @staticmethod
+    def _remove(files):
+        for switchboard, filebase, tmpfile, filename in files:
+            try:
+                with open(tmpfile, 'rb') as fp:
+                    reference = queuefile.blob_reference(fp)
+                with switchboard._changing():
+                    os.unlink(tmpfile)
+            except FileNotFoundError:
+                continue
+            if reference is not None:
+                switchboard._blobs.release(reference)
+
+    def discard(self):
+        """Throw away all the pending queue files."""
+        files, self._files = self._files, []
+        self._remove(files)
+
+    def commit(self):
+        """Sync and rename all the pending queue files."""
+        files, self._files = self._files, []
+        if len(files) == 0:
+            return
+        directories = set(os.path.dirname(filename)
+                          for switchboard, filebase, tmpfile, filename
+                          in files)
+        renamed = 0
+        try:
+            # Flush the file contents with one call per file system.  That
+            # also flushes everything else written to the file system, which
+            # is why group commits are optional.
+            devices = {}
+            for directory in directories:
+                devices.setdefault(os.stat(directory).st_dev, directory)
+            synced = all(sync_filesystem(directory)
+                         for directory in devices.values())
+            if not synced:
+                # Without support for that, sync the files one by one, as
+                # enqueue() would have done.
+                for switchboard, filebase, tmpfile, filename in files:
+                    with open(tmpfile, 'rb') as fp:
+                        os.fsync(fp.fileno())
+            for switchboard, filebase, tmpfile, filename in files:
+                with switchboard._changing():
+                    os.rename(tmpfile, filename)
+                renamed += 1
+                switchboard._add(filebase)
+            if synced:
+                for directory in directories:
+                    fsync_directory(directory)
+        except:
+            # The files which weren't renamed yet never become visible, so
+            # don't leave them lying around.
+            self._remove(files[renamed:])
+            raise
+
 
 
 @implementer(ISwitchboard)
@@ -66,7 +183,9 @@ class Switchboard:
     """See `ISwitchboard`."""
 
     def __init__(self, name, queue_directory,
-                 slice=None, numslices=1, recover=False):
+                 slice=None, numslices=1, recover=False, refresh_interval=0,
+                 scheduling='fifo', priority=0, steal_work=False,
+                 claim_lease=0):
         """Create a switchboard object.
 
         :param name: The queue name.
@@ -81,21 +200,79 @@ class Switchboard:
         :type numslices: int
         :param recover: True if backup files should be recovered.
         :type recover: bool
+        :param refresh_interval: How often, in seconds, the queue directory
+            is rescanned for files queued by other processes while this
+            switchboard still knows about files to process.  When zero, the
+            directory is rescanned whenever it has changed.
+        :type refresh_interval: float
+        :param scheduling: The order in which `get_files()` returns the queue
+            files.  `fifo` returns them in the order they were enqueued.
+            `fair` returns higher priority files first, and within each
+            priority takes turns between the mailing lists.
+        :type scheduling: str
+        :param priority: The priority given to enqueued messages which don't
+            already have one.
+        :type priority: int
+        :param steal_work: When true and there is nothing to do in this
+            switchboard's slice, `get_files()` returns some of the files from
+            the other slices.  The files are claimed by `dequeue()`, so each
+            file is still processed only once.
+        :type steal_work: bool
+        :param claim_lease: How long, in seconds, a dequeued file stays
+            claimed.  Backup files are only recovered once their claim has
+            expired, so that files claimed by other processes are left alone.
+            When zero, backup files are always recovered.
+        :type claim_lease: float
         """
         assert (numslices & (numslices - 1)) == 0, (
             'Not a power of 2: {0}'.format(numslices))
+        if scheduling not in ('fifo', 'fair'):
+            raise ValueError('Unknown scheduling: {}'.format(scheduling))
         self.name = name
         self.queue_directory = queue_directory
+        self.priority = priority
         # If configured to, create the directory if it doesn't yet exist.
         if config.create_paths:
             makedirs(self.queue_directory, 0o770)
+        self.claim_lease = claim_lease
         # Fast track for no slices
         self._lower = None
         self._upper = None
-        # BAW: test performance and end-cases of this algorithm
+        # The slice boundaries must be computed with integer arithmetic;
+        # floats can't represent 160 bit digests exactly.
         if numslices != 1:
-            self._lower = ((shamax + 1) * slice) / numslices
-            self._upper = (((shamax + 1) * (slice + 1)) / numslices) - 1
+            self._lower = ((shamax + 1) * slice) // numslices
+            self._upper = (((shamax + 1) * (slice + 1)) // numslices) - 1
+        self._index = QueueIndex(
+            self.queue_directory, self._in_slice, refresh_interval,
+            fair=(scheduling == 'fair'))
+        # Files in the other slices, which we can help out with when there's
+        # nothing to do in our own slice.
+        self._others = None
+        # The files from the other slices picked to help out with, and when
+        # they were picked.  Picking them takes a look at all the files in the
+        # other slices, so the same files are handed out until they are all
+        # gone, or until the index would be refreshed anyway.
+        self._stolen = deque()
+        self._stolen_at = None
+        self._steal_interval = refresh_interval
+        if steal_work and self._lower is not None:
+            self._others = QueueIndex(
+                self.queue_directory,
+                (lambda digest: not self._in_slice(digest)),
+                refresh_interval, fair=(scheduling == 'fair'))
+        self._blobs = BlobStore(config.BLOB_DIR)
+        # The references to the message bodies in the blob store of the files
+        # dequeued by this switchboard, or None for the bodies kept in the
+        # files themselves, so that finishing a file doesn't have to read it
+        # again.
+        self._blob_references = {}
+        # The files claimed by this switchboard which are still being
+        # processed.  While there are any, a thread renews their claims, so
+        # that they don't expire however long the processing takes.
+        self._claims = set()
+        self._claims_lock = threading.Lock()
+        self._renewer = None
         if recover:
             self.recover_backup_files()
 
@@ -109,24 +286,32 @@ class Switchboard:
         data = _metadata.copy()
         data.update(_kws)
         list_id = data.get('listid', '--nolist--')
-        # Get some data for the input to the sha hash.
-        now = repr(time.time())
-        if data.get('_plaintext'):
-            protocol = 0
-            msgsave = pickle.dumps(str(_msg), protocol)
-        else:
-            protocol = pickle.HIGHEST_PROTOCOL
-            msgsave = pickle.dumps(_msg, protocol)
-        # The list-id field is a string but the input to the hash function must
-        # be bytes.
-        hashfood = msgsave + list_id.encode('utf-8') + now.encode('utf-8')
-        # Encode the current time into the file name for FIFO sorting.  The
-        # file name consists of two parts separated by a '+': the received
-        # time for this message (i.e. when it first showed up on this system)
-        # and the sha hex digest.
-        filebase = now + '+' + hashlib.sha1(hashfood).hexdigest()
-        filename = os.path.join(self.queue_directory, filebase + '.pck')
-        tmpfile = filename + '.tmp'
+        # The message keeps its priority as it moves from queue to queue.
+        # Only record non-default priorities.
+        priority = int(data.get('priority', self.priority))
+        if priority != 0:
+            data['priority'] = priority
+        # Big sets of recipients are stored compactly.  They stay that way
+        # from queue to queue, until they are delivered to.
+        recipients = data.get('recipients')
+        threshold = int(config.mailman.compact_recipients_threshold)
+        if (threshold > 0 and recipients is not None and
+                not isinstance(recipients, CompactRecipients) and
+                len(recipients) >= threshold):
+            data['recipients'] = CompactRecipients(recipients)
+        # Get some data for the input to the sha hash.  Messages which are
+        # not to be delivered yet are named after the time they become due, so
+        # that they are left alone until then.
+        when = time.time()
+        deliver_after = data.get('deliver_after')
+        if deliver_after is not None:
+            # Avoid circular imports.
+            from mailman.utilities.datetime import now as right_now
+            delay = (deliver_after - right_now()).total_seconds()
+            if delay > 0:
+                when += delay
+        now = repr(when)
+        plaintext = bool(data.get('_plaintext'))
         # Always add the metadata schema version number
         data['version'] = config.QFILE_SCHEMA_VERSION
         # Filter out volatile entries.  Use .keys() so that we can mutate the
@@ -134,20 +319,62 @@ class Switchboard:
         for k in list(data):
             if k.startswith('_'):
                 del data[k]
-        # We have to tell the dequeue() method whether to parse the message
-        # object or not.
-        data['_parsemsg'] = (protocol == 0)
-        # Write to the pickle file the message object and metadata.
-        with open(tmpfile, 'wb') as fp:
-            fp.write(msgsave)
-            pickle.dump(data, fp, protocol)
+        # Record whether the message was enqueued as plain text.
+        data['_parsemsg'] = plaintext
+        # Stamp the message with the queues it passed through, and when, for
+        # the runners' statistics.  The first hop is always kept, so that the
+        # age of the message can be told.  The caller's message object is
+        # left alone, since it may be enqueued elsewhere too.
+        hops = getattr(_msg, 'queue_hops', None)
+        stamped = list(hops or [])
+        stamped.append([self.name, time.time()])
+        if len(stamped) > MAX_HOPS:
+            del stamped[1:len(stamped) - MAX_HOPS + 1]
+        _msg.queue_hops = stamped
+        try:
+            filedata = queuefile.dumps(
+                _msg, data, plaintext,
+                self._blobs, int(config.mailman.blob_threshold))
+        finally:
+            if hops is None:
+                del _msg.queue_hops
+            else:
+                _msg.queue_hops = hops
+        # The list-id field is a string but the input to the hash function must
+        # be bytes.
+        hashfood = filedata + list_id.encode('utf-8') + now.encode('utf-8')
+        # Encode the current time into the file name for FIFO sorting.  The
+        # file name consists of four parts separated by a '+': the time the
+        # message is due (normally when it was enqueued), the sha hex digest,
+        # the priority, and a key identifying the mailing list for fair
+        # scheduling.
+        list_key = hashlib.sha1(list_id.encode('utf-8')).hexdigest()[:8]
+        filebase = '+'.join((now, hashlib.sha1(hashfood).hexdigest(),
+                             str(priority), list_key))
+        filename = os.path.join(self.queue_directory, filebase + '.pck')
+        tmpfile = filename + '.tmp'
+        # Write the queue file.  Inside a group commit, syncing and renaming
+        # the file is deferred until the whole group is committed.
+        group_commit = GroupCommit.current()
+        with self._changing(), open(tmpfile, 'wb') as fp:
+            fp.write(filedata)
             fp.flush()
-            os.fsync(fp.fileno())
-        os.rename(tmpfile, filename)
+            if group_commit is None:
+                os.fsync(fp.fileno())
+        if group_commit is None:
+            with self._changing():
+                os.rename(tmpfile, filename)
+            self._add(filebase)
+        else:
+            group_commit.add(self, filebase, tmpfile, filename)
         return filebase
 
     def dequeue(self, filebase):
         """See `ISwitchboard`."""
+        # Whether or not the file can be read, it is no longer queued.
+        self._index.discard(filebase)
+        if self._others is not None:
+            self._others.discard(filebase)
         # Calculate the filename from the given filebase.
         filename = os.path.join(self.queue_directory, filebase + '.pck')
         backfile = os.path.join(self.queue_directory, filebase + '.bak')
@@ -155,102 +382,273 @@ class Switchboard:
         with open(filename, 'rb') as fp:
             # Move the file to the backup file name for processing.  If this
             # process crashes uncleanly the .bak file will be used to
-            # re-instate the .pck file in order to try again.
-            os.rename(filename, backfile)
-            msg = pickle.load(fp)
-            data = pickle.load(fp)
-        if data.get('_parsemsg'):
-            # Calculate the original size of the text now so that we won't
-            # have to generate the message later when we do size restriction
-            # checking.
-            original_size = len(msg)
-            msg = email.message_from_string(msg, Message)
-            msg.original_size = original_size
-            data['original_size'] = original_size
-        return msg, data
+            # re-instate the .pck file in order to try again.  The rename also
+            # claims the file; if another process got to it first, this raises
+            # a FileNotFoundError.
+            with self._changing():
+                os.rename(filename, backfile)
+            if self._in_slice(parse_filebase(filebase)[1]):
+                self._index.backups.add(filebase)
+            if self.claim_lease > 0:
+                # The modification time of the backup file records when the
+                # claim expires.
+                expires = time.time() + self.claim_lease
+                os.utime(backfile, (expires, expires))
+                self._claim(filebase)
+            reference = queuefile.blob_reference(fp)
+            fp.seek(0)
+            msg, msgdata = queuefile.load(fp, self._blobs)
+        self._blob_references[filebase] = reference
+        # The number of times the file was recovered is kept in its name.
+        # Files recovered by older versions keep the count in their metadata.
+        count = recovery_count(filebase)
+        if count > 0:
+            msgdata['_bak_count'] = msgdata.get('_bak_count', 0) + count
+        msgdata['_checkpoint'] = self._checkpoint_file(filebase)
+        return msg, msgdata
+
+    def _claim(self, filebase):
+        with self._claims_lock:
+            self._claims.add(filebase)
+            if self._renewer is None:
+                self._renewer = threading.Thread(
+                    target=self._renew_claims, daemon=True,
+                    name='claims-{}'.format(self.name))
+                self._renewer.start()
+
+    def _release(self, filebase):
+        with self._claims_lock:
+            self._claims.discard(filebase)
+
+    def _renew_claims(self):
+        """Keep the claims on the files being processed from expiring."""
+        while True:
+            time.sleep(self.claim_lease / 3)
+            with self._claims_lock:
+                if len(self._claims) == 0:
+                    self._renewer = None
+                    return
+                claims = list(self._claims)
+            expires = time.time() + self.claim_lease
+            for filebase in claims:
+                backfile = os.path.join(
+                    self.queue_directory, filebase + '.bak')
+                try:
+                    os.utime(backfile, (expires, expires))
+                except FileNotFoundError:
+                    # The file was finished in the meantime.
+                    pass
+
+    def _add(self, filebase):
+        # Files in the other slices are picked up by the index of the other
+        # slices.
+        self._index.add(filebase)
+        if self._others is not None:
+            self._others.add(filebase)
+
+    @contextmanager
+    def _changing(self):
+        """Change the queue directory without making the indexes rescan it.
+
+        The indexes are told about the files we add and remove, so only
+        changes made by others need a rescan.
+        """
+        before = directory_mtime(self.queue_directory)
+        try:
+            yield
+        finally:
+            after = directory_mtime(self.queue_directory)
+            self._index.absorb(before, after)
+            if self._others is not None:
+                self._others.absorb(before, after)
+
+    def _checkpoint_file(self, filebase):
+        # The digest stays the same when the file is recovered.
+        digest = parse_filebase(filebase)[1]
+        return os.path.join(
+            self.queue_directory, digest + CHECKPOINT_EXTENSION)
+
+    def restore(self, filebase):
+        """See `ISwitchboard`."""
+        bakfile = os.path.join(self.queue_directory, filebase + '.bak')
+        pckfile = os.path.join(self.queue_directory, filebase + '.pck')
+        with self._changing():
+            os.rename(bakfile, pckfile)
+        self._index.backups.discard(filebase)
+        self._release(filebase)
+        self._blob_references.pop(filebase, None)
+        self._add(filebase)
 
     def finish(self, filebase, preserve=False):
         """See `ISwitchboard`."""
         bakfile = os.path.join(self.queue_directory, filebase + '.bak')
+        # Files dequeued by another switchboard have to be read to find out
+        # whether they refer to a blob.
+        self._release(filebase)
+        self._index.backups.discard(filebase)
+        missing = object()
+        reference = self._blob_references.pop(filebase, missing)
         try:
             if preserve:
+                # The preserved file keeps its reference to the message body
+                # in the blob store, if it has one.
                 bad_dir = config.switchboards['bad'].queue_directory
                 psvfile = os.path.join(bad_dir, filebase + '.psv')
-                os.rename(bakfile, psvfile)
+                with self._changing():
+                    os.rename(bakfile, psvfile)
             else:
-                os.unlink(bakfile)
+                if reference is missing:
+                    with open(bakfile, 'rb') as fp:
+                        reference = queuefile.blob_reference(fp)
+                with self._changing():
+                    os.unlink(bakfile)
+                if reference is not None:
+                    self._blobs.release(reference)
+        except FileNotFoundError:
+            # The file was recovered by someone else, who will need whatever
+            # progress was made with it.
+            elog.error('Backup file went away before it was finished: %s',
+                       bakfile)
+            return
         except EnvironmentError:
             elog.exception(
                 'Failed to unlink/preserve backup file: %s', bakfile)
+        # Whatever progress was made with the file is of no use anymore.
+        try:
+            with self._changing():
+                os.unlink(self._checkpoint_file(filebase))
+        except FileNotFoundError:
+            pass
 
     @property
     def files(self):
         """See `ISwitchboard`."""
         return self.get_files()
 
-    def get_files(self, extension='.pck'):
+    def get_files(self, extension='.pck', count=None, until=None):
         """See `ISwitchboard`."""
+        if extension == '.pck':
+            # The queue files are tracked by our index, which only needs to
+            # look at the files that are new since the last scan.
+            self._index.refresh()
+            files = self._index.head(count, until)
+            if len(files) == 0 and self._others is not None:
+                files = self._steal(count, until)
+            return files
         times = {}
-        lower = self._lower
-        upper = self._upper
         for f in os.listdir(self.queue_directory):
-            # By ignoring anything that doesn't end in .pck, we ignore
-            # tempfiles and avoid a race condition.
+            # By ignoring anything that doesn't end in the extension we're
+            # looking for, we ignore tempfiles and avoid a race condition.
             filebase, ext = os.path.splitext(f)
             if ext != extension:
                 continue
-            when, digest = filebase.split('+', 1)
-            # Throw out any files which don't match our bitrange.  BAW: test
-            # performance and end-cases of this algorithm.  MAS: both
-            # comparisons need to be <= to get complete range.
-            if lower is None or (lower <= int(digest, 16) <= upper):
-                key = float(when)
+            when, digest, priority, list_key = parse_filebase(filebase)
+            if until is not None and when > until:
+                continue
+            if self._in_slice(digest):
+                key = when
                 while key in times:
                     key += DELTA
                 times[key] = filebase
         # FIFO sort
-        return [times[k] for k in sorted(times)]
+        files = [times[k] for k in sorted(times)]
+        return (files if count is None else files[:count])
+
+    def _steal(self, count, until):
+        """Pick some of the files in the other slices to help out with.
+
+        :param count: The maximum number of file bases to return, or None to
+            return all of them.
+        :type count: int or None
+        :param until: If given, only return the file bases which are due at
+            this time, in seconds since the epoch.
+        :type until: float or None
+        :return: The file bases.
+        :rtype: list of str
+        """
+        self._others.refresh()
+        # Most of the time, there is nothing to help out with.
+        earliest = self._others.earliest()
+        if earliest is None or (until is not None and earliest > until):
+            return []
+        stolen = self._stolen
+        # Drop the files which were processed in the meantime.
+        while len(stolen) > 0 and stolen[0] not in self._others:
+            stolen.popleft()
+        now = time.time()
+        if (len(stolen) == 0 or
+                now - self._stolen_at >= self._steal_interval > 0):
+            # The owners of the other slices work from the oldest files, so
+            # take the newer half of them.
+            others = self._others.head(None, until)
+            stolen = self._stolen = deque(others[len(others) // 2:])
+            self._stolen_at = now
+        files = (filebase for filebase in stolen
+                 if filebase in self._others and
+                 (until is None or parse_filebase(filebase)[0] <= until))
+        return list(files if count is None else islice(files, count))
+
+    def next_due(self):
+        """See `ISwitchboard`."""
+        self._index.refresh()
+        due = self._index.earliest()
+        if self._others is not None:
+            self._others.refresh()
+            others_due = self._others.earliest()
+            if due is None or (others_due is not None and others_due < due):
+                due = others_due
+        return due
+
+    def _in_slice(self, digest):
+        """Does the file with the given hex digest belong to our slice?"""
+        # Throw out any files which don't match our bitrange.  BAW: test
+        # performance and end-cases of this algorithm.  MAS: both
+        # comparisons need to be <= to get complete range.
+        return (self._lower is None or
+                self._lower <= int(digest, 16) <= self._upper)
 
     def recover_backup_files(self):
         """See `ISwitchboard`."""
-        # Move all .bak files in our slice to .pck.  It's impossible for both
-        # to exist at the same time, so the move is enough to ensure that our
-        # normal dequeuing process will handle them.  We keep count in
-        # _bak_count in the metadata of the number of times we recover this
-        # file.  When the count reaches MAX_BAK_COUNT, we move the .bak file
-        # to a .psv file in the bad queue.
-        for filebase in self.get_files('.bak'):
+        # Move all .bak files in our slice back to .pck.  It's impossible for
+        # both to exist at the same time, so the move is enough to ensure that
+        # our normal dequeuing process will handle them.  The number of times
+        # a file was recovered is kept in its file base, so the files don't
+        # have to be read or rewritten.  When the count reaches MAX_BAK_COUNT,
+        # we move the .bak file to a .psv file in the bad queue.  Files which
+        # are still claimed by another process are left alone.
+        #
+        # The backup files are picked up by the index's scan of the queue
+        # directory, which it needs anyway, or recorded when we dequeue the
+        # files ourselves, so the work done here is
+        # proportional to the number of files which were being processed.
+        self._index.refresh()
+        for filebase in sorted(self._index.backups):
             src = os.path.join(self.queue_directory, filebase + '.bak')
-            dst = os.path.join(self.queue_directory, filebase + '.pck')
-            with open(src, 'rb+') as fp:
-                try:
-                    # Throw away the message object.
-                    pickle.load(fp)
-                    data_pos = fp.tell()
-                    data = pickle.load(fp)
-                except Exception as error:
-                    # If unpickling throws any exception, just log and
-                    # preserve this entry
-                    elog.error('Unpickling .bak exception: %s\n'
-                               'Preserving file: %s', error, filebase)
-                    self.finish(filebase, preserve=True)
-                else:
-                    data['_bak_count'] = data.get('_bak_count', 0) + 1
-                    fp.seek(data_pos)
-                    if data.get('_parsemsg'):
-                        protocol = 0
-                    else:
-                        protocol = 1
-                    pickle.dump(data, fp, protocol)
-                    fp.truncate()
-                    fp.flush()
-                    os.fsync(fp.fileno())
-                    if data['_bak_count'] >= MAX_BAK_COUNT:
-                        elog.error('.bak file max count, preserving file: %s',
-                                   filebase)
-                        self.finish(filebase, preserve=True)
-                    else:
-                        os.rename(src, dst)
+            try:
+                if (self.claim_lease > 0 and
+                        os.stat(src).st_mtime > time.time()):
+                    # Another process is still working on this file.  Keep
+                    # it in mind, since the directory may not change again
+                    # by the time the claim expires.
+                    continue
+            except FileNotFoundError:
+                # The file was finished in the meantime.
+                self._index.backups.discard(filebase)
+                continue
+            self._index.backups.discard(filebase)
+            new_filebase = recovered_filebase(filebase)
+            if recovery_count(new_filebase) >= MAX_BAK_COUNT:
+                elog.error('.bak file max count, preserving file: %s',
+                           filebase)
+                self.finish(filebase, preserve=True)
+                continue
+            dst = os.path.join(self.queue_directory, new_filebase + '.pck')
+            try:
+                with self._changing():
+                    os.rename(src, dst)
+            except FileNotFoundError:
+                continue
+            self._add(new_filebase)
 
 
 
@@ -269,4 +667,8 @@ def handle_ConfigurationUpdatedEvent(event):
             substitutions = config.paths
             substitutions['name'] = name
             path = expand(conf.path, substitutions)
-            config.switchboards[name] = Switchboard(name, path)
+            refresh_interval = as_timedelta(
+                conf.index_refresh).total_seconds()
+            config.switchboards[name] = Switchboard(
+                name, path, refresh_interval=refresh_interval,
+                scheduling=conf.scheduling, priority=int(conf.priority))
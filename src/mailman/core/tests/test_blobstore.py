@@ -0,0 +1,169 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the blob store."""
+
+__all__ = [
+    'TestBlobStore',
+    'TestSwitchboardBlobs',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mailman.config import config
+from mailman.core import queuefile
+from mailman.core.blobstore import BlobStore
+from mailman.core.switchboard import Switchboard
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._blobs = BlobStore(os.path.join(self._tempdir, 'blobs'))
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_put_and_get(self):
+        reference = self._blobs.put(b'some data')
+        self.assertIn(reference, self._blobs)
+        self.assertEqual(self._blobs.get(reference), b'some data')
+
+    def test_stored_once(self):
+        reference_1 = self._blobs.put(b'some data')
+        reference_2 = self._blobs.put(b'some data')
+        self.assertNotEqual(reference_1, reference_2)
+        self.assertEqual(len(self._blobs), 1)
+        self.assertTrue(os.path.samefile(
+            os.path.join(self._blobs.directory, reference_1),
+            os.path.join(self._blobs.directory, reference_2)))
+
+    def test_release(self):
+        reference_1 = self._blobs.put(b'some data')
+        reference_2 = self._blobs.put(b'some data')
+        self._blobs.release(reference_1)
+        self.assertNotIn(reference_1, self._blobs)
+        self.assertEqual(self._blobs.get(reference_2), b'some data')
+        self.assertEqual(len(self._blobs), 1)
+        # Releasing the last reference deletes the blob.
+        self._blobs.release(reference_2)
+        self.assertEqual(len(self._blobs), 0)
+        self.assertEqual(os.listdir(self._blobs.directory), [])
+
+    def test_release_twice(self):
+        reference = self._blobs.put(b'some data')
+        self._blobs.release(reference)
+        self._blobs.release(reference)
+        self.assertEqual(len(self._blobs), 0)
+
+    def test_put_after_release(self):
+        reference = self._blobs.put(b'some data')
+        self._blobs.release(reference)
+        reference = self._blobs.put(b'some data')
+        self.assertEqual(self._blobs.get(reference), b'some data')
+        self.assertEqual(len(self._blobs), 1)
+
+
+
+class TestSwitchboardBlobs(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._in = Switchboard('in', os.path.join(self._tempdir, 'in'))
+        self._out = Switchboard('out', os.path.join(self._tempdir, 'out'))
+        self._blobs = BlobStore(config.BLOB_DIR)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""" + 'A big message.\n' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def _queue_file(self, switchboard, filebase, extension='.pck'):
+        return os.path.join(switchboard.queue_directory, filebase + extension)
+
+    def test_small_bodies_are_not_shared(self):
+        with configuration('mailman', blob_threshold=10000):
+            filebase = self._in.enqueue(self._msg)
+        self.assertEqual(len(self._blobs), 0)
+        msg, msgdata = self._in.dequeue(filebase)
+        self._in.finish(filebase)
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_body_shared_across_hops(self):
+        with configuration('mailman', blob_threshold=1000):
+            filebase = self._in.enqueue(self._msg)
+            self.assertEqual(len(self._blobs), 1)
+            self.assertLess(
+                os.path.getsize(self._queue_file(self._in, filebase)), 1000)
+            msg, msgdata = self._in.dequeue(filebase)
+            msg['X-Hop'] = 'out'
+            out_filebase = self._out.enqueue(msg, msgdata)
+            self._in.finish(filebase)
+        # There is still only one copy of the body, now referenced only by
+        # the queue file in the outgoing queue.
+        self.assertEqual(len(self._blobs), 1)
+        msg, msgdata = self._out.dequeue(out_filebase)
+        self.assertEqual(msg['x-hop'], 'out')
+        self.assertEqual(msg.get_payload(), self._msg.get_payload())
+        self._out.finish(out_filebase)
+        self.assertEqual(len(self._blobs), 0)
+
+    def test_finish_does_not_read_the_file(self):
+        # The switchboard remembers the blob reference it read when the file
+        # was dequeued.
+        with configuration('mailman', blob_threshold=1000):
+            filebase = self._in.enqueue(self._msg)
+        self._in.dequeue(filebase)
+        with patch('mailman.core.switchboard.queuefile.blob_reference') as (
+                blob_reference):
+            self._in.finish(filebase)
+        self.assertFalse(blob_reference.called)
+        self.assertEqual(len(self._blobs), 0)
+
+    def test_finish_by_another_switchboard(self):
+        with configuration('mailman', blob_threshold=1000):
+            filebase = self._in.enqueue(self._msg)
+        self._in.dequeue(filebase)
+        other = Switchboard('in', self._in.queue_directory)
+        other.finish(filebase)
+        self.assertEqual(len(self._blobs), 0)
+
+    def test_preserved_files_keep_their_blobs(self):
+        with configuration('mailman', blob_threshold=1000):
+            filebase = self._in.enqueue(self._msg)
+        self._in.dequeue(filebase)
+        self._in.finish(filebase, preserve=True)
+        self.assertEqual(len(self._blobs), 1)
+        bad = config.switchboards['bad']
+        psvfile = self._queue_file(bad, filebase, '.psv')
+        with open(psvfile, 'rb') as fp:
+            msg, msgdata = queuefile.load(fp, self._blobs)
+        self.assertEqual(msg.get_payload(), self._msg.get_payload())
@@ -0,0 +1,299 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the queue file format."""
+
+__all__ = [
+    'TestQueueFile',
+    'TestSwitchboardQueueFiles',
+    ]
+
+
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+from email.header import Header
+from mailman.core import queuefile
+from mailman.core.switchboard import Switchboard
+from mailman.email.message import LazyMessage
+from mailman.interfaces.action import Action
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.recipients import CompactRecipients
+from uuid import UUID
+
+
+
+class TestQueueFile(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: A test
+Message-ID: <ant>
+
+A message.
+""")
+
+    def _roundtrip(self, msg, msgdata=None, plaintext=False):
+        data = queuefile.dumps(
+            msg, ({} if msgdata is None else msgdata), plaintext)
+        return queuefile.load(io.BytesIO(data))
+
+    def test_raw_message(self):
+        data = queuefile.dumps(self._msg, {})
+        self.assertTrue(data.startswith(b'MMQF'))
+        self.assertTrue(data.endswith(b'\n\nA message.\n'))
+        msg, msgdata = queuefile.load(io.BytesIO(data))
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertEqual(msg['subject'], 'A test')
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_metadata_types(self):
+        metadata = dict(
+            none=None, flag=True, count=7, ratio=0.5, text='hello',
+            seq=[1, 'two'], pair=(1, 2), recipients={'anne@example.com'},
+            frozen=frozenset(['x']), data=b'\x00\xff', when=datetime(
+                2015, 4, 1, 12, 30, 15, 250),
+            period=timedelta(days=1, seconds=5), uuid=UUID(int=7),
+            numbers={1: 'one'}, nested=dict(deep=[(1, {'x'})]),
+            action=Action.hold)
+        msg, msgdata = self._roundtrip(self._msg, metadata)
+        self.assertEqual(msgdata, metadata)
+        for key in metadata:
+            self.assertIs(type(msgdata[key]), type(metadata[key]), key)
+        self.assertIs(type(msgdata['nested']['deep'][0]), tuple)
+
+    def test_compact_recipients(self):
+        # Compact recipients stay compressed in the queue file, and aren't
+        # expanded when it is read.
+        recipients = CompactRecipients(
+            '{}@example.com'.format(n) for n in range(200))
+        msg, msgdata = self._roundtrip(self._msg, dict(recipients=recipients))
+        copy = msgdata['recipients']
+        self.assertIsInstance(copy, CompactRecipients)
+        self.assertIsNone(copy._addresses)
+        self.assertEqual(copy.data, recipients.data)
+        self.assertEqual(copy, recipients)
+
+    def test_tagged_looking_dictionary(self):
+        metadata = dict(tricky={queuefile.TAG: 'set', 'items': []})
+        msg, msgdata = self._roundtrip(self._msg, metadata)
+        self.assertEqual(msgdata, metadata)
+
+    def test_attributes(self):
+        # Attributes set directly on the message survive.
+        self._msg.original_size = 99
+        self._msg.set_unixfrom('From anne@example.com')
+        msg, msgdata = self._roundtrip(self._msg)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertEqual(msg.original_size, 99)
+        self.assertEqual(msg.get_unixfrom(), 'From anne@example.com')
+
+    def test_header_instance_is_pickled(self):
+        # Header instances would come back as strings, so such messages are
+        # pickled instead.
+        self._msg['X-Header'] = Header('Ünïcode', 'utf-8')
+        msg, msgdata = self._roundtrip(self._msg)
+        self.assertNotIsInstance(msg, LazyMessage)
+        self.assertIsInstance(msg['x-header'], Header)
+
+    def test_non_ascii_text_is_pickled(self):
+        self._msg.set_payload('Ünïcode')
+        msg, msgdata = self._roundtrip(self._msg)
+        self.assertNotIsInstance(msg, LazyMessage)
+        self.assertEqual(msg.get_payload(), 'Ünïcode')
+
+    def test_raw_bytes(self):
+        # Messages with 8-bit headers and bodies are stored as is.
+        original = mfs(b"""\
+From: anne@example.com
+Subject: \xe4\xf6
+
+\xe4\xf6\xfc
+""".decode('ascii', 'surrogateescape'))
+        msg, msgdata = self._roundtrip(original)
+        self.assertIsInstance(msg, LazyMessage)
+        self.assertEqual(msg.as_bytes(), original.as_bytes())
+
+    def test_plaintext(self):
+        msg, msgdata = self._roundtrip(self._msg, plaintext=True)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msg.original_size, len(str(self._msg)))
+        self.assertEqual(msgdata['original_size'], msg.original_size)
+
+    def test_unparsed_body_is_reused(self):
+        msg, msgdata = self._roundtrip(self._msg)
+        msg['X-Added'] = 'yes'
+        data = queuefile.dumps(msg, {})
+        # The body was copied without being parsed.
+        self.assertIsNotNone(msg.unparsed_body)
+        msg, msgdata = queuefile.load(io.BytesIO(data))
+        self.assertEqual(msg['x-added'], 'yes')
+        self.assertEqual(msg.get_payload(), 'A message.\n')
+
+    def test_changed_boundary(self):
+        original = mfs("""\
+From: anne@example.com
+Content-Type: multipart/mixed; boundary="OLD"
+
+--OLD
+Content-Type: text/plain
+
+The first part.
+--OLD--
+""")
+        msg, msgdata = self._roundtrip(original)
+        msg.set_boundary('NEW')
+        msg, msgdata = self._roundtrip(msg)
+        self.assertEqual(msg.get_boundary(), 'NEW')
+        self.assertEqual(len(msg.get_payload()), 1)
+        self.assertEqual(msg.get_payload(0).get_payload(), 'The first part.')
+
+    def test_legacy_pickle(self):
+        fp = io.BytesIO()
+        pickle.dump(self._msg, fp, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(dict(foo=1, _parsemsg=False), fp)
+        fp.seek(0)
+        msg, msgdata = queuefile.load(fp)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata, dict(foo=1, _parsemsg=False))
+
+    def test_legacy_plaintext(self):
+        fp = io.BytesIO()
+        pickle.dump(str(self._msg), fp, 0)
+        pickle.dump(dict(_parsemsg=True), fp, 0)
+        fp.seek(0)
+        msg, msgdata = queuefile.load(fp)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata['original_size'], len(str(self._msg)))
+
+    def test_rewrite_metadata(self):
+        fp = io.BytesIO(queuefile.dumps(self._msg, dict(foo=1)))
+        metadata = queuefile.load_metadata(fp)
+        self.assertEqual(metadata, dict(foo=1))
+        metadata['bar'] = 'a much longer value than before'
+        queuefile.rewrite_metadata(fp, metadata)
+        fp.seek(0)
+        msg, msgdata = queuefile.load(fp)
+        self.assertEqual(msgdata, metadata)
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_rewrite_legacy_metadata(self):
+        fp = io.BytesIO()
+        pickle.dump(self._msg, fp, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(dict(foo='a long value'), fp)
+        metadata = queuefile.load_metadata(fp)
+        metadata['foo'] = 1
+        queuefile.rewrite_metadata(fp, metadata)
+        fp.seek(0)
+        msg, msgdata = queuefile.load(fp)
+        self.assertEqual(msgdata, dict(foo=1))
+
+    def test_unsupported_version(self):
+        data = bytearray(queuefile.dumps(self._msg, {}))
+        data[4] = 99
+        with self.assertRaises(ValueError):
+            queuefile.load(io.BytesIO(bytes(data)))
+
+
+
+class TestSwitchboardQueueFiles(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._switchboard = Switchboard('test', self._tempdir)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+A message.
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_legacy_queue_file(self):
+        # Queue files written by older versions are still dequeued.
+        filebase = '1234.5+' + 'a' * 40
+        path = os.path.join(self._tempdir, filebase + '.pck')
+        with open(path, 'wb') as fp:
+            pickle.dump(self._msg, fp, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dict(foo=1, _parsemsg=False, version=3), fp)
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata['foo'], 1)
+
+    def test_recover_legacy_queue_file(self):
+        filebase = '1234.5+' + 'a' * 40
+        path = os.path.join(self._tempdir, filebase + '.bak')
+        with open(path, 'wb') as fp:
+            pickle.dump(self._msg, fp, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(dict(foo=1, _parsemsg=False, version=3), fp)
+        self._switchboard.recover_backup_files()
+        # Recovered files are renamed to count the recoveries.
+        filebase = '1234.5+' + 'a' * 40 + '+0++1'
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata['_bak_count'], 1)
+
+    def test_recover_queue_file(self):
+        filebase = self._switchboard.enqueue(self._msg, foo=1)
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        filebase += '+1'
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.finish(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msgdata['_bak_count'], 1)
+        self.assertEqual(msgdata['foo'], 1)
+
+    def test_compact_recipients(self):
+        recipients = ['{}@example.com'.format(n) for n in range(5)]
+        with configuration('mailman', compact_recipients_threshold=5):
+            filebase = self._switchboard.enqueue(
+                self._msg, recipients=recipients)
+            msg, msgdata = self._switchboard.dequeue(filebase)
+            self._switchboard.finish(filebase)
+            self.assertIsInstance(msgdata['recipients'], CompactRecipients)
+            self.assertEqual(msgdata['recipients'], set(recipients))
+            # Enqueueing them again, e.g. for a retry, keeps them as they are.
+            filebase = self._switchboard.enqueue(msg, msgdata)
+            msg, msgdata = self._switchboard.dequeue(filebase)
+            self._switchboard.finish(filebase)
+            self.assertIsNone(msgdata['recipients']._addresses)
+            # Fewer recipients are stored as they are.
+            filebase = self._switchboard.enqueue(
+                self._msg, recipients=recipients[:4])
+            msg, msgdata = self._switchboard.dequeue(filebase)
+            self._switchboard.finish(filebase)
+            self.assertEqual(msgdata['recipients'], recipients[:4])
@@ -0,0 +1,135 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the queue statistics."""
+
+__all__ = [
+    'TestHistogram',
+    'TestRunnerStats',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mailman.core.queuestats import (
+    Histogram, RunnerStats, collect, render_text)
+
+
+
+class TestHistogram(unittest.TestCase):
+    def test_observe(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 100):
+            histogram.observe(value)
+        # Bucket bounds are inclusive.
+        self.assertEqual(histogram.buckets, [2, 1, 1])
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 106.5)
+        self.assertEqual(histogram.cumulative(),
+                         [(1, 2), (10, 3), (None, 4)])
+
+    def test_merge(self):
+        histogram_1 = Histogram((1, 10))
+        histogram_1.observe(2)
+        histogram_2 = Histogram((1, 10))
+        histogram_2.observe(20)
+        histogram_1.merge(histogram_2)
+        self.assertEqual(histogram_1.buckets, [0, 1, 1])
+        self.assertEqual(histogram_1.count, 2)
+        self.assertEqual(histogram_1.sum, 22)
+
+    def test_merge_different_buckets(self):
+        with self.assertRaises(ValueError):
+            Histogram((1, 10)).merge(Histogram((1, 100)))
+
+
+
+class TestRunnerStats(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._stats_dir = os.path.join(self._tempdir, 'stats')
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def _stats(self, name, processed=1, latency=0.2):
+        stats = RunnerStats(name)
+        stats.count('processed', processed)
+        stats.observe('dequeue_latency', latency)
+        return stats
+
+    def test_save_and_load(self):
+        path = os.path.join(self._stats_dir, 'in.0.json')
+        self._stats('in', 3).save(path)
+        self.assertEqual(os.listdir(self._stats_dir), ['in.0.json'])
+        stats = RunnerStats.load(path)
+        self.assertEqual(stats.name, 'in')
+        self.assertEqual(stats.counters['processed'], 3)
+        self.assertEqual(stats.histograms['dequeue_latency'].count, 1)
+
+    def test_collect(self):
+        # The statistics of the runners of each queue are combined.
+        self._stats('in', 1).save(os.path.join(self._stats_dir, 'in.0.json'))
+        self._stats('in', 2).save(os.path.join(self._stats_dir, 'in.1.json'))
+        self._stats('out', 4).save(
+            os.path.join(self._stats_dir, 'out.0.json'))
+        queues = collect(self._stats_dir)
+        self.assertEqual(sorted(queues), ['in', 'out'])
+        self.assertEqual(queues['in'].counters['processed'], 3)
+        self.assertEqual(queues['in'].histograms['dequeue_latency'].count, 2)
+        self.assertEqual(queues['out'].counters['processed'], 4)
+
+    def test_collect_skips_corrupt_files(self):
+        self._stats('in').save(os.path.join(self._stats_dir, 'in.0.json'))
+        with open(os.path.join(self._stats_dir, 'in.1.json'), 'w') as fp:
+            fp.write('{"name": ')
+        with open(os.path.join(self._stats_dir, 'in.2.json'), 'w') as fp:
+            fp.write('[]')
+        queues = collect(self._stats_dir)
+        self.assertEqual(queues['in'].counters['processed'], 1)
+
+    def test_collect_missing_directory(self):
+        self.assertEqual(collect(self._stats_dir), {})
+
+    def test_render_text(self):
+        stats = self._stats('in', 2, 0.2)
+        text = render_text(dict(bad=(1, 2.5), **{'in': (0, 0)}),
+                           {'in': stats})
+        lines = text.splitlines()
+        self.assertIn('# TYPE mailman_queue_depth gauge', lines)
+        self.assertIn('mailman_queue_depth{queue="bad"} 1', lines)
+        self.assertIn('mailman_queue_oldest_age_seconds{queue="bad"} 2.5',
+                      lines)
+        self.assertIn('# TYPE mailman_queue_processed_total counter', lines)
+        self.assertIn('mailman_queue_processed_total{queue="in"} 2', lines)
+        self.assertIn(
+            'mailman_queue_dequeue_latency_seconds_bucket'
+            '{queue="in",le="0.1"} 0', lines)
+        self.assertIn(
+            'mailman_queue_dequeue_latency_seconds_bucket'
+            '{queue="in",le="0.5"} 1', lines)
+        self.assertIn(
+            'mailman_queue_dequeue_latency_seconds_bucket'
+            '{queue="in",le="+Inf"} 1', lines)
+        self.assertIn(
+            'mailman_queue_dequeue_latency_seconds_count{queue="in"} 1',
+            lines)
+        self.assertIn('mailman_queue_files_per_pass_count{queue="in"} 0',
+                      lines)
@@ -0,0 +1,88 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the queue directory watcher."""
+
+__all__ = [
+    'TestQueueWatcher',
+    ]
+
+
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mailman.core.queuewatcher import QueueWatcher
+from mailman.core.switchboard import Switchboard
+from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestQueueWatcher(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self._switchboard = Switchboard('test', self._queue_directory)
+        self._watcher = QueueWatcher(self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def tearDown(self):
+        self._watcher.close()
+        shutil.rmtree(self._queue_directory)
+
+    def test_timeout(self):
+        # Nothing gets enqueued, so the wait times out.
+        t0 = time.time()
+        self.assertFalse(self._watcher.wait(0.2))
+        self.assertGreaterEqual(time.time() - t0, 0.2)
+
+    def test_wake_up_on_enqueue(self):
+        if not self._watcher.is_watching:
+            raise unittest.SkipTest('inotify is not available')
+        timer = threading.Timer(
+            0.1, self._switchboard.enqueue, (self._msg,))
+        timer.start()
+        t0 = time.time()
+        try:
+            self.assertTrue(self._watcher.wait(30))
+        finally:
+            timer.join()
+        self.assertLess(time.time() - t0, 30)
+
+    def test_already_enqueued(self):
+        # A file enqueued before we start waiting is not missed.
+        if not self._watcher.is_watching:
+            raise unittest.SkipTest('inotify is not available')
+        self._switchboard.enqueue(self._msg)
+        self.assertTrue(self._watcher.wait(30))
+
+    def test_ignore_dequeue(self):
+        # Dequeuing a file renames it to a backup file, which is not a reason
+        # to wake up.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._watcher.wait(0)
+        self._switchboard.dequeue(filebase)
+        self.assertFalse(self._watcher.wait(0.2))
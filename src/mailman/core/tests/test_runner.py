@@ -22,10 +22,13 @@ __all__ = [
     ]
 
 
+import os
 import unittest
 
+from datetime import timedelta
 from mailman.app.lifecycle import create_list
 from mailman.config import config
+from mailman.core.queuestats import collect
 from mailman.core.runner import Runner
 from mailman.interfaces.runner import RunnerCrashEvent
 from mailman.runners.virgin import VirginRunner
@@ -34,6 +37,8 @@ from mailman.testing.helpers import (
     make_digest_messages, make_testable_runner,
     specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
+from unittest.mock import patch
 
 
 
@@ -42,6 +47,14 @@ class CrashingRunner(Runner):
         raise RuntimeError('borked')
 
 
+class PoisonedRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        if msg['message-id'] == '<poison>':
+            raise RuntimeError('poisoned')
+        config.switchboards['out'].enqueue(msg, msgdata)
+        return False
+
+
 
 class TestRunner(unittest.TestCase):
     """Test the Runner base class behavior."""
@@ -120,3 +133,138 @@ Message-ID: <ant>
         # The list's -request address is the original sender.
         self.assertEqual(bag.msgdata['original_sender'],
                          'test-request@example.com')
+
+    @configuration('runner.virgin', group_commit='yes')
+    def test_group_commit(self):
+        # With group commits, the files enqueued while processing a message
+        # are synced together, before the original queue file is finished.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['virgin'].enqueue(msg, listid='test.example.com')
+        runner = make_testable_runner(VirginRunner, 'virgin')
+        self.assertTrue(runner.group_commit)
+        with patch('mailman.core.switchboard.sync_filesystem',
+                   return_value=True) as sync_filesystem:
+            runner.run()
+        self.assertEqual(sync_filesystem.call_count, 1)
+        messages = get_queue_messages('out')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msg['message-id'], '<ant>')
+
+    @configuration('runner.virgin', sleep_time='1m', watch_queue='no')
+    def test_snooze_until_due(self):
+        # An idle runner doesn't sleep past the time its next deferred file
+        # becomes due.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        config.switchboards['virgin'].enqueue(
+            msg, listid='test.example.com',
+            deliver_after=now() + timedelta(seconds=30))
+        runner = make_testable_runner(VirginRunner, 'virgin')
+        runner.run()
+        self.assertEqual(len(config.switchboards['virgin'].files), 1)
+        with patch('mailman.core.runner.time.sleep') as sleep:
+            runner._snooze(0)
+        timeout = sleep.call_args[0][0]
+        self.assertLessEqual(timeout, 30)
+        self.assertGreater(timeout, 20)
+
+    def _enqueue_in(self, *message_ids):
+        for message_id in message_ids:
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: {}
+
+""".format(message_id))
+            config.switchboards['in'].enqueue(msg, listid='test.example.com')
+
+    @configuration('runner.in', batch_size='10')
+    def test_batch(self):
+        # A batch of messages is processed in one transaction.
+        self._enqueue_in('<ant>', '<bee>', '<cat>')
+        runner = make_testable_runner(PoisonedRunner, 'in')
+        with patch.object(config.db, 'commit',
+                          wraps=config.db.commit) as commit:
+            runner.run()
+        self.assertEqual(commit.call_count, 1)
+        messages = get_queue_messages('out', sort_on='message-id')
+        self.assertEqual([message.msg['message-id'] for message in messages],
+                         ['<ant>', '<bee>', '<cat>'])
+
+    @configuration('runner.in', batch_size='2')
+    def test_batch_size(self):
+        self._enqueue_in('<ant>', '<bee>', '<cat>')
+        runner = make_testable_runner(PoisonedRunner, 'in')
+        with patch.object(config.db, 'commit',
+                          wraps=config.db.commit) as commit:
+            runner.run()
+        self.assertEqual(commit.call_count, 2)
+        self.assertEqual(len(get_queue_messages('out')), 3)
+
+    @configuration('runner.in', batch_size='10')
+    def test_failed_batch(self):
+        # When a message in a batch fails, the batch is processed again one
+        # message at a time, so that only the failing message is shunted.
+        self._enqueue_in('<ant>', '<poison>', '<bee>')
+        # The failed batch is rolled back, so the mailing list must already
+        # be committed.
+        config.db.commit()
+        runner = make_testable_runner(PoisonedRunner, 'in')
+        with event_subscribers(self._got_event):
+            runner.run()
+        messages = get_queue_messages('out', sort_on='message-id')
+        self.assertEqual([message.msg['message-id'] for message in messages],
+                         ['<ant>', '<bee>'])
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<poison>')
+        self.assertEqual(len(self._events), 1)
+        self.assertEqual(str(self._events[0].error), 'poisoned')
+        # Nothing is left behind in the queues.
+        self.assertEqual(
+            os.listdir(config.switchboards['in'].queue_directory), [])
+        self.assertEqual(
+            os.listdir(config.switchboards['out'].queue_directory), [])
+
+    def test_statistics(self):
+        self._enqueue_in('<ant>', '<poison>', '<bee>')
+        config.db.commit()
+        runner = make_testable_runner(PoisonedRunner, 'in')
+        runner.run()
+        counters = runner.stats.counters
+        self.assertEqual(counters['processed'], 2)
+        self.assertEqual(counters['shunted'], 1)
+        self.assertGreaterEqual(counters['passes'], 1)
+        histograms = runner.stats.histograms
+        self.assertEqual(histograms['dequeue_latency'].count, 3)
+        self.assertEqual(histograms['dispose_time'].count, 3)
+        # The messages were stamped when they were enqueued.
+        self.assertEqual(histograms['message_age'].count, 3)
+        self.assertEqual(histograms['files_per_pass'].sum, 3)
+
+    def test_statistics_file(self):
+        # The runner saves its statistics for others to see, and removes them
+        # when it goes away.
+        self._enqueue_in('<ant>')
+        runner = make_testable_runner(PoisonedRunner, 'in')
+        runner._one_iteration()
+        stats = collect(config.STATS_DIR)
+        self.assertEqual(stats['in'].counters['processed'], 1)
+        runner._clean_up()
+        self.assertEqual(collect(config.STATS_DIR), {})
+
+    @configuration('runner.in', stats_interval='0s')
+    def test_no_statistics_file(self):
+        self._enqueue_in('<ant>')
+        runner = make_testable_runner(PoisonedRunner, 'in')
+        runner._one_iteration()
+        self.assertEqual(collect(config.STATS_DIR), {})
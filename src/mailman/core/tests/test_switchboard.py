@@ -18,17 +18,30 @@
 """Switchboard tests."""
 
 __all__ = [
+    'TestFairScheduling',
+    'TestGroupCommit',
+    'TestQueueHops',
     'TestSwitchboard',
+    'TestSwitchboardIndex',
+    'TestWorkStealing',
     ]
 
 
+import os
+import time
+import shutil
+import tempfile
 import unittest
 
+from datetime import timedelta
 from mailman.config import config
+from mailman.core.switchboard import (
+    MAX_HOPS, GroupCommit, Switchboard, shamax)
 from mailman.testing.helpers import (
     LogFileMark,
     specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
 from unittest.mock import patch
 
 
@@ -56,3 +69,584 @@ Message-ID: <ant>
         traceback = error_log.read().splitlines()
         self.assertEqual(traceback[1], 'Traceback (most recent call last):')
         self.assertEqual(traceback[-1], 'OSError: Oops!')
+
+
+
+class TestSwitchboardIndex(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def test_files_queued_by_another_switchboard(self):
+        # Files queued through another switchboard, e.g. in another process,
+        # are picked up when the queue directory is rescanned.
+        switchboard_1 = Switchboard('test', self._queue_directory)
+        switchboard_2 = Switchboard('test', self._queue_directory)
+        self.assertEqual(switchboard_1.files, [])
+        filebase = switchboard_2.enqueue(self._msg)
+        self.assertEqual(switchboard_1.files, [filebase])
+
+    def test_files_removed_by_another_switchboard(self):
+        switchboard_1 = Switchboard('test', self._queue_directory)
+        switchboard_2 = Switchboard('test', self._queue_directory)
+        filebase = switchboard_1.enqueue(self._msg)
+        self.assertEqual(switchboard_2.files, [filebase])
+        switchboard_1.dequeue(filebase)
+        switchboard_1.finish(filebase)
+        self.assertEqual(switchboard_2.files, [])
+
+    def test_get_files_count(self):
+        # Only the oldest files are returned, in FIFO order.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebases = [switchboard.enqueue(self._msg, index=i)
+                     for i in range(5)]
+        self.assertEqual(switchboard.get_files(count=2), filebases[:2])
+        self.assertEqual(switchboard.files, filebases)
+        # Dequeued files are no longer handed out.
+        switchboard.dequeue(filebases[0])
+        self.assertEqual(switchboard.get_files(count=2), filebases[1:3])
+
+    def test_refresh_interval(self):
+        # While a switchboard still has files to process, it doesn't look for
+        # new files until the refresh interval has passed.
+        switchboard_1 = Switchboard(
+            'test', self._queue_directory, refresh_interval=3600)
+        switchboard_2 = Switchboard('test', self._queue_directory)
+        filebase_1 = switchboard_1.enqueue(self._msg)
+        self.assertEqual(switchboard_1.files, [filebase_1])
+        filebase_2 = switchboard_2.enqueue(self._msg)
+        self.assertEqual(switchboard_1.files, [filebase_1])
+        # Once it runs out of work, the directory is rescanned.
+        switchboard_1.dequeue(filebase_1)
+        self.assertEqual(switchboard_1.files, [filebase_2])
+
+    def test_own_changes_do_not_rescan(self):
+        # The switchboard tells its index about the files it queues and
+        # removes itself, so a pass which only sees its own changes to the
+        # queue directory doesn't list the directory again.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebases = [switchboard.enqueue(self._msg, index=i)
+                     for i in range(3)]
+        # Make sure the directory wasn't modified just before the scan.
+        past = time.time() - 10
+        os.utime(self._queue_directory, (past, past))
+        self.assertEqual(switchboard.files, filebases)
+        with patch('mailman.core.queueindex.os.listdir',
+                   wraps=os.listdir) as listdir:
+            for i in range(3):
+                filebase = filebases.pop(0)
+                self.assertEqual(switchboard.get_files(count=1), [filebase])
+                switchboard.dequeue(filebase)
+                switchboard.finish(filebase)
+                filebases.append(switchboard.enqueue(self._msg, index=i + 3))
+            self.assertEqual(switchboard.files, filebases)
+            self.assertEqual(listdir.call_count, 0)
+            # Files queued by others are still picked up.
+            other = Switchboard('test', self._queue_directory)
+            filebases.append(other.enqueue(self._msg))
+            self.assertEqual(switchboard.files, filebases)
+            self.assertEqual(listdir.call_count, 1)
+
+    def test_slices(self):
+        # Each file belongs to exactly one slice of the queue.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebases = set(switchboard.enqueue(self._msg, index=i)
+                        for i in range(20))
+        slice_0 = Switchboard('test', self._queue_directory, 0, 2)
+        slice_1 = Switchboard('test', self._queue_directory, 1, 2)
+        files_0 = set(slice_0.files)
+        files_1 = set(slice_1.files)
+        self.assertEqual(files_0 & files_1, set())
+        self.assertEqual(files_0 | files_1, filebases)
+        # The other extensions honor the slices too.
+        for filebase in filebases:
+            switchboard.dequeue(filebase)
+        self.assertEqual(set(slice_0.get_files('.bak')), files_0)
+        self.assertEqual(set(slice_1.get_files('.bak')), files_1)
+
+    def test_slice_boundaries(self):
+        # The digests at the edges of the slices belong to exactly one slice.
+        slice_0 = Switchboard('test', self._queue_directory, 0, 2)
+        slice_1 = Switchboard('test', self._queue_directory, 1, 2)
+        for value in (0, (shamax + 1) // 2 - 1, (shamax + 1) // 2, shamax):
+            digest = '{:040x}'.format(value)
+            self.assertNotEqual(
+                slice_0._in_slice(digest), slice_1._in_slice(digest), digest)
+
+    def test_deferred_files(self):
+        # Files with a deliver_after time in the future are named after the
+        # time they become due, and are left out until then.
+        switchboard = Switchboard('test', self._queue_directory)
+        later = switchboard.enqueue(
+            self._msg, deliver_after=now() + timedelta(hours=1))
+        due = switchboard.enqueue(self._msg)
+        self.assertEqual(switchboard.files, [due, later])
+        self.assertEqual(switchboard.get_files(until=time.time()), [due])
+        self.assertEqual(
+            switchboard.get_files(until=time.time() + 7200), [due, later])
+        self.assertEqual(switchboard.get_files('.pck', until=time.time()),
+                         [due])
+        switchboard.dequeue(due)
+        self.assertAlmostEqual(
+            switchboard.next_due(), time.time() + 3600, delta=60)
+        switchboard.dequeue(later)
+        self.assertIsNone(switchboard.next_due())
+
+    def test_recovered_files_are_indexed(self):
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        switchboard.dequeue(filebase)
+        self.assertEqual(switchboard.files, [])
+        switchboard.recover_backup_files()
+        self.assertEqual(switchboard.files, [filebase + '+1'])
+        self.assertEqual(
+            os.listdir(self._queue_directory), [filebase + '+1.pck'])
+
+    def test_recovery_count(self):
+        # The number of times a file was recovered is kept in its name, and
+        # files recovered too often are preserved in the bad queue.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        for count in range(1, 3):
+            switchboard.dequeue(filebase)
+            switchboard.recover_backup_files()
+            filebase = switchboard.files[0]
+            self.assertEqual(filebase.split('+')[-1], str(count))
+            msg, msgdata = switchboard.dequeue(filebase)
+            self.assertEqual(msgdata['_bak_count'], count)
+            switchboard.restore(filebase)
+        bad = config.switchboards['bad']
+        switchboard.dequeue(filebase)
+        switchboard.recover_backup_files()
+        self.assertEqual(os.listdir(self._queue_directory), [])
+        self.assertEqual(bad.get_files('.psv'), [filebase])
+        os.remove(os.path.join(bad.queue_directory, filebase + '.psv'))
+
+    def test_checkpoint_survives_recovery(self):
+        # The checkpoint file of a queue file stays the same when the file is
+        # recovered, and goes away when it is finished.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        msg, msgdata = switchboard.dequeue(filebase)
+        checkpoint = msgdata['_checkpoint']
+        self.assertEqual(os.path.dirname(checkpoint), self._queue_directory)
+        with open(checkpoint, 'w') as fp:
+            fp.write('anne@example.com\n')
+        switchboard.recover_backup_files()
+        filebase = switchboard.files[0]
+        msg, msgdata = switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['_checkpoint'], checkpoint)
+        switchboard.finish(filebase)
+        self.assertEqual(os.listdir(self._queue_directory), [])
+
+    def test_recovery_does_not_read_files(self):
+        # Recovering a file just renames it.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        switchboard.dequeue(filebase)
+        with patch('mailman.core.switchboard.open',
+                   side_effect=AssertionError('file opened'), create=True):
+            switchboard.recover_backup_files()
+        self.assertEqual(switchboard.files, [filebase + '+1'])
+
+    def test_recovery_with_index(self):
+        # Backup files found by an earlier scan which have since been
+        # finished are skipped.
+        switchboard = Switchboard('test', self._queue_directory)
+        filebase = switchboard.enqueue(self._msg)
+        switchboard.dequeue(filebase)
+        self.assertEqual(switchboard.files, [])
+        switchboard.finish(filebase)
+        switchboard.recover_backup_files()
+        self.assertEqual(switchboard.files, [])
+        self.assertEqual(os.listdir(self._queue_directory), [])
+
+
+
+class TestFairScheduling(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self._switchboard = Switchboard(
+            'test', self._queue_directory, scheduling='fair')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _enqueue(self, list_id, count, **kws):
+        return [self._switchboard.enqueue(self._msg, listid=list_id, **kws)
+                for i in range(count)]
+
+    def test_unknown_scheduling(self):
+        with self.assertRaises(ValueError):
+            Switchboard('test', self._queue_directory, scheduling='random')
+
+    def test_lists_take_turns(self):
+        # A busy list doesn't hold up the messages of a quieter list.
+        busy = self._enqueue('busy.example.com', 4)
+        quiet = self._enqueue('quiet.example.com', 2)
+        self.assertEqual(
+            self._switchboard.files,
+            [busy[0], quiet[0], busy[1], quiet[1], busy[2], busy[3]])
+
+    def test_turns_rotate(self):
+        # The list which didn't get a turn in the last batch goes first in
+        # the next one.
+        ant = self._enqueue('ant.example.com', 2)
+        bee = self._enqueue('bee.example.com', 2)
+        cat = self._enqueue('cat.example.com', 2)
+        batch = self._switchboard.get_files(count=2)
+        self.assertEqual(batch, [ant[0], bee[0]])
+        for filebase in batch:
+            self._switchboard.dequeue(filebase)
+        self.assertEqual(
+            self._switchboard.get_files(count=3), [cat[0], ant[1], bee[1]])
+
+    def test_priority(self):
+        # Higher priority files are returned first, and the priority is
+        # carried along in the metadata.
+        low = self._enqueue('ant.example.com', 2)
+        high = self._enqueue('ant.example.com', 1, priority=5)
+        self.assertEqual(self._switchboard.files, high + low)
+        msg, msgdata = self._switchboard.dequeue(high[0])
+        self.assertEqual(msgdata['priority'], 5)
+        msg, msgdata = self._switchboard.dequeue(low[0])
+        self.assertNotIn('priority', msgdata)
+
+    def test_default_priority(self):
+        switchboard = Switchboard(
+            'test', self._queue_directory, scheduling='fair', priority=3)
+        low = self._enqueue('ant.example.com', 1)
+        high = switchboard.enqueue(self._msg, listid='ant.example.com')
+        self.assertEqual(self._switchboard.files, [high] + low)
+        msg, msgdata = switchboard.dequeue(high)
+        self.assertEqual(msgdata['priority'], 3)
+
+    def test_old_file_bases(self):
+        # Queue files named by older versions go with the default priority,
+        # under a key of their own.
+        old = '1234.5+' + 'a' * 40
+        with open(os.path.join(self._queue_directory, old + '.pck'), 'wb'):
+            pass
+        self.assertEqual(self._switchboard.files, [old])
+        new = self._enqueue('ant.example.com', 2)
+        self.assertEqual(self._switchboard.files, [old, new[0], new[1]])
+
+    def test_fifo(self):
+        # By default, the files are returned in FIFO order.
+        busy = self._enqueue('busy.example.com', 2)
+        quiet = self._enqueue('quiet.example.com', 1)
+        switchboard = Switchboard('test', self._queue_directory)
+        self.assertEqual(switchboard.files, busy + quiet)
+
+
+
+class TestGroupCommit(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self._switchboard = Switchboard('test', self._queue_directory)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _extensions(self):
+        return sorted(os.path.splitext(filename)[1]
+                      for filename in os.listdir(self._queue_directory))
+
+    def test_files_appear_on_commit(self):
+        with GroupCommit():
+            filebases = [self._switchboard.enqueue(self._msg, index=i)
+                         for i in range(3)]
+            # Nothing is visible yet.
+            self.assertEqual(self._switchboard.files, [])
+            self.assertEqual(self._extensions(), ['.tmp'] * 3)
+        self.assertEqual(self._extensions(), ['.pck'] * 3)
+        self.assertEqual(self._switchboard.files, filebases)
+
+    @patch('mailman.core.switchboard.fsync_directory')
+    def test_one_sync(self, fsync_directory):
+        # The files are not synced one by one.
+        with patch('mailman.core.switchboard.os.fsync') as fsync:
+            with patch('mailman.core.switchboard.sync_filesystem',
+                       return_value=True) as sync_filesystem:
+                with GroupCommit():
+                    for i in range(3):
+                        self._switchboard.enqueue(self._msg, index=i)
+        self.assertEqual(fsync.call_count, 0)
+        self.assertEqual(sync_filesystem.call_count, 1)
+        # The queue directory is synced once, after the renames.
+        fsync_directory.assert_called_once_with(self._queue_directory)
+
+    @patch('mailman.core.switchboard.fsync_directory')
+    def test_fallback_to_fsync(self, fsync_directory):
+        # Without support for syncing a whole file system, each file gets
+        # synced, but only when the group is committed.
+        with patch('mailman.core.switchboard.os.fsync') as fsync:
+            with patch('mailman.core.switchboard.sync_filesystem',
+                       return_value=False):
+                with GroupCommit():
+                    for i in range(3):
+                        self._switchboard.enqueue(self._msg, index=i)
+                    self.assertEqual(fsync.call_count, 0)
+        self.assertEqual(fsync.call_count, 3)
+        self.assertEqual(self._extensions(), ['.pck'] * 3)
+        # Like individually enqueued files, the directory isn't synced.
+        self.assertFalse(fsync_directory.called)
+
+    def test_failed_commit(self):
+        # When committing the group fails, the files which weren't renamed
+        # yet are removed.
+        rename = os.rename
+        def fail_second(src, dst, calls=[]):
+            calls.append(src)
+            if len(calls) == 2:
+                raise OSError('No space left')
+            rename(src, dst)
+        with patch('mailman.core.switchboard.os.rename',
+                   side_effect=fail_second):
+            with self.assertRaises(OSError):
+                with GroupCommit():
+                    for i in range(3):
+                        self._switchboard.enqueue(self._msg, index=i)
+        self.assertEqual(self._extensions(), ['.pck'])
+        self.assertEqual(len(self._switchboard.files), 1)
+
+    def test_nested(self):
+        # Nested group commits join the outermost one.
+        with GroupCommit():
+            with GroupCommit():
+                self._switchboard.enqueue(self._msg)
+            self.assertEqual(self._extensions(), ['.tmp'])
+        self.assertEqual(self._extensions(), ['.pck'])
+
+    def test_discard(self):
+        # Discarded files never show up.
+        with GroupCommit() as group_commit:
+            self._switchboard.enqueue(self._msg)
+            group_commit.discard()
+        self.assertEqual(self._extensions(), [])
+        self.assertEqual(self._switchboard.files, [])
+
+    def test_commit_on_exception(self):
+        # Files enqueued before an exception are still committed.
+        with self.assertRaises(RuntimeError):
+            with GroupCommit():
+                self._switchboard.enqueue(self._msg)
+                raise RuntimeError
+        self.assertEqual(self._extensions(), ['.pck'])
+
+
+
+
+class TestWorkStealing(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._queue_directory = tempfile.mkdtemp()
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._slices = [
+            Switchboard('test', self._queue_directory, i, 2,
+                        steal_work=True, claim_lease=3600)
+            for i in range(2)]
+        self._switchboard = Switchboard('test', self._queue_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self._queue_directory)
+
+    def _enqueue_into(self, slice_number, count):
+        # Enqueue messages until the slice has the given number of them.
+        owner = self._slices[slice_number]
+        filebases = []
+        index = 0
+        while len(filebases) < count:
+            filebase = self._switchboard.enqueue(self._msg, index=index)
+            index += 1
+            if owner._in_slice(filebase.split('+')[1]):
+                filebases.append(filebase)
+            else:
+                self._switchboard.dequeue(filebase)
+                self._switchboard.finish(filebase)
+        return filebases
+
+    def test_own_slice_first(self):
+        own = self._enqueue_into(0, 1)
+        self._enqueue_into(1, 1)
+        self.assertEqual(self._slices[0].files, own)
+
+    def test_steal_newer_half(self):
+        # An idle switchboard takes the newer half of the other slices.
+        others = self._enqueue_into(1, 4)
+        self.assertEqual(self._slices[0].files, others[2:])
+        self.assertEqual(self._slices[0].get_files(count=1), others[2:3])
+        self.assertEqual(self._slices[1].files, others)
+
+    def test_files_to_steal_are_picked_once(self):
+        # Picking the files to help out with looks at all the files in the
+        # other slices, so it is only done again once they are all gone.
+        others = self._enqueue_into(1, 4)
+        switchboard = self._slices[0]
+        with patch.object(switchboard._others, 'head',
+                          wraps=switchboard._others.head) as head:
+            for filebase in others[2:]:
+                self.assertEqual(switchboard.get_files(count=1), [filebase])
+                switchboard.dequeue(filebase)
+                switchboard.finish(filebase)
+            self.assertEqual(head.call_count, 1)
+            # The remaining files are picked again.
+            self.assertEqual(switchboard.files, others[1:2])
+            self.assertEqual(head.call_count, 2)
+            # When nothing is due, the other slices aren't looked at.
+            self.assertEqual(switchboard.get_files(until=0), [])
+            self.assertEqual(head.call_count, 2)
+
+    def test_no_stealing(self):
+        self._enqueue_into(1, 1)
+        switchboard = Switchboard('test', self._queue_directory, 0, 2)
+        self.assertEqual(switchboard.files, [])
+
+    def test_claim(self):
+        # Only one switchboard can claim a file.
+        filebase = self._enqueue_into(1, 1)[0]
+        self.assertEqual(self._slices[0].files, [filebase])
+        self.assertEqual(self._slices[1].files, [filebase])
+        self._slices[0].dequeue(filebase)
+        with self.assertRaises(FileNotFoundError):
+            self._slices[1].dequeue(filebase)
+        self.assertEqual(self._slices[1].files, [])
+
+    def test_claimed_files_are_not_recovered(self):
+        filebase = self._enqueue_into(1, 1)[0]
+        self._slices[0].dequeue(filebase)
+        # The owner of the slice leaves the file alone while it's claimed.
+        self._slices[1].recover_backup_files()
+        self.assertEqual(self._slices[1].files, [])
+        # Once the claim expires, the file is processed again.
+        bakfile = os.path.join(self._queue_directory, filebase + '.bak')
+        os.utime(bakfile, (time.time() - 1, time.time() - 1))
+        self._slices[1].recover_backup_files()
+        self.assertEqual(self._slices[1].files, [filebase + '+1'])
+
+    def test_claims_are_renewed(self):
+        # A file which takes longer than the claim lease to process stays
+        # claimed until it is finished.
+        thief = Switchboard('test', self._queue_directory, 0, 2,
+                            steal_work=True, claim_lease=0.3)
+        filebase = self._enqueue_into(1, 1)[0]
+        thief.dequeue(filebase)
+        checkpoint = thief._checkpoint_file(filebase)
+        with open(checkpoint, 'w') as fp:
+            print('anne@example.com', file=fp)
+        time.sleep(1)
+        self._slices[1].recover_backup_files()
+        self.assertEqual(self._slices[1].files, [])
+        thief.finish(filebase)
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(os.listdir(self._queue_directory), [])
+        # Once the file is finished, its claim is no longer renewed.
+        time.sleep(0.2)
+        self.assertIsNone(thief._renewer)
+
+    def test_finish_recovered_file(self):
+        # When a file was recovered by its owner after all, finishing it
+        # leaves its checkpoint alone, since the recovered file needs it.
+        filebase = self._enqueue_into(1, 1)[0]
+        self._slices[0].dequeue(filebase)
+        checkpoint = self._slices[0]._checkpoint_file(filebase)
+        with open(checkpoint, 'w') as fp:
+            print('anne@example.com', file=fp)
+        bakfile = os.path.join(self._queue_directory, filebase + '.bak')
+        os.utime(bakfile, (time.time() - 1, time.time() - 1))
+        self._slices[1].recover_backup_files()
+        self._slices[0].finish(filebase)
+        self.assertTrue(os.path.exists(checkpoint))
+        self.assertEqual(self._slices[1].files, [filebase + '+1'])
+
+    def test_expired_claim_in_quiet_directory(self):
+        # A file whose claim expires is recovered, even when the queue
+        # directory hasn't changed since the file was first passed over.
+        filebase = self._enqueue_into(1, 1)[0]
+        self._slices[0].dequeue(filebase)
+        past = time.time() - 60
+        os.utime(self._queue_directory, (past, past))
+        self._slices[1].recover_backup_files()
+        self.assertEqual(self._slices[1].files, [])
+        bakfile = os.path.join(self._queue_directory, filebase + '.bak')
+        os.utime(bakfile, (time.time() - 1, time.time() - 1))
+        self._slices[1].recover_backup_files()
+        self.assertEqual(self._slices[1].files, [filebase + '+1'])
+
+
+
+class TestQueueHops(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._in = Switchboard('in', os.path.join(self._tempdir, 'in'))
+        self._out = Switchboard('out', os.path.join(self._tempdir, 'out'))
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_hops(self):
+        # Messages remember the queues they passed through, and when.
+        start = time.time()
+        filebase = self._in.enqueue(self._msg)
+        # The caller's message is left alone.
+        self.assertFalse(hasattr(self._msg, 'queue_hops'))
+        msg, msgdata = self._in.dequeue(filebase)
+        self._in.finish(filebase)
+        self.assertNotIn('queue_hops', msgdata)
+        out_filebase = self._out.enqueue(msg, msgdata)
+        self.assertEqual(len(msg.queue_hops), 1)
+        msg, msgdata = self._out.dequeue(out_filebase)
+        self._out.finish(out_filebase)
+        self.assertEqual([hop[0] for hop in msg.queue_hops], ['in', 'out'])
+        self.assertGreaterEqual(msg.queue_hops[0][1], start)
+        self.assertGreaterEqual(msg.queue_hops[1][1], msg.queue_hops[0][1])
+
+    def test_hops_are_capped(self):
+        # Only the most recent hops are remembered, along with the first one.
+        msg = self._msg
+        for count in range(MAX_HOPS + 5):
+            filebase = self._in.enqueue(msg, count=count)
+            msg, msgdata = self._in.dequeue(filebase)
+            self._in.finish(filebase)
+        self.assertEqual(len(msg.queue_hops), MAX_HOPS)
+        self.assertLess(msg.queue_hops[0][1], msg.queue_hops[1][1])
@@ -0,0 +1,125 @@
+"""Effective preferences table
+
+Revision ID: 3a8c2f6d1e47
+Revises: 2bb9b382198
+Create Date: 2015-06-02 10:41:27.512693
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3a8c2f6d1e47'
+down_revision = '2bb9b382198'
+
+from alembic import op
+import sqlalchemy as sa
+
+from mailman.database.types import Enum
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
+
+
+def upgrade():
+
+    ### Update the schema
+    op.create_table('effectivepreferences',
+        sa.Column('member_id', sa.Integer(), nullable=False),
+        sa.Column('list_id', sa.Unicode(), nullable=True),
+        sa.Column('role', Enum(MemberRole), nullable=True),
+        sa.Column('address_id', sa.Integer(), nullable=True),
+        sa.Column('email', sa.Unicode(), nullable=True),
+        sa.Column('explicit', sa.Boolean(), nullable=True),
+        sa.Column('delivery_mode', Enum(DeliveryMode), nullable=True),
+        sa.Column('delivery_status', Enum(DeliveryStatus), nullable=True),
+        sa.Column('receive_own_postings', sa.Boolean(), nullable=True),
+        sa.Column('receive_list_copy', sa.Boolean(), nullable=True),
+        sa.Column('preferred_language', sa.Unicode(), nullable=True),
+        sa.PrimaryKeyConstraint('member_id')
+        )
+    op.create_index(
+        'ix_effectivepreferences_list_id_role_delivery_mode',
+        'effectivepreferences', ['list_id', 'role', 'delivery_mode'])
+    op.create_index(
+        'ix_effectivepreferences_list_id_email',
+        'effectivepreferences', ['list_id', 'email'])
+
+    ### Now migrate the data
+    # don't import the table definitions from the models, they may break this
+    # migration when the models are updated in the future (see the Alembic
+    # doc)
+    member = sa.sql.table('member',
+        sa.sql.column('id'), sa.sql.column('list_id'), sa.sql.column('role'),
+        sa.sql.column('address_id'), sa.sql.column('user_id'),
+        sa.sql.column('preferences_id'),
+        )
+    address = sa.sql.table('address',
+        sa.sql.column('id'), sa.sql.column('email'), sa.sql.column('user_id'),
+        sa.sql.column('preferences_id'),
+        )
+    user = sa.sql.table('user',
+        sa.sql.column('id'), sa.sql.column('_preferred_address_id'),
+        sa.sql.column('preferences_id'),
+        )
+    preferences = sa.sql.table('preferences',
+        sa.sql.column('id'), sa.sql.column('delivery_mode'),
+        sa.sql.column('delivery_status'),
+        sa.sql.column('receive_own_postings'),
+        sa.sql.column('receive_list_copy'),
+        sa.sql.column('preferred_language'),
+        )
+    effective = sa.sql.table('effectivepreferences',
+        *[sa.sql.column(name) for name in (
+            'member_id', 'list_id', 'role', 'address_id', 'email', 'explicit',
+            'delivery_mode', 'delivery_status', 'receive_own_postings',
+            'receive_list_copy', 'preferred_language')])
+    member_preferences = preferences.alias('member_preferences')
+    member_user = user.alias('member_user')
+    member_address = address.alias('member_address')
+    address_preferences = preferences.alias('address_preferences')
+    address_user = user.alias('address_user')
+    user_preferences = preferences.alias('user_preferences')
+    # The system's default preferences, as of this revision.  Members
+    # without a preferred language of their own get their mailing list's.
+    defaults = (
+        ('delivery_mode', DeliveryMode.regular.value),
+        ('delivery_status', DeliveryStatus.enabled.value),
+        ('receive_own_postings', True),
+        ('receive_list_copy', True),
+        ('preferred_language', None),
+        )
+    columns = [
+        member.c.id, member.c.list_id, member.c.role, member_address.c.id,
+        member_address.c.email, member.c.address_id != None,
+        ]
+    for name, default in defaults:
+        levels = [table.c[name] for table in (
+            member_preferences, address_preferences, user_preferences)]
+        if default is not None:
+            levels.append(sa.literal(default))
+        columns.append(sa.func.coalesce(*levels))
+    joins = member.outerjoin(
+        member_preferences,
+        member.c.preferences_id == member_preferences.c.id,
+    ).outerjoin(
+        member_user, member.c.user_id == member_user.c.id,
+    ).outerjoin(
+        member_address, member_address.c.id == sa.func.coalesce(
+            member.c.address_id, member_user.c._preferred_address_id),
+    ).outerjoin(
+        address_preferences,
+        member_address.c.preferences_id == address_preferences.c.id,
+    ).outerjoin(
+        address_user, member_address.c.user_id == address_user.c.id,
+    ).outerjoin(
+        user_preferences,
+        address_user.c.preferences_id == user_preferences.c.id,
+    )
+    op.execute(effective.insert().from_select(
+        [column.name for column in effective.columns],
+        sa.select(columns).select_from(joins)))
+
+
+def downgrade():
+    op.drop_index('ix_effectivepreferences_list_id_email',
+                  'effectivepreferences')
+    op.drop_index('ix_effectivepreferences_list_id_role_delivery_mode',
+                  'effectivepreferences')
+    op.drop_table('effectivepreferences')
@@ -0,0 +1,42 @@
+"""Mailing list recipients version
+
+Revision ID: 4f1b7d3e2a95
+Revises: 3a8c2f6d1e47
+Create Date: 2015-06-09 14:22:05.731846
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f1b7d3e2a95'
+down_revision = '3a8c2f6d1e47'
+
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    ### Update the schema
+    op.add_column('mailinglist', sa.Column(
+        'recipients_version', sa.Unicode(), nullable=True))
+
+    ### Now migrate the data
+    # don't import the table definition from the models, it may break this
+    # migration when the model is updated in the future (see the Alembic doc)
+    mlist = sa.sql.table('mailinglist',
+        sa.sql.column('id', sa.Integer),
+        sa.sql.column('recipients_version', sa.Unicode),
+        )
+    # every mailing list gets a version of its own
+    connection = op.get_bind()
+    for (mlist_id,) in connection.execute(sa.select([mlist.c.id])).fetchall():
+        connection.execute(mlist.update().where(mlist.c.id == mlist_id).values(
+            recipients_version=uuid.uuid4().hex))
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        # SQLite does not support dropping columns.
+        op.drop_column('mailinglist', 'recipients_version')
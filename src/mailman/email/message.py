@@ -20,10 +20,11 @@
 This is a subclass of email.message.Message but provides a slightly extended
 interface which is more convenient for use inside Mailman.  It also supports
 safe pickle deserialization, even if the email package adds additional Message
-attributes.
+attributes, and it remembers its flattened form until it is changed.
 """
 
 __all__ = [
+    'LazyMessage',
     'Message',
     'MultipartDigestMessage',
     'OwnerNotification',
@@ -31,8 +32,11 @@ __all__ = [
     ]
 
 
+import re
 import email
+import itertools
 import email.message
+import email.parser
 import email.utils
 
 from email.header import Header
@@ -41,14 +45,50 @@ from mailman.config import config
 
 
 COMMASPACE = ', '
+# The blank line separating a message's headers from its body.
+BLANK_LINE = re.compile(rb'\r?\n\r?\n')
+# Every change to any message gets a new number from here.
+_generations = itertools.count(1)
+
+
+
+def _tracked(name):
+    """Return a property for an attribute whose changes are tracked."""
+    def getter(self):
+        return self.__dict__.get(name)
+    def setter(self, value):
+        self.__dict__[name] = value
+        self._changed()
+    return property(getter, setter)
+
+
+def _changing(name):
+    """Return a method which changes the message, like the base class's."""
+    method = getattr(email.message.Message, name)
+    def wrapper(self, *args, **kws):
+        result = method(self, *args, **kws)
+        self._changed()
+        return result
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
 
 
 
 class Message(email.message.Message):
+    # The number of the last change to this message, or 0 if it hasn't been
+    # changed since it was unpickled from an older version.
+    _generation = 0
+
     # BAW: For debugging w/ bin/dumpdb.  Apparently pprint uses repr.
     def __repr__(self):
         return self.__str__()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_flattened', None)
+        return state
+
     def __setstate__(self, values):
         # The base class has grown and changed attributes over time.  This can
         # break messages sitting in Mailman's queues at the time of upgrading
@@ -57,6 +97,83 @@ class Message(email.message.Message):
         # using Python 2.6's email package version 4.0.1 as a base line here.
         self.__dict__ = values
 
+    # Flattening the message is expensive, so its flattened forms are kept
+    # until the message or any of its parts changes.  Every change sets the
+    # part's generation to a number no part had before, so the generations
+    # of all the parts tell whether anything changed since the message was
+    # flattened.  Changing a Header instance in place, or the headers list
+    # behind the message's back, is not noticed.
+
+    _payload = _tracked('_payload')
+    preamble = _tracked('preamble')
+    epilogue = _tracked('epilogue')
+
+    __setitem__ = _changing('__setitem__')
+    __delitem__ = _changing('__delitem__')
+    add_header = _changing('add_header')
+    replace_header = _changing('replace_header')
+    set_raw = _changing('set_raw')
+    set_payload = _changing('set_payload')
+    attach = _changing('attach')
+    set_charset = _changing('set_charset')
+    set_boundary = _changing('set_boundary')
+    set_default_type = _changing('set_default_type')
+    set_unixfrom = _changing('set_unixfrom')
+
+    def _changed(self):
+        self.__dict__['_generation'] = next(_generations)
+
+    def _fingerprint(self):
+        """The generations of all the parts, or None if they're unknown."""
+        generations = []
+        parts = [self]
+        while len(parts) > 0:
+            part = parts.pop()
+            # Changes to other kinds of parts are not tracked.
+            if not isinstance(part, Message):
+                return None
+            generations.append(part._generation)
+            payload = part._payload
+            if isinstance(payload, list):
+                generations.append(len(payload))
+                parts.extend(payload)
+        return tuple(generations)
+
+    def _flatten(self, form, flatten):
+        fingerprint = self._fingerprint()
+        cached = self.__dict__.get('_flattened')
+        if (fingerprint is not None and cached is not None and
+                cached[0] == fingerprint and form in cached[1]):
+            return cached[1][form]
+        flattened = flatten()
+        # Flattening can change the message, e.g. by making up a boundary.
+        fingerprint = self._fingerprint()
+        if fingerprint is not None:
+            if cached is None or cached[0] != fingerprint:
+                cached = self.__dict__['_flattened'] = (fingerprint, {})
+            cached[1][form] = flattened
+        return flattened
+
+    def as_string(self, unixfrom=False, maxheaderlen=0, policy=None):
+        """See `email.message.Message`.
+
+        The flattened message is kept until the message changes.
+        """
+        flatten = super(Message, self).as_string
+        if unixfrom or maxheaderlen != 0 or policy is not None:
+            return flatten(unixfrom, maxheaderlen, policy)
+        return self._flatten('string', flatten)
+
+    def as_bytes(self, unixfrom=False, policy=None):
+        """See `email.message.Message`.
+
+        The flattened message is kept until the message changes.
+        """
+        flatten = super(Message, self).as_bytes
+        if unixfrom or policy is not None:
+            return flatten(unixfrom, policy)
+        return self._flatten('bytes', flatten)
+
     @property
     def sender(self):
         """The address considered to be the author of the email.
@@ -118,6 +235,122 @@ class Message(email.message.Message):
         return clean_senders
 
 
+
+def _parsed_lazily(name):
+    """Return a property for an attribute which is set by parsing the body."""
+    def getter(self):
+        if self.__dict__.get('_raw') is not None:
+            self._parse_body()
+        return self.__dict__.get(name)
+    def setter(self, value):
+        # Parse the body first so that it doesn't later overwrite the new
+        # value.
+        if self.__dict__.get('_raw') is not None:
+            self._parse_body()
+        self.__dict__[name] = value
+        self._changed()
+    return property(getter, setter)
+
+
+def _describing_body(name):
+    """Return a header changing method which keeps the body consistent."""
+    method = getattr(Message, name)
+    def wrapper(self, header, *args, **kws):
+        # The Content-* headers describe the body, e.g. its MIME boundary or
+        # transfer encoding, so the original bytes of the body can't be used
+        # anymore once they change.  Parse the body according to the original
+        # headers first, so that it is generated again according to the new
+        # ones.
+        if (self.__dict__.get('_raw') is not None and
+                str(header).lower().startswith('content-')):
+            self._parse_body()
+        return method(self, header, *args, **kws)
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+
+class LazyMessage(Message):
+    """A message whose body is only parsed when it is first needed.
+
+    The headers are parsed up front, so that anything which only looks at the
+    headers never pays for building the message's MIME tree.  The first
+    access to the payload (including flattening the message or walking its
+    parts) parses the original bytes in full.
+    """
+
+    def __init__(self, *args, **kws):
+        self.__dict__['_raw'] = None
+        self.__dict__['_body_offset'] = None
+        super().__init__(*args, **kws)
+
+    _payload = _parsed_lazily('_payload')
+    preamble = _parsed_lazily('preamble')
+    epilogue = _parsed_lazily('epilogue')
+    defects = _parsed_lazily('defects')
+
+    __setitem__ = _describing_body('__setitem__')
+    __delitem__ = _describing_body('__delitem__')
+    add_header = _describing_body('add_header')
+    replace_header = _describing_body('replace_header')
+    set_raw = _describing_body('set_raw')
+
+    def set_boundary(self, boundary):
+        # This rewrites the Content-Type header behind __setitem__'s back.
+        if self.__dict__.get('_raw') is not None:
+            self._parse_body()
+        super().set_boundary(boundary)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Create a message from its RFC 5322 bytes, parsing only headers.
+
+        :param data: The message bytes.
+        :type data: bytes
+        :return: The message.
+        :rtype: `LazyMessage`
+        """
+        match = BLANK_LINE.search(data)
+        header_block = (data if match is None else data[:match.end()])
+        msg = email.parser.BytesParser(_class=cls).parsebytes(
+            header_block, headersonly=True)
+        # When something other than a header precedes the first blank line,
+        # the parser takes it to be the start of the body.  The body will be
+        # parsed again anyway, but then it doesn't start after the blank line.
+        clean = (match is not None and msg.__dict__['_payload'] == '')
+        msg.__dict__['_raw'] = data
+        msg.__dict__['_body_offset'] = (match.end() if clean else None)
+        return msg
+
+    @property
+    def unparsed_body(self):
+        """The original bytes of the body, if it hasn't been parsed yet.
+
+        This is None once the body has been parsed, or if the body doesn't
+        cleanly start after the first blank line.
+        """
+        raw = self.__dict__['_raw']
+        offset = self.__dict__['_body_offset']
+        if raw is None or offset is None:
+            return None
+        return raw[offset:]
+
+    def _parse_body(self):
+        raw = self.__dict__['_raw']
+        self.__dict__['_raw'] = None
+        self.__dict__['_body_offset'] = None
+        parsed = email.message_from_bytes(raw, Message)
+        # Keep our own headers, since they may have been changed.
+        for name in ('_payload', 'preamble', 'epilogue', 'defects'):
+            self.__dict__[name] = parsed.__dict__[name]
+
+    def __getstate__(self):
+        if self.__dict__['_raw'] is not None:
+            self._parse_body()
+        return super().__getstate__()
+
+
 
 class MultipartDigestMessage(MIMEMultipart, Message):
     """Mix-in class for MIME digest messages."""
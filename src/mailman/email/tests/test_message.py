@@ -18,20 +18,58 @@
 """Test the message API."""
 
 __all__ = [
+    'TestFlattenedCache',
+    'TestLazyMessage',
     'TestMessage',
     'TestMessageSubclass',
     ]
 
 
+import io
+import copy
+import pickle
 import unittest
 
+from email.generator import Generator
+from email.mime.text import MIMEText
 from email.parser import FeedParser
 from mailman.app.lifecycle import create_list
-from mailman.email.message import Message, UserNotification
-from mailman.testing.helpers import get_queue_messages
+from mailman.config import config
+from mailman.email.message import LazyMessage, Message, UserNotification
+from mailman.testing.helpers import (
+    get_queue_messages, specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 
 
+MULTIPART = """\
+From: anne@example.com
+To: test@example.com
+Subject: A test
+Message-ID: <ant>
+Approved: secret
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+--BOUNDARY
+Content-Type: text/plain
+
+A message.
+--BOUNDARY
+Content-Type: text/html
+
+<p>A message.</p>
+--BOUNDARY--
+"""
+
+
+def _uncached(msg):
+    # Flatten the message like as_string() does, without the cache.
+    fp = io.StringIO()
+    Generator(fp, mangle_from_=False, maxheaderlen=0,
+              policy=msg.policy).flatten(msg)
+    return fp.getvalue()
+
+
 
 class TestMessage(unittest.TestCase):
     """Test the message API."""
@@ -88,3 +126,187 @@ Test content
         except TypeError as error:
             self.fail(error)
         self.assertEqual(filename, u'd\xe9jeuner.txt')
+
+
+
+class TestLazyMessage(unittest.TestCase):
+    def setUp(self):
+        self._msg = LazyMessage.from_bytes(b"""\
+From: anne@example.com
+Subject: Parts
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+The preamble.
+--BOUNDARY
+Content-Type: text/plain
+
+The first part.
+--BOUNDARY--
+""")
+
+    def test_headers_without_body(self):
+        # The headers are available before the body is parsed.
+        self.assertEqual(self._msg['subject'], 'Parts')
+        self.assertEqual(self._msg.get_content_type(), 'multipart/mixed')
+        self.assertTrue(self._msg.unparsed_body.startswith(b'The preamble.'))
+
+    def test_body_parsed_on_demand(self):
+        self.assertTrue(self._msg.is_multipart())
+        self.assertIsNone(self._msg.unparsed_body)
+        self.assertEqual(self._msg.preamble, 'The preamble.')
+        self.assertEqual(self._msg.get_payload(0).get_payload(),
+                         'The first part.')
+
+    def test_header_changes_survive_parsing(self):
+        del self._msg['subject']
+        self._msg['Subject'] = 'Changed'
+        self.assertEqual(len(self._msg.get_payload()), 1)
+        self.assertEqual(self._msg.get_all('subject'), ['Changed'])
+
+    def test_set_boundary(self):
+        # Changing the headers which describe the body parses the body, so
+        # that it is generated again to match.
+        self._msg.set_boundary('NEW')
+        self.assertIsNone(self._msg.unparsed_body)
+        text = self._msg.as_string()
+        self.assertIn('boundary="NEW"', text)
+        self.assertIn('--NEW\n', text)
+        self.assertNotIn('--BOUNDARY', text)
+
+    def test_content_headers(self):
+        for name in ('Content-Transfer-Encoding', 'content-type'):
+            msg = LazyMessage.from_bytes(self._msg.as_bytes())
+            del msg[name]
+            self.assertIsNone(msg.unparsed_body, name)
+        msg = LazyMessage.from_bytes(self._msg.as_bytes())
+        msg.replace_header('Content-Type', 'multipart/mixed; boundary="X"')
+        self.assertIsNone(msg.unparsed_body)
+        # Other headers leave the body alone.
+        msg = LazyMessage.from_bytes(self._msg.as_bytes())
+        msg['X-Added'] = 'yes'
+        del msg['subject']
+        self.assertIsNotNone(msg.unparsed_body)
+
+    def test_set_payload(self):
+        self._msg.set_payload('Replaced')
+        self.assertIsNone(self._msg.unparsed_body)
+        self.assertEqual(self._msg.get_payload(), 'Replaced')
+        # The rest of the body was still parsed.
+        self.assertEqual(self._msg.preamble, 'The preamble.')
+
+    def test_pickle(self):
+        msg = pickle.loads(pickle.dumps(self._msg))
+        self.assertEqual(msg.as_string(), self._msg.as_string())
+
+    def test_no_blank_line(self):
+        # Without a clean break between headers and body, the body can still
+        # be parsed, just not copied as is.
+        msg = LazyMessage.from_bytes(b"""\
+From: anne@example.com
+This is not a header.
+
+Neither is this.
+""")
+        self.assertIsNone(msg.unparsed_body)
+        self.assertEqual(msg['from'], 'anne@example.com')
+        self.assertEqual(msg.get_payload(),
+                         'This is not a header.\n\nNeither is this.\n')
+
+
+
+
+class TestFlattenedCache(unittest.TestCase):
+    """Test that the flattened message is kept until the message changes."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs(MULTIPART)
+        self._text = self._msg.as_string()
+
+    def _assertCoherent(self, msg, reason=None):
+        self.assertEqual(msg.as_string(), _uncached(msg), reason)
+
+    def test_flattened_once(self):
+        self.assertIs(self._msg.as_string(), self._text)
+        self.assertIs(str(self._msg), self._text)
+        data = self._msg.as_bytes()
+        self.assertIs(self._msg.as_bytes(), data)
+        self.assertIs(bytes(self._msg), data)
+        # Flattening any other way isn't cached.
+        self.assertTrue(
+            self._msg.as_string(unixfrom=True).startswith('From nobody'))
+        self.assertIs(self._msg.as_string(), self._text)
+
+    def test_header_changes(self):
+        self._msg['X-Test'] = 'one'
+        self._assertCoherent(self._msg)
+        self._msg.replace_header('X-Test', 'two')
+        self._assertCoherent(self._msg)
+        del self._msg['x-test']
+        self._assertCoherent(self._msg)
+        self._msg.add_header('X-Test', 'three', param='four')
+        self._assertCoherent(self._msg)
+        self._msg.set_param('charset', 'utf-8', header='X-Test')
+        self._assertCoherent(self._msg)
+        self._msg.set_boundary('CHANGED')
+        self._assertCoherent(self._msg)
+        self.assertIn('--CHANGED--', self._msg.as_string())
+
+    def test_part_changes(self):
+        part = self._msg.get_payload(1)
+        part['X-Test'] = 'one'
+        self._assertCoherent(self._msg)
+        part.set_payload('<p>Changed</p>')
+        self._assertCoherent(self._msg)
+        part._payload = '<p>Changed again</p>'
+        self._assertCoherent(self._msg)
+        self._msg.preamble = 'A preamble.'
+        self._assertCoherent(self._msg)
+        # The parts can be changed in place too.
+        payload = self._msg.get_payload()
+        payload.reverse()
+        self._assertCoherent(self._msg)
+        payload.append(mfs('Content-Type: text/plain\n\nA footer.\n'))
+        self._assertCoherent(self._msg)
+        del payload[0]
+        self._assertCoherent(self._msg)
+
+    def test_foreign_parts(self):
+        # Changes to parts which aren't Mailman messages can't be tracked,
+        # so messages with such parts are flattened every time.
+        part = MIMEText('A footer.')
+        self._msg.attach(part)
+        self._assertCoherent(self._msg)
+        part.set_payload('Changed.')
+        self._assertCoherent(self._msg)
+
+    def test_copies(self):
+        msg = copy.deepcopy(self._msg)
+        self.assertEqual(msg.as_string(), self._text)
+        msg['X-Test'] = 'one'
+        self._assertCoherent(msg)
+        self.assertIs(self._msg.as_string(), self._text)
+        # The flattened message isn't pickled.
+        state = pickle.loads(pickle.dumps(self._msg)).__dict__
+        self.assertNotIn('_flattened', state)
+
+    def test_lazy_message(self):
+        msg = LazyMessage.from_bytes(self._msg.as_bytes())
+        self._assertCoherent(msg)
+        msg.get_payload(0).set_payload('Changed.')
+        self._assertCoherent(msg)
+
+    def test_handlers(self):
+        # The flattened message stays coherent with whatever the handlers do
+        # to the message.
+        mlist = create_list('test@example.com')
+        mlist.subject_prefix = '[Test] '
+        mlist.filter_content = True
+        mlist.filter_types = ['text/html']
+        for name in sorted(config.handlers):
+            msg = mfs(MULTIPART)
+            msg.as_string()
+            msgdata = dict(recipients={'bart@example.com'})
+            config.handlers[name].process(mlist, msg, msgdata)
+            self._assertCoherent(msg, name)
@@ -31,6 +31,9 @@ __all__ = [
 from email.utils import getaddresses, formataddr
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+from mailman.interfaces.preferences import IEffectivePreferencesManager
+from zope.component import getUtility
 from zope.interface import implementer
 
 
@@ -48,8 +51,11 @@ class AvoidDuplicates:
     def process(self, mlist, msg, msgdata):
         """See `IHandler`."""
         recips = msgdata.get('recipients')
+        # The recipients of streamed postings aren't known yet.  See the
+        # member-recipients handler.
+        streaming = msgdata.get('streaming', False)
         # Short circuit
-        if not recips:
+        if not recips and not streaming:
             return
         # Seed this set with addresses we don't care about dup avoiding.
         listaddrs = set((mlist.posting_address,
@@ -78,6 +84,21 @@ class AvoidDuplicates:
             # No one was explicitly addressed, so we can't do any dup
             # collapsing
             return
+        # Look up the preferences of the explicit recipients all at once.
+        manager = getUtility(IEffectivePreferencesManager)
+        if streaming:
+            # Only the explicit recipients matter, as long as they are
+            # regular members who are getting the message at all.
+            preferences = manager.get_preferences(mlist, explicit_recips)
+            excluded = msgdata.get('excluded_recipients', set())
+            recips = set(
+                email for email, member in preferences.items()
+                if member.delivery_mode == DeliveryMode.regular
+                and member.delivery_status == DeliveryStatus.enabled
+                and email not in excluded)
+        else:
+            preferences = manager.get_preferences(
+                mlist, explicit_recips.intersection(recips))
         newrecips = set()
         for r in recips:
             # If this recipient is explicitly addressed...
@@ -86,7 +107,7 @@ class AvoidDuplicates:
                 # If the member wants to receive duplicates, or if the
                 # recipient is not a member at all, they will get a copy.
                 # header.
-                member = mlist.members.get_member(r)
+                member = preferences.get(r)
                 if member and not member.receive_list_copy:
                     send_duplicate = False
                 # We'll send a duplicate unless the user doesn't wish it.  If
@@ -103,8 +124,16 @@ class AvoidDuplicates:
                 # list.  Add them to the newrecips list and flag them as
                 # having received this message.
                 newrecips.add(r)
-        # Set the new list of recipients.  XXX recips should always be a set.
-        msgdata['recipients'] = list(newrecips)
+        if streaming:
+            # Leave out whoever doesn't want a duplicate when the recipients
+            # are worked out.
+            if len(recips) > len(newrecips):
+                msgdata.setdefault('excluded_recipients', set()).update(
+                    recips - newrecips)
+        else:
+            # Set the new list of recipients.  XXX recips should always be a
+            # set.
+            msgdata['recipients'] = list(newrecips)
         # RFC 2822 specifies zero or one CC header
         if cc_addresses:
             del msg['cc']
@@ -21,6 +21,7 @@ __all__ = [
     'Decorate',
     'decorate',
     'decorate_template',
+    'member_substitutions',
     ]
 
 
@@ -51,14 +52,7 @@ def process(mlist, msg, msgdata):
     member = msgdata.get('member')
     if member is not None:
         # Calculate the extra personalization dictionary.
-        recipient = msgdata.get('recipient', member.address.original_email)
-        d['user_address'] = recipient
-        d['user_delivered_to'] = member.address.original_email
-        d['user_language'] = member.preferred_language.description
-        d['user_name'] = (member.user.display_name
-                          if member.user.display_name
-                          else member.address.original_email)
-        d['user_optionsurl'] = member.options_url
+        d.update(member_substitutions(member, msgdata.get('recipient')))
     # These strings are descriptive for the log file and shouldn't be i18n'd
     d.update(msgdata.get('decoration-data', {}))
     try:
@@ -198,6 +192,30 @@ def process(mlist, msg, msgdata):
 
 
 
+def member_substitutions(member, recipient=None):
+    """Return the personalized decoration substitutions for a member.
+
+    :param member: The member the message is being delivered to.
+    :type member: `IMember`
+    :param recipient: The address the message is being delivered to.  It
+        defaults to the member's address.
+    :type recipient: str
+    :return: The `user_*` substitutions.
+    :rtype: dict
+    """
+    email = member.address.original_email
+    return dict(
+        user_address=(email if recipient is None else recipient),
+        user_delivered_to=email,
+        user_language=member.preferred_language.description,
+        user_name=(member.user.display_name
+                   if member.user.display_name
+                   else email),
+        user_optionsurl=member.options_url,
+        )
+
+
+
 def decorate(mlist, uri, extradict=None):
     """Expand the decoration template from its URI."""
     if uri is None:
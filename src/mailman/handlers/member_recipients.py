@@ -32,8 +32,10 @@ from mailman.config import config
 from mailman.core import errors
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
-from mailman.interfaces.member import DeliveryStatus
+from mailman.interfaces.preferences import IEffectivePreferencesManager
+from mailman.interfaces.recipients import IRecipientsCache
 from mailman.utilities.string import wrap
+from zope.component import getUtility
 from zope.interface import implementer
 
 
@@ -53,7 +55,8 @@ class MemberRecipients:
             return
         # Should the original sender should be included in the recipients list?
         include_sender = True
-        member = mlist.members.get_member(msg.sender)
+        member = getUtility(IEffectivePreferencesManager).get_preferences(
+            mlist, [msg.sender]).get(msg.sender)
         if member and not member.receive_own_postings:
             include_sender = False
         # Support for urgent messages, which bypasses digests and disabled
@@ -83,13 +86,24 @@ Your urgent message to the $mlist.display_name mailing list was not authorized
 for delivery.  The original message as received by Mailman is attached.
 """)
                 raise errors.RejectMessage(wrap(text))
+        # The postings to very big mailing lists are streamed.  Their
+        # recipients are only worked out by the outgoing runners, a work
+        # unit at a time (see the to-outgoing handler), so just remember
+        # whoever is to be left out.
+        threshold = int(config.mta.streaming_threshold)
+        if (threshold > 0 and
+                mlist.regular_members.member_count >= threshold):
+            msgdata['streaming'] = True
+            if not include_sender:
+                msgdata.setdefault('excluded_recipients', set()).add(
+                    member.email)
+            return
         # Calculate the regular recipients of the message
-        recipients = set(member.address.email
-                         for member in mlist.regular_members.members
-                         if member.delivery_status == DeliveryStatus.enabled)
+        recipients = set(
+            getUtility(IRecipientsCache).get_regular_recipients(mlist))
         # Remove the sender if they don't want to receive their own posts
-        if not include_sender and member.address.email in recipients:
-            recipients.remove(member.address.email)
+        if not include_sender and member.email in recipients:
+            recipients.remove(member.email)
         # Handle topic classifications
         # XXX: Disabled for now until we fix it properly
         #do_topic_filters(mlist, msg, msgdata, recipients)
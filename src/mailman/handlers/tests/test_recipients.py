@@ -20,6 +20,7 @@
 __all__ = [
     'TestMemberRecipients',
     'TestOwnerRecipients',
+    'TestStreaming',
     ]
 
 
@@ -30,7 +31,8 @@ from mailman.config import config
 from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
 from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.helpers import (
-    configuration, specialized_message_from_string as mfs)
+    configuration, get_queue_messages,
+    specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 from zope.component import getUtility
 
@@ -208,3 +210,66 @@ To: test-owner@example.com
         self._process(self._mlist, self._msg, msgdata)
         self.assertEqual(msgdata['recipients'],
                          set(('siteadmin@example.com',)))
+
+
+
+class TestStreaming(unittest.TestCase):
+    """Test the postings whose recipients are streamed."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        manager = getUtility(IUserManager)
+        self._members = {}
+        for name in ('anne', 'bart', 'cris', 'dave'):
+            address = manager.create_address('{}@example.com'.format(name))
+            self._members[name] = self._mlist.subscribe(address)
+        # Anne doesn't get her own postings, Bart doesn't get duplicates, and
+        # Dave gets digests.
+        self._members['anne'].preferences.receive_own_postings = False
+        self._members['bart'].preferences.receive_list_copy = False
+        self._members['dave'].preferences.delivery_mode = (
+            DeliveryMode.mime_digests)
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Cc: bart@example.com, cris@example.com, elle@example.com
+
+""")
+
+    def _process(self, msgdata):
+        for name in ('member-recipients', 'avoid-duplicates', 'to-outgoing'):
+            config.handlers[name].process(self._mlist, self._msg, msgdata)
+
+    @configuration('mta', streaming_threshold=3, streaming_unit_size=2)
+    def test_work_units(self):
+        msgdata = {}
+        self._process(msgdata)
+        # The recipients are never worked out, only who is left out.
+        self.assertNotIn('recipients', msgdata)
+        self.assertTrue(msgdata['streaming'])
+        self.assertEqual(msgdata['excluded_recipients'],
+                         set(('anne@example.com', 'bart@example.com')))
+        self.assertEqual(msgdata['add-dup-header'],
+                         set(('cris@example.com',)))
+        # Bart doesn't get his copy through the mailing list.
+        self.assertEqual(self._msg['cc'],
+                         'cris@example.com, elle@example.com')
+        # There are three regular members, so two work units.
+        ids = sorted(member.id for name, member in self._members.items()
+                     if name != 'dave')
+        units = get_queue_messages('out', sort_on='message-id')
+        self.assertEqual(
+            sorted(tuple(unit.msgdata['recipient_range']) for unit in units),
+            [(ids[0], ids[1]), (ids[2], ids[2])])
+
+    @configuration('mta', streaming_threshold=4)
+    def test_below_threshold(self):
+        msgdata = {}
+        self._process(msgdata)
+        self.assertNotIn('streaming', msgdata)
+        self.assertEqual(sorted(msgdata['recipients']), ['cris@example.com'])
+        units = get_queue_messages('out')
+        self.assertEqual(len(units), 1)
+        self.assertNotIn('recipient_range', units[0].msgdata)
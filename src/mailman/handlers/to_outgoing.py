@@ -43,4 +43,14 @@ class ToOutgoing:
 
     def process(self, mlist, msg, msgdata):
         """See `IHandler`."""
-        config.switchboards['out'].enqueue(msg, msgdata, listid=mlist.list_id)
+        outq = config.switchboards['out']
+        if not msgdata.get('streaming', False):
+            outq.enqueue(msg, msgdata, listid=mlist.list_id)
+            return
+        # Streamed postings are split into work units, each naming a range of
+        # the regular members.  The outgoing runners work out the recipients
+        # of each unit when they deliver it.
+        size = int(config.mta.streaming_unit_size)
+        for recipient_range in mlist.regular_members.split(size):
+            outq.enqueue(msg, msgdata, listid=mlist.list_id,
+                         recipient_range=recipient_range)
@@ -18,6 +18,7 @@
 """Interface for mail transport agent integration."""
 
 __all__ = [
+    'IChunkingStrategy',
     'IMailTransportAgentAliases',
     'IMailTransportAgentDelivery',
     'IMailTransportAgentLifecycle',
@@ -31,10 +32,13 @@ from zope.interface import Interface
 
 class SomeRecipientsFailed(MailmanError):
     """Delivery to some or all recipients failed"""
-    def __init__(self, temporary_failures, permanent_failures):
+    def __init__(self, temporary_failures, permanent_failures, deferred=None):
         super(SomeRecipientsFailed, self).__init__()
         self.temporary_failures = temporary_failures
         self.permanent_failures = permanent_failures
+        # The recipients which weren't delivered to yet, by the time they
+        # are due.
+        self.deferred = ({} if deferred is None else deferred)
 
 
 
@@ -116,3 +120,37 @@ class IMailTransportAgentDelivery(Interface):
         :return: delivery failures as defined by `smtplib.SMTP.sendmail`
         :rtype: dictionary
         """
+
+
+
+
+class IChunkingStrategy(Interface):
+    """A way of splitting the recipients of a bulk delivery into chunks.
+
+    Every chunk is delivered to the MTA in its own SMTP transaction.  The
+    same strategy object is used for all the bulk deliveries of a process, so
+    it can learn from the results of earlier deliveries.
+    """
+
+    def chunkify(recipients, max_recipients):
+        """Split a set of recipients into chunks.
+
+        :param recipients: The set of recipient email addresses.
+        :type recipients: sequence of email address strings
+        :param max_recipients: The maximum number of recipients in a chunk.
+            Zero or less means there is no maximum.
+        :type max_recipients: integer
+        :return: The chunks, each holding no more than `max_recipients`
+            addresses.
+        :rtype: iterator of sets of strings
+        """
+
+    def learn(recipients, refused):
+        """Learn from the delivery of a chunk.
+
+        :param recipients: The recipients of the chunk.
+        :type recipients: set of email address strings
+        :param refused: The refused recipients of the chunk, as defined by
+            `smtplib.SMTP.sendmail`.
+        :type refused: dictionary
+        """
@@ -18,7 +18,10 @@
 """Interface for preferences."""
 
 __all__ = [
+    'IEffectivePreferences',
+    'IEffectivePreferencesManager',
     'IPreferences',
+    'PreferencesChangedEvent',
     ]
 
 
@@ -72,3 +75,91 @@ class IPreferences(Interface):
         which means that no preference is specified.
 
         XXX I'm not sure this is the right place to put this.""")
+
+
+
+class PreferencesChangedEvent:
+    """Event which gets triggered when members' resolved preferences change.
+
+    This includes members being subscribed or unsubscribed, and members'
+    addresses changing.  It gets triggered when the changes are flushed to
+    the database, once the members' `IEffectivePreferences` are up to date.
+    """
+
+    def __init__(self, list_ids):
+        self.list_ids = list_ids
+
+    def __str__(self):
+        return 'preferences changed on {0}'.format(
+            ', '.join(sorted(self.list_ids)))
+
+
+
+class IEffectivePreferences(Interface):
+    """A member's preferences, as they are resolved for delivery.
+
+    Each preference is the member's own, or else their address's, or else
+    their user's, or else the system's, exactly like the preferences of
+    `IMember`.  These are kept in the database, and are updated whenever any
+    of the preferences they are resolved from change.
+    """
+
+    member_id = Attribute(
+        """The database id of the member these are the preferences of.""")
+
+    list_id = Attribute("""The list id of the member's mailing list.""")
+
+    role = Attribute("""The member's role, as a `MemberRole`.""")
+
+    email = Attribute("""The email address the member is subscribed with.""")
+
+    delivery_mode = Attribute("""The member's `DeliveryMode`.""")
+
+    delivery_status = Attribute("""The member's `DeliveryStatus`.""")
+
+    receive_own_postings = Attribute(
+        """Does the member get a list copy of their own messages?""")
+
+    receive_list_copy = Attribute(
+        """Does the member get a list copy when they are explicitly named in
+        a message's recipients?""")
+
+    preferred_language = Attribute(
+        """The code of the member's preferred language, or None if neither
+        they nor their address or user have one.  In that case, the mailing
+        list's preferred language applies.""")
+
+
+
+class IEffectivePreferencesManager(Interface):
+    """The resolved preferences of all the members."""
+
+    def get_preferences(mlist, emails, role=None):
+        """Get the resolved preferences of many members at once.
+
+        This takes one query for every few hundred addresses, instead of
+        several for every member.
+
+        :param mlist: The mailing list.
+        :type mlist: `IMailingList`
+        :param emails: The email addresses of the members.
+        :type emails: iterable of strings
+        :param role: The role of the members.  Defaults to
+            `MemberRole.member`.
+        :type role: `MemberRole`
+        :return: The preferences of the addresses which are subscribed,
+            keyed by their email addresses.  Like `IRoster.get_member()`, an
+            address subscribed explicitly wins over the same address
+            subscribed as a user's preferred address.
+        :rtype: dict of `IEffectivePreferences`
+        """
+
+    def rebuild():
+        """Resolve everybody's preferences from scratch.
+
+        This is only needed when the preferences were changed behind the
+        database layer's back, e.g. by hand.
+
+        :return: The number of members whose preferences were resolved.
+        :rtype: int
+        """
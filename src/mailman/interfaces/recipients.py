@@ -0,0 +1,69 @@
+# Copyright (C) 2007-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Interface for the cache of mailing lists' recipients."""
+
+__all__ = [
+    'IRecipientsCache',
+    ]
+
+
+from zope.interface import Interface
+
+
+
+class IRecipientsCache(Interface):
+    """The recipients of each mailing list's postings and digests.
+
+    These are worked out from the delivery rosters the first time they are
+    asked for, and then kept until the mailing list's membership or its
+    members' preferences change.  Every mailing list has a version stamp in
+    the database, which changes along with them, so that all the processes
+    sharing the database agree on when the recipients have to be worked out
+    again.
+    """
+
+    def get_regular_recipients(mlist):
+        """The recipients of the mailing list's postings.
+
+        :param mlist: The mailing list.
+        :type mlist: `IMailingList`
+        :return: The email addresses of the regular members whose delivery
+            is enabled.
+        :rtype: frozenset of strings
+        """
+
+    def get_digest_recipients(mlist):
+        """The recipients of the mailing list's digests.
+
+        :param mlist: The mailing list.
+        :type mlist: `IMailingList`
+        :return: The case-preserved email addresses of the digest members
+            whose delivery is enabled, each along with their
+            `DeliveryMode`.
+        :rtype: frozenset of 2-tuples
+        """
+
+    def invalidate(list_ids):
+        """Forget the recipients of some mailing lists.
+
+        Their version stamps change too, so the other processes forget them
+        as well, once the current transaction is committed.
+
+        :param list_ids: The list ids of the mailing lists.
+        :type list_ids: iterable of strings
+        """
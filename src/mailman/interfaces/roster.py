@@ -18,6 +18,7 @@
 """Interface for a roster of members."""
 
 __all__ = [
+    'IDeliveryRoster',
     'IRoster',
     ]
 
@@ -68,6 +69,20 @@ class IRoster(Interface):
         :rtype: `IMember` or None
         """
 
+    def get_members(emails):
+        """Get the members for many addresses at once.
+
+        This is like calling ``get_member()`` for every address, but it
+        takes a constant number of database queries, and the members'
+        addresses, users and preferences are loaded along with them.
+
+        :param emails: The email addresses to search for.
+        :type emails: iterable of strings
+        :return: The members found, keyed by their email addresses.
+            Addresses which aren't subscribed are missing.
+        :rtype: dict
+        """
+
     def get_memberships(email):
         """Get the memberships for the given address.
 
@@ -76,3 +91,48 @@ class IRoster(Interface):
         :return: All the memberships associated with this email address.
         :rtype: sequence of length 0, 1, or 2 of ``IMember``
         """
+
+
+
+class IDeliveryRoster(IRoster):
+    """A roster of the members getting a particular kind of delivery.
+
+    The members' delivery modes are resolved in the database, along the same
+    chain of preferences as `IMember.delivery_mode`.
+    """
+
+    deliverable_addresses = Attribute(
+        """An iterator over the addresses which are to be delivered to.
+
+        These are the addresses of the members in this roster whose delivery
+        is enabled, resolved in the database along the same chain of
+        preferences as `IMember.delivery_status`.  Each is given as an
+        (`IAddress`, `DeliveryMode`) 2-tuple.
+        """)
+
+    def split(size):
+        """Split the deliverable addresses into ranges of members.
+
+        The members are read from the database a few at a time, so that this
+        takes little memory however big the roster is.
+
+        :param size: The greatest number of deliverable addresses in a range.
+        :type size: int
+        :return: The ranges, in order, as (first, last) 2-tuples of the
+            database ids of the members, as in
+            `IEffectivePreferences.member_id`.  The ranges include both
+            ends.
+        :rtype: iterator
+        """
+
+    def get_deliverable_addresses(first, last):
+        """The deliverable addresses of a range of members.
+
+        :param first: The database id of the first member of the range.
+        :type first: int
+        :param last: The database id of the last member of the range.
+        :type last: int
+        :return: Like `deliverable_addresses`, but only for the members in
+            the range.
+        :rtype: iterator
+        """
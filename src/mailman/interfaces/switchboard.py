@@ -57,9 +57,23 @@ class ISwitchboard(Interface):
         metadata.  The message file is preserved in a backup file, which must
         be removed by calling the .finish() method.
 
+        The `_checkpoint` metadata key is the path of a file in which the
+        progress made with the message can be recorded.  It is the same
+        after the file is recovered, and it is removed by .finish().
+
         Returned is a 2-tuple of the form (message, metadata).
         """
 
+    def restore(filebase):
+        """Put a dequeued file back into the queue.
+
+        The file can then be dequeued again.  This is used when the processing
+        of the message has been rolled back.
+
+        :param filebase: The base name of the dequeued file.
+        :type filebase: str
+        """
+
     def finish(filebase, preserve=False):
         """Remove the backup file for filebase.
 
@@ -73,12 +87,33 @@ class ISwitchboard(Interface):
         The base names of the matching files are returned.
         """)
 
-    def get_files(extension='.pck'):
+    def get_files(extension='.pck', count=None, until=None):
         """Like the 'files' attribute, but accepts an alternative extension.
 
         Only the files in the queue directory that have a matching extension
         are returned.  Like 'files', the base names of the matching files are
         returned.
+
+        :param extension: The file extension to match.
+        :type extension: str
+        :param count: If given, return at most this many of the matching
+            files, in the order in which they should be processed.
+        :type count: int
+        :param until: If given, only return the files which are due at this
+            time, in seconds since the epoch.  Messages enqueued with a
+            `deliver_after` time in the future are not due until then.
+        :type until: float
+        :return: The matching file bases, in the switchboard's scheduling
+            order (FIFO by default).
+        :rtype: list of str
+        """
+
+    def next_due():
+        """The time at which the earliest queue file is due.
+
+        :return: The time in seconds since the epoch, or None if the queue is
+            empty.
+        :rtype: float
         """
 
     def recover_backup_files():
@@ -86,5 +121,8 @@ class ISwitchboard(Interface):
 
         It is impossible for both the .bak and .pck files to exist at the same
         time, so moving them is enough to ensure that a normal dequeing
-        operation will handle them.
+        operation will handle them.  The recovered files are renamed to count
+        the number of times they were recovered, which `dequeue()` returns as
+        the `_bak_count` metadata key.  Files recovered too many times are
+        preserved in the bad queue instead.
         """
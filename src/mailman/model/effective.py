@@ -0,0 +1,322 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The members' preferences, resolved ahead of time.
+
+A member's preferences fall back to those of the address they are subscribed
+with, then to those of the address's user, then to the system's.  Resolving
+that for every member on every delivery takes several queries per member, so
+the resolved preferences are kept in a table of their own, with a row per
+member.
+
+The rows of the members whose preferences, memberships, addresses or users
+change are resolved again right after every flush of the session, so the
+table is always up to date as far as the session can tell.  A
+`PreferencesChangedEvent` then tells which mailing lists they are members of.
+"""
+
+__all__ = [
+    'EffectivePreferences',
+    'EffectivePreferencesManager',
+    ]
+
+
+from mailman.core.constants import system_preferences
+from mailman.database.model import Model
+from mailman.database.transaction import dbconnection
+from mailman.database.types import Enum
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
+from mailman.interfaces.preferences import (
+    IEffectivePreferences, IEffectivePreferencesManager,
+    PreferencesChangedEvent)
+from mailman.model.address import Address
+from mailman.model.member import Member
+from mailman.model.preferences import Preferences
+from sqlalchemy import (
+    Boolean, Column, Index, Integer, Unicode, event, func, inspect, literal,
+    or_, sql)
+from sqlalchemy.orm import Query, Session, aliased
+from zope.event import notify
+from zope.interface import implementer
+
+
+# The number of ids to look up in one query.  Some databases limit the number
+# of parameters of a query.
+BATCH_SIZE = 500
+
+# The names of the resolved preferences' columns, and the preferences they
+# are resolved from, in the order of the columns.
+PREFERENCES = (
+    ('delivery_mode', Preferences.delivery_mode),
+    ('delivery_status', Preferences.delivery_status),
+    ('receive_own_postings', Preferences.receive_own_postings),
+    ('receive_list_copy', Preferences.receive_list_copy),
+    ('preferred_language', Preferences._preferred_language),
+    )
+
+# The statement resolving the preferences, once it is built.
+_resolved = None
+
+
+
+@implementer(IEffectivePreferences)
+class EffectivePreferences(Model):
+    """See `IEffectivePreferences`."""
+
+    __tablename__ = 'effectivepreferences'
+
+    # The rows go away along with their members, in the same flush, so the
+    # member id isn't a foreign key.
+    member_id = Column(Integer, primary_key=True)
+    list_id = Column(Unicode)
+    role = Column(Enum(MemberRole))
+    address_id = Column(Integer)
+    email = Column(Unicode)
+    # Whether the member is subscribed with an explicit address, rather than
+    # their user's preferred address.
+    explicit = Column(Boolean)
+    delivery_mode = Column(Enum(DeliveryMode))
+    delivery_status = Column(Enum(DeliveryStatus))
+    receive_own_postings = Column(Boolean)
+    receive_list_copy = Column(Boolean)
+    preferred_language = Column(Unicode)
+
+    __table_args__ = (
+        Index('ix_effectivepreferences_list_id_role_delivery_mode',
+              list_id, role, delivery_mode),
+        Index('ix_effectivepreferences_list_id_email', list_id, email),
+        )
+
+    def __repr__(self):
+        return '<EffectivePreferences of member {0}>'.format(self.member_id)
+
+
+
+def _resolve():
+    """Select the members' resolved preferences.
+
+    The statement is only built the first time, since building it takes far
+    longer than running it for a few members.
+
+    :return: The statement selecting the columns of `EffectivePreferences`,
+        in order, and the aliases of the tables the preferences are resolved
+        from.
+    :rtype: 2-tuple of (`Select`, dict)
+    """
+    global _resolved
+    if _resolved is not None:
+        return _resolved
+    # Avoid circular imports.
+    from mailman.model.user import User
+    aliases = dict(
+        member_preferences=aliased(Preferences),
+        member_user=aliased(User),
+        address=aliased(Address),
+        address_preferences=aliased(Preferences),
+        address_user=aliased(User),
+        user_preferences=aliased(Preferences),
+        )
+    address = aliases['address']
+    columns = [
+        Member.id, Member.list_id, Member.role, address.id, address.email,
+        Member.address_id != None,
+        ]
+    for name, preference in PREFERENCES:
+        levels = [getattr(aliases[level], preference.key) for level in (
+            'member_preferences', 'address_preferences', 'user_preferences')]
+        # Without a preferred language of their own, members get their
+        # mailing list's.
+        if name != 'preferred_language':
+            levels.append(literal(getattr(system_preferences, name),
+                                  preference.type))
+        columns.append(func.coalesce(*levels))
+    query = Query(columns).select_from(Member).outerjoin(
+        aliases['member_preferences'],
+        Member.preferences_id == aliases['member_preferences'].id,
+    ).outerjoin(
+        aliases['member_user'], Member.user_id == aliases['member_user'].id,
+    ).outerjoin(
+        address, address.id == func.coalesce(
+            Member.address_id, aliases['member_user']._preferred_address_id),
+    ).outerjoin(
+        aliases['address_preferences'],
+        address.preferences_id == aliases['address_preferences'].id,
+    ).outerjoin(
+        aliases['address_user'], address.user_id == aliases['address_user'].id,
+    ).outerjoin(
+        aliases['user_preferences'],
+        aliases['address_user'].preferences_id ==
+            aliases['user_preferences'].id,
+    )
+    _resolved = (query.statement, aliases)
+    return _resolved
+
+
+def _insert(select):
+    table = EffectivePreferences.__table__
+    return table.insert().from_select(
+        [column.name for column in table.columns], select)
+
+
+def _batches(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        yield ids[start:start + BATCH_SIZE]
+
+
+def _expire(session, member_ids=None):
+    # The rows already loaded into the session are out of date.
+    for key, obj in list(session.identity_map.items()):
+        if (type(obj) is EffectivePreferences and
+                (member_ids is None or key[1][0] in member_ids)):
+            session.expire(obj)
+
+
+def _update(session, member_ids):
+    """Resolve the preferences of some members again.
+
+    :param session: The database session.
+    :param member_ids: The ids of the members.  The rows of the ones which
+        no longer exist are deleted.
+    :type member_ids: set of int
+    :return: The list ids of the members' mailing lists, as far as the old
+        rows tell.
+    :rtype: set of str
+    """
+    table = EffectivePreferences.__table__
+    select = _resolve()[0]
+    _expire(session, member_ids)
+    list_ids = set()
+    for batch in _batches(member_ids):
+        condition = table.c.member_id.in_(batch)
+        list_ids.update(list_id for (list_id,) in session.execute(
+            sql.select([table.c.list_id]).distinct().where(condition)))
+        session.execute(table.delete().where(condition))
+        session.execute(_insert(select.where(Member.id.in_(batch))))
+    return list_ids
+
+
+def _after_flush(session, flush_context):
+    """Resolve the preferences of the members affected by a flush."""
+    # Avoid circular imports.
+    from mailman.model.user import User
+    # The attributes the resolved preferences depend on.  New addresses,
+    # users and preferences only matter once they are linked to a member,
+    # which changes the member or whatever else they are linked to.
+    watched = {
+        Member: ('address_id', '_address', 'user_id', '_user',
+                 'preferences_id', 'preferences'),
+        Address: ('email', 'user_id', 'user', 'preferences_id',
+                  'preferences'),
+        User: ('_preferred_address_id', '_preferred_address',
+               'preferences_id', 'preferences'),
+        Preferences: tuple(preference.key for name, preference
+                           in PREFERENCES),
+        }
+    changed = {cls: set() for cls in watched}
+    # The new members have no rows to tell which mailing lists they are on.
+    list_ids = set()
+    for obj in session.new:
+        if type(obj) is Member:
+            changed[Member].add(obj.id)
+            list_ids.add(obj.list_id)
+    for obj in session.deleted:
+        if type(obj) in watched:
+            changed[type(obj)].add(obj.id)
+    for obj in session.dirty:
+        names = watched.get(type(obj))
+        if names is None:
+            continue
+        state = inspect(obj)
+        if any(state.attrs[name].history.has_changes() for name in names):
+            changed[type(obj)].add(obj.id)
+    if not any(changed.values()):
+        return
+    select, aliases = _resolve()
+    select = select.with_only_columns([Member.id])
+    # Which members' preferences could have changed?  Ask for as many of the
+    # changed rows at once as a query can take.
+    member_ids = set(changed[Member])
+    conditions = []
+    for ids, columns in (
+            (changed[Preferences], (aliases['member_preferences'].id,
+                                    aliases['address_preferences'].id,
+                                    aliases['user_preferences'].id)),
+            (changed[Address], (aliases['address'].id,)),
+            (changed[User], (aliases['member_user'].id,
+                             aliases['address_user'].id)),
+            ):
+        for batch in _batches(ids):
+            conditions.extend((len(batch), column.in_(batch))
+                              for column in columns)
+    while len(conditions) > 0:
+        size = 0
+        for count, (length, condition) in enumerate(conditions):
+            size += length
+            if count > 0 and size > BATCH_SIZE:
+                break
+        else:
+            count = len(conditions)
+        member_ids.update(member_id for (member_id,) in session.execute(
+            select.where(or_(*[
+                condition for length, condition in conditions[:count]]))))
+        del conditions[:count]
+    list_ids.update(_update(session, member_ids))
+    if len(list_ids) > 0:
+        notify(PreferencesChangedEvent(list_ids))
+
+
+event.listen(Session, 'after_flush', _after_flush)
+
+
+
+@implementer(IEffectivePreferencesManager)
+class EffectivePreferencesManager:
+    """See `IEffectivePreferencesManager`."""
+
+    @dbconnection
+    def get_preferences(self, store, mlist, emails, role=None):
+        """See `IEffectivePreferencesManager`."""
+        role = (MemberRole.member if role is None else role)
+        emails = list(set(emails))
+        preferences = {}
+        for start in range(0, len(emails), BATCH_SIZE):
+            batch = emails[start:start + BATCH_SIZE]
+            query = store.query(EffectivePreferences).filter(
+                EffectivePreferences.list_id == mlist.list_id,
+                EffectivePreferences.role == role,
+                EffectivePreferences.email.in_(batch))
+            for row in query:
+                # The explicit subscriptions win.
+                other = preferences.get(row.email)
+                if other is None or row.explicit:
+                    preferences[row.email] = row
+        return preferences
+
+    @dbconnection
+    def rebuild(self, store):
+        """See `IEffectivePreferencesManager`."""
+        # Flush first, so that nothing is resolved again afterward.
+        store.flush()
+        _expire(store)
+        store.execute(EffectivePreferences.__table__.delete())
+        store.execute(_insert(_resolve()[0]))
+        list_ids = set(list_id for (list_id,) in store.query(
+            EffectivePreferences.list_id).distinct())
+        if len(list_ids) > 0:
+            notify(PreferencesChangedEvent(list_ids))
+        return store.query(EffectivePreferences).count()
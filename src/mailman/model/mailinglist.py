@@ -23,6 +23,7 @@ __all__ = [
 
 
 import os
+import uuid
 
 from mailman.config import config
 from mailman.database.model import Model
@@ -89,6 +90,10 @@ class MailingList(Model):
     anonymous_list = Column(Boolean)
     # Attributes not directly modifiable via the web u/i
     created_at = Column(DateTime)
+    # Changed to a new random value whenever the recipients of the mailing
+    # list's postings or digests may have changed.  See
+    # `mailman.model.recipients`.
+    recipients_version = Column(Unicode)
     # Attributes which are directly modifiable via the web u/i.  The more
     # complicated attributes are currently stored as pickles, though that
     # will change as the schema and implementation is developed.
@@ -198,6 +203,7 @@ class MailingList(Model):
         self._list_id = '{0}.{1}'.format(listname, hostname)
         # For the pending database
         self.next_request_id = 1
+        self.recipients_version = uuid.uuid4().hex
         # We need to set up the rosters.  Normally, this method will get called
         # when the MailingList object is loaded from the database, but when the
         # constructor is called, SQLAlchemy's `load` event isn't triggered.
@@ -63,6 +63,10 @@ class Member(Model):
     preferences = relationship('Preferences')
     user_id = Column(Integer, ForeignKey('user.id'))
     _user = relationship('User')
+    _mailing_list = relationship(
+        'MailingList',
+        primaryjoin='foreign(Member.list_id) == MailingList._list_id',
+        viewonly=True)
 
     def __init__(self, role, list_id, subscriber):
         self._member_id = uid_factory.new_uid()
@@ -96,8 +100,11 @@ class Member(Model):
     @property
     def mailing_list(self):
         """See `IMember`."""
-        list_manager = getUtility(IListManager)
-        return list_manager.get_by_list_id(self.list_id)
+        mlist = self._mailing_list
+        if mlist is None:
+            # The membership hasn't been flushed to the database yet.
+            mlist = getUtility(IListManager).get_by_list_id(self.list_id)
+        return mlist
 
     @property
     def member_id(self):
@@ -131,9 +138,10 @@ class Member(Model):
     @property
     def user(self):
         """See `IMember`."""
+        # The user controlling the explicit address is the one linked to it.
         return (self._user
                 if self._address is None
-                else getUtility(IUserManager).get_user(self._address.email))
+                else self._address.user)
 
     @property
     def subscriber(self):
@@ -0,0 +1,169 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The cache of mailing lists' recipients.
+
+The recipients of a posting are worked out with a query over the mailing
+list's whole membership, though the membership rarely changes between
+postings.  So the recipients are kept in each process, and optionally in a
+file in the mailing list's data directory, where the other processes and the
+next runs can pick them up.
+
+Every mailing list's `recipients_version` changes to a new random value
+whenever its membership or its members' preferences change, and the cached
+recipients are only used for as long as it doesn't.  Unlike a counter, a
+random version can't come back when a mailing list is deleted and created
+again.
+"""
+
+__all__ = [
+    'RecipientsCache',
+    'handle_MembershipChangeEvent',
+    'handle_PreferencesChangedEvent',
+    ]
+
+
+import os
+import uuid
+import pickle
+
+from mailman.config import config
+from mailman.database.transaction import dbconnection
+from mailman.interfaces.member import MembershipChangeEvent
+from mailman.interfaces.preferences import PreferencesChangedEvent
+from mailman.interfaces.recipients import IRecipientsCache
+from mailman.model.effective import BATCH_SIZE
+from mailman.model.mailinglist import MailingList
+from zope.component import getUtility
+from zope.interface import implementer
+
+
+# The files the recipients are cached in, in the mailing list's data
+# directory.
+FILENAMES = dict(
+    regular='regular-recipients.pck',
+    digest='digest-recipients.pck',
+    )
+
+
+
+def _regular_recipients(mlist):
+    return frozenset(
+        address.email for address, delivery_mode
+        in mlist.regular_members.deliverable_addresses)
+
+
+def _digest_recipients(mlist):
+    return frozenset(
+        (address.original_email, delivery_mode) for address, delivery_mode
+        in mlist.digest_members.deliverable_addresses)
+
+
+def _load(path, version):
+    try:
+        with open(path, 'rb') as fp:
+            cached = pickle.load(fp)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        # There is no file yet, or it is corrupt.
+        return None
+    if cached.get('version') != version:
+        return None
+    return cached['recipients']
+
+
+def _save(path, version, recipients):
+    # Several processes may be saving the same recipients at once.
+    tmpfile = '{0}.{1}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmpfile, 'wb') as fp:
+            pickle.dump(dict(version=version, recipients=recipients), fp,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, path)
+    except OSError:
+        # The recipients are still cached in memory.
+        pass
+
+
+
+@implementer(IRecipientsCache)
+class RecipientsCache:
+    """See `IRecipientsCache`."""
+
+    def __init__(self):
+        # The cached recipients and their versions, by list id and kind.
+        self._cache = {}
+
+    @dbconnection
+    def _get_version(self, store, list_id):
+        # The version may have been changed by another process, or behind the
+        # back of the mailing list object, so always ask the database.
+        return store.query(MailingList.recipients_version).filter(
+            MailingList._list_id == list_id).scalar()
+
+    def _get(self, mlist, kind, compute):
+        where = config.mailman.recipient_cache
+        if where == 'none':
+            return compute(mlist)
+        key = (mlist.list_id, kind)
+        version = self._get_version(mlist.list_id)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        path = os.path.join(mlist.data_path, FILENAMES[kind])
+        recipients = (_load(path, version) if where == 'disk' else None)
+        if recipients is None:
+            recipients = compute(mlist)
+            if where == 'disk':
+                _save(path, version, recipients)
+        self._cache[key] = (version, recipients)
+        return recipients
+
+    def get_regular_recipients(self, mlist):
+        """See `IRecipientsCache`."""
+        return self._get(mlist, 'regular', _regular_recipients)
+
+    def get_digest_recipients(self, mlist):
+        """See `IRecipientsCache`."""
+        return self._get(mlist, 'digest', _digest_recipients)
+
+    @dbconnection
+    def invalidate(self, store, list_ids):
+        """See `IRecipientsCache`."""
+        list_ids = sorted(set(list_ids))
+        for key in list(self._cache):
+            if key[0] in list_ids:
+                del self._cache[key]
+        table = MailingList.__table__
+        version = uuid.uuid4().hex
+        for start in range(0, len(list_ids), BATCH_SIZE):
+            batch = list_ids[start:start + BATCH_SIZE]
+            store.execute(table.update().where(
+                table.c.list_id.in_(batch)).values(
+                    recipients_version=version))
+
+
+
+def handle_MembershipChangeEvent(event):
+    if not isinstance(event, MembershipChangeEvent):
+        return
+    getUtility(IRecipientsCache).invalidate([event.mlist.list_id])
+
+
+def handle_PreferencesChangedEvent(event):
+    if not isinstance(event, PreferencesChangedEvent):
+        return
+    getUtility(IRecipientsCache).invalidate(event.list_ids)
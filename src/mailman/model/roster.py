@@ -35,14 +35,22 @@ __all__ = [
 
 
 from mailman.database.transaction import dbconnection
-from mailman.interfaces.member import DeliveryMode, MemberRole
-from mailman.interfaces.roster import IRoster
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
+from mailman.interfaces.roster import IDeliveryRoster, IRoster
 from mailman.model.address import Address
+from mailman.model.effective import EffectivePreferences
 from mailman.model.member import Member
 from sqlalchemy import and_, or_
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from zope.interface import implementer
 
 
+# The number of email addresses to look up in one query.  Some databases
+# limit the number of parameters of a query.
+BATCH_SIZE = 500
+
+
 
 @implementer(IRoster)
 class AbstractRoster:
@@ -132,6 +140,47 @@ class AbstractRoster:
                 if memberships[0]._address is not None
                 else memberships[1])
 
+    @dbconnection
+    def get_members(self, store, emails):
+        """See ``IRoster``."""
+        # Avoid circular imports.
+        from mailman.model.user import User
+        emails = list(set(emails))
+        members = {}
+        for start in range(0, len(emails), BATCH_SIZE):
+            batch = emails[start:start + BATCH_SIZE]
+            # The members subscribed with an explicit address come first,
+            # since those are the ones get_member() returns.
+            explicit = self._query().join(Member._address).filter(
+                Address.email.in_(batch)).options(
+                    joinedload(Member.preferences),
+                    contains_eager(Member._address).joinedload(
+                        Address.preferences),
+                    contains_eager(Member._address).joinedload(
+                        Address.user).joinedload(User.preferences),
+                    )
+            for member in explicit:
+                members[member._address.email] = member
+            # Then the members subscribed with their preferred address.
+            preferred = self._query().join(Member._user).join(
+                User._preferred_address).filter(
+                    Address.email.in_(batch)).options(
+                        joinedload(Member.preferences),
+                        contains_eager(Member._user).joinedload(
+                            User.preferences),
+                        contains_eager(Member._user).contains_eager(
+                            User._preferred_address).joinedload(
+                                Address.preferences),
+                        )
+            for member in preferred:
+                members.setdefault(member._user.preferred_address.email,
+                                   member)
+        for member in members.values():
+            # They're all members of this mailing list, so save them the
+            # trouble of looking it up.
+            set_committed_value(member, '_mailing_list', self._mlist)
+        return members
+
     def get_memberships(self, email):
         """See ``IRoster``."""
         memberships = self._get_all_memberships(email)
@@ -205,61 +254,92 @@ class AdministratorRoster(AbstractRoster):
 
 
 
+@implementer(IDeliveryRoster)
 class DeliveryMemberRoster(AbstractRoster):
     """Return all the members having a particular kind of delivery."""
 
     role = MemberRole.member
+    # The delivery modes of the members in the roster.
+    delivery_modes = ()
+
+    @dbconnection
+    def _query(self, store):
+        # The members' delivery modes are resolved ahead of time.
+        return store.query(Member).join(
+            EffectivePreferences,
+            EffectivePreferences.member_id == Member.id).filter(
+                EffectivePreferences.list_id == self._mlist.list_id,
+                EffectivePreferences.role == self.role,
+                EffectivePreferences.delivery_mode.in_(self.delivery_modes))
+
+    def _deliverable(self, store, *entities):
+        return store.query(*entities).filter(
+            EffectivePreferences.list_id == self._mlist.list_id,
+            EffectivePreferences.role == self.role,
+            EffectivePreferences.delivery_mode.in_(self.delivery_modes),
+            EffectivePreferences.delivery_status == DeliveryStatus.enabled)
+
+    def _deliverable_addresses(self, store):
+        return self._deliverable(
+            store, Address, EffectivePreferences.delivery_mode).join(
+                EffectivePreferences,
+                EffectivePreferences.address_id == Address.id)
 
     @property
-    def member_count(self):
-        """See `IRoster`."""
-        # XXX 2012-03-15 BAW: It would be nice to make this more efficient.
-        # The problem is that you'd have to change the loop in _get_members()
-        # checking the delivery mode to a query parameter.
-        return len(tuple(self.members))
+    @dbconnection
+    def deliverable_addresses(self, store):
+        """See `IDeliveryRoster`."""
+        for address, delivery_mode in self._deliverable_addresses(store):
+            yield address, delivery_mode
 
     @dbconnection
-    def _get_members(self, store, *delivery_modes):
-        """The set of members for a mailing list, filter by delivery mode.
-
-        :param delivery_modes: The modes to filter on.
-        :type delivery_modes: sequence of `DeliveryMode`.
-        :return: A generator of members.
-        :rtype: generator
-        """
-        results = store.query(Member).filter_by(
-            list_id = self._mlist.list_id,
-            role = MemberRole.member)
-        for member in results:
-            if member.delivery_mode in delivery_modes:
-                yield member
+    def split(self, store, size):
+        """See `IDeliveryRoster`."""
+        # Only the ids go through the cursor, and only `size` rows of them
+        # are fetched at a time.
+        query = self._deliverable(
+            store, EffectivePreferences.member_id).filter(
+                EffectivePreferences.address_id != None).order_by(
+                    EffectivePreferences.member_id).yield_per(size)
+        first = last = None
+        count = 0
+        for (member_id,) in query:
+            if count == 0:
+                first = member_id
+            last = member_id
+            count += 1
+            if count == size:
+                yield first, last
+                count = 0
+        if count > 0:
+            yield first, last
+
+    @dbconnection
+    def get_deliverable_addresses(self, store, first, last):
+        """See `IDeliveryRoster`."""
+        query = self._deliverable_addresses(store).filter(
+            EffectivePreferences.member_id >= first,
+            EffectivePreferences.member_id <= last)
+        for address, delivery_mode in query:
+            yield address, delivery_mode
 
 
 class RegularMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'regular_members'
+    delivery_modes = (DeliveryMode.regular,)
 
-    @property
-    def members(self):
-        """See `IRoster`."""
-        for member in self._get_members(DeliveryMode.regular):
-            yield member
 
 
-
 class DigestMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'digest_members'
+    delivery_modes = (DeliveryMode.plaintext_digests,
+                      DeliveryMode.mime_digests,
+                      DeliveryMode.summary_digests)
 
-    @property
-    def members(self):
-        """See `IRoster`."""
-        for member in self._get_members(DeliveryMode.plaintext_digests,
-                                        DeliveryMode.mime_digests,
-                                        DeliveryMode.summary_digests):
-            yield member
 
 
 
@@ -328,6 +408,15 @@ class Memberships:
                 'Too many matching member results: {0}'.format(
                     results.count()))
 
+    def get_members(self, emails):
+        """See `IRoster`."""
+        members = {}
+        for email in emails:
+            member = self.get_member(email)
+            if member is not None:
+                members[email] = member
+        return members
+
     @dbconnection
     def get_memberships(self, store, address):
         """See `IRoster`."""
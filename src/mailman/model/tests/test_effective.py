@@ -0,0 +1,150 @@
+# Copyright (C) 2012-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the members' resolved preferences."""
+
+__all__ = [
+    'TestEffectivePreferences',
+    ]
+
+
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.languages import ILanguageManager
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
+from mailman.interfaces.preferences import (
+    IEffectivePreferences, IEffectivePreferencesManager)
+from mailman.interfaces.usermanager import IUserManager
+from mailman.model.effective import EffectivePreferences
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
+from zope.component import getUtility
+from zope.interface.verify import verifyObject
+
+
+
+class TestEffectivePreferences(unittest.TestCase):
+    """Test the members' resolved preferences."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._manager = getUtility(IEffectivePreferencesManager)
+        user_manager = getUtility(IUserManager)
+        self._anne = user_manager.make_user('anne@example.com', 'Anne Person')
+        self._address = list(self._anne.addresses)[0]
+        self._member = self._mlist.subscribe(self._address)
+
+    def _get(self, member=None):
+        member = (self._member if member is None else member)
+        return config.db.store.query(EffectivePreferences).filter_by(
+            member_id=member.id).one()
+
+    def test_interfaces(self):
+        verifyObject(IEffectivePreferences, self._get())
+
+    def test_system_defaults(self):
+        preferences = self._get()
+        self.assertEqual(preferences.list_id, 'test.example.com')
+        self.assertEqual(preferences.role, MemberRole.member)
+        self.assertEqual(preferences.email, 'anne@example.com')
+        self.assertTrue(preferences.explicit)
+        self.assertEqual(preferences.delivery_mode, DeliveryMode.regular)
+        self.assertEqual(preferences.delivery_status, DeliveryStatus.enabled)
+        self.assertTrue(preferences.receive_own_postings)
+        self.assertTrue(preferences.receive_list_copy)
+        # The mailing list's language applies.
+        self.assertIsNone(preferences.preferred_language)
+
+    def test_user_preferences(self):
+        self._anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._anne.preferences.preferred_language = (
+            getUtility(ILanguageManager)['fr'])
+        preferences = self._get()
+        self.assertEqual(preferences.delivery_mode, DeliveryMode.mime_digests)
+        self.assertEqual(preferences.preferred_language, 'fr')
+
+    def test_address_preferences_override_user_preferences(self):
+        self._anne.preferences.receive_list_copy = False
+        self._address.preferences.receive_list_copy = True
+        self.assertTrue(self._get().receive_list_copy)
+        # Until they are cleared.
+        self._address.preferences.receive_list_copy = None
+        self.assertFalse(self._get().receive_list_copy)
+
+    def test_member_preferences_override_address_preferences(self):
+        self._address.preferences.delivery_status = DeliveryStatus.by_user
+        self._member.preferences.delivery_status = DeliveryStatus.enabled
+        self.assertEqual(self._get().delivery_status, DeliveryStatus.enabled)
+
+    def test_preferred_address(self):
+        # Bart is subscribed with whatever his preferred address is.
+        bart = getUtility(IUserManager).make_user('bart@example.com')
+        address = list(bart.addresses)[0]
+        address.verified_on = now()
+        bart.preferred_address = address
+        member = self._mlist.subscribe(bart)
+        preferences = self._get(member)
+        self.assertFalse(preferences.explicit)
+        self.assertEqual(preferences.email, 'bart@example.com')
+        # Changing it changes the address of his subscription.
+        other = bart.register('bperson@example.com')
+        other.verified_on = now()
+        other.preferences.receive_own_postings = False
+        bart.preferred_address = other
+        preferences = self._get(member)
+        self.assertEqual(preferences.email, 'bperson@example.com')
+        self.assertFalse(preferences.receive_own_postings)
+
+    def test_unsubscribe(self):
+        member_id = self._member.id
+        self._member.unsubscribe()
+        config.db.store.flush()
+        self.assertEqual(config.db.store.query(EffectivePreferences).filter_by(
+            member_id=member_id).count(), 0)
+
+    def test_get_preferences(self):
+        # Anne is also subscribed through her user, with the same address.
+        self._anne.preferences.receive_list_copy = False
+        self._address.verified_on = now()
+        self._anne.preferred_address = self._address
+        self._mlist.subscribe(self._anne)
+        self._member.preferences.receive_list_copy = True
+        preferences = self._manager.get_preferences(
+            self._mlist, ['anne@example.com', 'bart@example.com'])
+        self.assertEqual(list(preferences), ['anne@example.com'])
+        # Her explicit subscription wins.
+        self.assertEqual(preferences['anne@example.com'].member_id,
+                         self._member.id)
+        self.assertTrue(preferences['anne@example.com'].receive_list_copy)
+        # She has no other roles.
+        self.assertEqual(self._manager.get_preferences(
+            self._mlist, ['anne@example.com'], MemberRole.owner), {})
+
+    def test_rebuild(self):
+        preferences = self._address.preferences
+        preferences.delivery_mode = DeliveryMode.plaintext_digests
+        config.db.store.flush()
+        # Something changes the table behind Mailman's back.
+        config.db.store.execute(EffectivePreferences.__table__.update().values(
+            delivery_mode=DeliveryMode.regular))
+        self.assertEqual(self._manager.rebuild(), 1)
+        self.assertEqual(self._get().delivery_mode,
+                         DeliveryMode.plaintext_digests)
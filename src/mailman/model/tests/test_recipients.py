@@ -0,0 +1,158 @@
+# Copyright (C) 2012-2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the cache of mailing lists' recipients."""
+
+__all__ = [
+    'TestRecipientsCache',
+    ]
+
+
+import os
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.listmanager import IListManager
+from mailman.interfaces.member import DeliveryMode
+from mailman.interfaces.recipients import IRecipientsCache
+from mailman.interfaces.usermanager import IUserManager
+from mailman.model.effective import EffectivePreferences
+from mailman.model.recipients import RecipientsCache
+from mailman.testing.helpers import configuration
+from mailman.testing.layers import ConfigLayer
+from zope.component import getUtility
+from zope.interface.verify import verifyObject
+
+
+
+class TestRecipientsCache(unittest.TestCase):
+    """Test the cache of mailing lists' recipients."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._cache = getUtility(IRecipientsCache)
+        self._user_manager = getUtility(IUserManager)
+        self._anne = self._mlist.subscribe(
+            self._user_manager.create_address('anne@example.com'))
+        self._bart = self._mlist.subscribe(
+            self._user_manager.create_address('bart@example.com'))
+        self._bart.preferences.delivery_mode = DeliveryMode.mime_digests
+        config.db.commit()
+
+    def _tamper(self, email, delivery_mode):
+        # Change the resolved preferences without Mailman noticing.
+        table = EffectivePreferences.__table__
+        config.db.store.execute(table.update().where(
+            table.c.email == email).values(delivery_mode=delivery_mode))
+
+    def test_interface(self):
+        verifyObject(IRecipientsCache, self._cache)
+
+    def test_recipients(self):
+        self.assertEqual(self._cache.get_regular_recipients(self._mlist),
+                         {'anne@example.com'})
+        self.assertEqual(self._cache.get_digest_recipients(self._mlist),
+                         {('bart@example.com', DeliveryMode.mime_digests)})
+
+    def test_cached(self):
+        self._cache.get_regular_recipients(self._mlist)
+        self._tamper('bart@example.com', DeliveryMode.regular)
+        self.assertEqual(self._cache.get_regular_recipients(self._mlist),
+                         {'anne@example.com'})
+        # Unless there is no cache.
+        with configuration('mailman', recipient_cache='none'):
+            self.assertEqual(
+                self._cache.get_regular_recipients(self._mlist),
+                {'anne@example.com', 'bart@example.com'})
+
+    def test_subscription(self):
+        self._cache.get_regular_recipients(self._mlist)
+        self._mlist.subscribe(
+            self._user_manager.create_address('cris@example.com'))
+        self.assertEqual(self._cache.get_regular_recipients(self._mlist),
+                         {'anne@example.com', 'cris@example.com'})
+
+    def test_unsubscription(self):
+        self._cache.get_regular_recipients(self._mlist)
+        self._anne.unsubscribe()
+        self.assertEqual(self._cache.get_regular_recipients(self._mlist),
+                         set())
+
+    def test_preferences(self):
+        self._cache.get_digest_recipients(self._mlist)
+        self._bart.address.preferences.delivery_mode = (
+            DeliveryMode.plaintext_digests)
+        self._bart.preferences.delivery_mode = None
+        self.assertEqual(
+            self._cache.get_digest_recipients(self._mlist),
+            {('bart@example.com', DeliveryMode.plaintext_digests)})
+
+    def test_other_processes(self):
+        # Another process has a cache of its own.
+        other = RecipientsCache()
+        self._cache.get_regular_recipients(self._mlist)
+        other.get_regular_recipients(self._mlist)
+        self._tamper('bart@example.com', DeliveryMode.regular)
+        # Invalidating the recipients in one process changes their version
+        # in the database, which the other process sees.
+        self._cache.invalidate(['test.example.com'])
+        config.db.commit()
+        self.assertEqual(other.get_regular_recipients(self._mlist),
+                         {'anne@example.com', 'bart@example.com'})
+
+    def test_disk(self):
+        path = os.path.join(self._mlist.data_path, 'regular-recipients.pck')
+        with configuration('mailman', recipient_cache='disk'):
+            self._cache.get_regular_recipients(self._mlist)
+            self.assertTrue(os.path.exists(path))
+            self._tamper('bart@example.com', DeliveryMode.regular)
+            # A new process picks up the saved recipients.
+            self.assertEqual(
+                RecipientsCache().get_regular_recipients(self._mlist),
+                {'anne@example.com'})
+            # Until they change.
+            self._cache.invalidate(['test.example.com'])
+            self.assertEqual(
+                RecipientsCache().get_regular_recipients(self._mlist),
+                {'anne@example.com', 'bart@example.com'})
+        # The file holds the latest recipients.
+        self.assertEqual(
+            RecipientsCache().get_regular_recipients(self._mlist),
+            {'anne@example.com', 'bart@example.com'})
+
+    def test_corrupt_file(self):
+        path = os.path.join(self._mlist.data_path, 'regular-recipients.pck')
+        with open(path, 'wb') as fp:
+            fp.write(b'corrupt')
+        with configuration('mailman', recipient_cache='disk'):
+            self.assertEqual(
+                self._cache.get_regular_recipients(self._mlist),
+                {'anne@example.com'})
+
+    def test_recreated_list(self):
+        # Another process cached the recipients of a mailing list, which is
+        # deleted and created again.  The new mailing list's version is not
+        # the old one's.
+        other = RecipientsCache()
+        other.get_regular_recipients(self._mlist)
+        getUtility(IListManager).delete(self._mlist)
+        config.db.commit()
+        mlist = create_list('test@example.com')
+        self.assertEqual(other.get_regular_recipients(mlist), set())
@@ -18,6 +18,8 @@
 """Test rosters."""
 
 __all__ = [
+    'TestDeliveryRosters',
+    'TestGetMembers',
     'TestMailingListRoster',
     'TestMembershipsRoster',
     ]
@@ -26,13 +28,18 @@ __all__ = [
 import unittest
 
 from mailman.app.lifecycle import create_list
+from mailman.config import config
 from mailman.interfaces.address import IAddress
-from mailman.interfaces.member import DeliveryMode, MemberRole
+from mailman.interfaces.roster import IDeliveryRoster
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
 from mailman.interfaces.user import IUser
 from mailman.interfaces.usermanager import IUserManager
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import now
+from sqlalchemy import event
+from unittest.mock import patch
 from zope.component import getUtility
+from zope.interface.verify import verifyObject
 
 
 
@@ -200,3 +207,210 @@ class TestMembershipsRoster(unittest.TestCase):
         self.assertEqual(
             [record.address.email for record in memberships],
             ['anne@example.com', 'anne@example.com'])
+
+
+
+class TestGetMembers(unittest.TestCase):
+    """Test looking up many members at once."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        self._emails = []
+        for name in ('anne', 'bart', 'cris', 'dave'):
+            email = '{}@example.com'.format(name)
+            user = user_manager.make_user(email, name.title())
+            self._mlist.subscribe(list(user.addresses)[0])
+            self._emails.append(email)
+        # Elle is subscribed with her preferred address.
+        elle = user_manager.make_user('elle@example.com', 'Elle Person')
+        preferred = list(elle.addresses)[0]
+        preferred.verified_on = now()
+        elle.preferred_address = preferred
+        self._mlist.subscribe(elle)
+        self._emails.append('elle@example.com')
+        # Fred isn't subscribed, and Gwen is only an owner.
+        user_manager.create_address('fred@example.com')
+        gwen = user_manager.create_address('gwen@example.com')
+        self._mlist.subscribe(gwen, MemberRole.owner)
+        config.db.commit()
+        # Reload the mailing list before counting the queries.
+        self._mlist.list_id
+        self._queries = []
+        event.listen(config.db.engine, 'before_cursor_execute',
+                     self._count)
+        self.addCleanup(event.remove, config.db.engine,
+                        'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._queries.append(args)
+
+    def test_get_members(self):
+        emails = self._emails + ['fred@example.com', 'gwen@example.com']
+        members = self._mlist.members.get_members(emails)
+        self.assertEqual(sorted(members), self._emails)
+        for email in self._emails:
+            self.assertEqual(members[email],
+                             self._mlist.members.get_member(email))
+
+    def test_explicit_address_wins(self):
+        elle = getUtility(IUserManager).get_user('elle@example.com')
+        self._mlist.subscribe(elle.preferred_address)
+        members = self._mlist.members.get_members(['elle@example.com'])
+        self.assertEqual(members['elle@example.com'].subscriber,
+                         elle.preferred_address)
+
+    def test_other_roster(self):
+        members = self._mlist.owners.get_members(self._emails + [
+            'gwen@example.com'])
+        self.assertEqual(list(members), ['gwen@example.com'])
+
+    def test_constant_queries(self):
+        members = self._mlist.members.get_members(self._emails)
+        # Everything the deliveries need is loaded along with the members.
+        del self._queries[:]
+        for member in members.values():
+            member.preferred_language
+            member.user.display_name
+            member.address.original_email
+            member.delivery_mode
+        self.assertEqual(self._queries, [])
+
+    def test_batches(self):
+        with patch('mailman.model.roster.BATCH_SIZE', 2):
+            members = self._mlist.members.get_members(self._emails)
+        self.assertEqual(sorted(members), self._emails)
+        # Two queries for each of the three batches.
+        self.assertEqual(len(self._queries), 6)
+
+
+
+class TestDeliveryRosters(unittest.TestCase):
+    """Test the rosters of members by their kind of delivery."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        def subscribe(name):
+            user = user_manager.make_user(
+                '{}@example.com'.format(name), name.title())
+            address = list(user.addresses)[0]
+            return user, address, self._mlist.subscribe(address)
+        # Anne gets the system's defaults.
+        subscribe('anne')
+        # Bart's member preferences override his address's.
+        bart, address, member = subscribe('bart')
+        address.preferences.delivery_mode = DeliveryMode.mime_digests
+        member.preferences.delivery_mode = DeliveryMode.regular
+        # Cris's address preferences override her user's.
+        cris, address, member = subscribe('cris')
+        cris.preferences.delivery_mode = DeliveryMode.regular
+        address.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        # Dave gets digests from his user's preferences, but his delivery
+        # is disabled.
+        dave, address, member = subscribe('dave')
+        dave.preferences.delivery_mode = DeliveryMode.mime_digests
+        dave.preferences.delivery_status = DeliveryStatus.by_user
+        # Elle is subscribed with her preferred address, and her delivery is
+        # disabled by her membership.
+        elle = user_manager.make_user('elle@example.com', 'Elle Person')
+        preferred = list(elle.addresses)[0]
+        preferred.verified_on = now()
+        elle.preferred_address = preferred
+        member = self._mlist.subscribe(elle)
+        member.preferences.delivery_status = DeliveryStatus.by_bounces
+        # Fred is subscribed with his preferred address too, and gets
+        # summary digests from its preferences.
+        fred = user_manager.make_user('fred@example.com', 'Fred Person')
+        preferred = list(fred.addresses)[0]
+        preferred.verified_on = now()
+        fred.preferred_address = preferred
+        preferred.preferences.delivery_mode = DeliveryMode.summary_digests
+        self._mlist.subscribe(fred)
+        # Gwen is only an owner.
+        gwen = user_manager.create_address('gwen@example.com')
+        self._mlist.subscribe(gwen, MemberRole.owner)
+        config.db.commit()
+
+    def _emails(self, members):
+        return sorted(member.address.email for member in members)
+
+    def test_interfaces(self):
+        verifyObject(IDeliveryRoster, self._mlist.regular_members)
+        verifyObject(IDeliveryRoster, self._mlist.digest_members)
+
+    def test_members(self):
+        self.assertEqual(self._emails(self._mlist.regular_members.members), [
+            'anne@example.com', 'bart@example.com', 'elle@example.com'])
+        self.assertEqual(self._emails(self._mlist.digest_members.members), [
+            'cris@example.com', 'dave@example.com', 'fred@example.com'])
+        self.assertEqual(self._mlist.regular_members.member_count, 3)
+        self.assertEqual(self._mlist.digest_members.member_count, 3)
+
+    def test_same_as_members(self):
+        # The database resolves the preferences like the members do.
+        for roster, modes in (
+                (self._mlist.regular_members, [DeliveryMode.regular]),
+                (self._mlist.digest_members, [
+                    DeliveryMode.plaintext_digests,
+                    DeliveryMode.mime_digests,
+                    DeliveryMode.summary_digests])):
+            self.assertEqual(
+                self._emails(roster.members),
+                self._emails(member for member in self._mlist.members.members
+                             if member.delivery_mode in modes))
+
+    def test_deliverable_addresses(self):
+        self.assertEqual(
+            sorted((address.email, mode) for address, mode
+                   in self._mlist.regular_members.deliverable_addresses), [
+                ('anne@example.com', DeliveryMode.regular),
+                ('bart@example.com', DeliveryMode.regular),
+                ])
+        self.assertEqual(
+            sorted((address.email, mode.name) for address, mode
+                   in self._mlist.digest_members.deliverable_addresses), [
+                ('cris@example.com', 'plaintext_digests'),
+                ('fred@example.com', 'summary_digests'),
+                ])
+
+    def test_one_query(self):
+        # Reload the mailing list before counting the queries.
+        self._mlist.list_id
+        queries = []
+        def count(*args):
+            queries.append(args)
+        event.listen(config.db.engine, 'before_cursor_execute', count)
+        self.addCleanup(event.remove, config.db.engine,
+                        'before_cursor_execute', count)
+        addresses = list(self._mlist.regular_members.deliverable_addresses)
+        self.assertEqual(len(addresses), 2)
+        self.assertEqual(len(queries), 1)
+
+    def test_split(self):
+        roster = self._mlist.regular_members
+        ids = sorted(member.id for member in roster.members
+                     if member.delivery_status == DeliveryStatus.enabled)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(list(roster.split(1)),
+                         [(ids[0], ids[0]), (ids[1], ids[1])])
+        self.assertEqual(list(roster.split(2)), [(ids[0], ids[1])])
+        self.assertEqual(list(roster.split(10)), [(ids[0], ids[1])])
+
+    def test_split_empty(self):
+        mlist = create_list('ant@example.com')
+        self.assertEqual(list(mlist.regular_members.split(10)), [])
+
+    def test_deliverable_addresses_in_range(self):
+        roster = self._mlist.regular_members
+        emails = []
+        for first, last in roster.split(1):
+            emails.extend(
+                address.email for address, mode
+                in roster.get_deliverable_addresses(first, last))
+        self.assertEqual(sorted(emails),
+                         ['anne@example.com', 'bart@example.com'])
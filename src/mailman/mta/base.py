@@ -28,9 +28,11 @@ import socket
 import logging
 import smtplib
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from lazr.config import as_timedelta
 from mailman.config import config
 from mailman.interfaces.mta import IMailTransportAgentDelivery
-from mailman.mta.connection import Connection
+from mailman.mta.connection import Connection, ConnectionPool
 from zope.interface import implementer
 
 
@@ -46,10 +48,92 @@ class BaseDelivery:
         """Create a basic deliverer."""
         username = (config.mta.smtp_user if config.mta.smtp_user else None)
         password = (config.mta.smtp_pass if config.mta.smtp_pass else None)
-        self._connection = Connection(
+        self._connection_args = (
             config.mta.smtp_host, int(config.mta.smtp_port),
             int(config.mta.max_sessions_per_connection),
             username, password)
+        self._connection = Connection(*self._connection_args)
+        # The number of SMTP sessions to run at the same time.
+        self._threads = int(config.mta.max_delivery_threads)
+        # Where to record the recipients the MTA accepted, if anywhere.
+        self.checkpoint = None
+
+    def _deliver_all(self, mlist, deliveries):
+        """Deliver messages to their recipients, possibly concurrently.
+
+        With more than one delivery thread, the messages are sent over
+        several connections at the same time.  The deliveries are still
+        produced, and their envelope senders and message texts computed, in
+        the calling thread; only the SMTP sessions run in the other threads.
+        The accepted recipients of every delivery are recorded in the
+        checkpoint, if there is one, as soon as it is done.
+
+        :param mlist: The mailing list being delivered to.
+        :type mlist: `IMailingList`
+        :param deliveries: The (message, metadata, recipients) triples to
+            deliver.  They are consumed lazily.
+        :type deliveries: iterable
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`,
+            for all the deliveries.
+        :rtype: dictionary
+        """
+        refused = {}
+        if self._threads <= 1:
+            for msg, msgdata, recipients in deliveries:
+                failures = self._deliver_to_recipients(
+                    mlist, msg, msgdata, recipients)
+                self._record(recipients, failures)
+                refused.update(failures)
+            return refused
+        # Every thread needs its own connection.  Borrow them from the active
+        # connection pool, or from one just for these deliveries.
+        if ConnectionPool.current() is not None:
+            return self._deliver_concurrently(mlist, deliveries)
+        pool = ConnectionPool(
+            *self._connection_args, check_interval=as_timedelta(
+                config.mta.connection_check_interval).total_seconds())
+        try:
+            with pool:
+                return self._deliver_concurrently(mlist, deliveries)
+        finally:
+            pool.close()
+
+    def _deliver_concurrently(self, mlist, deliveries):
+        refused = {}
+        def collect(futures):
+            for future in futures:
+                failures = future.result()
+                self._record(pending.pop(future), failures)
+                refused.update(failures)
+        with ThreadPoolExecutor(self._threads) as executor:
+            # The recipients of each SMTP session, by its future.
+            pending = {}
+            for msg, msgdata, recipients in deliveries:
+                # Don't get too far ahead of the SMTP sessions.
+                if len(pending) >= 2 * self._threads:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                sender = self._get_sender(mlist, msg, msgdata)
+                future = executor.submit(
+                    self._send, sender, recipients, msg['message-id'],
+                    msg.as_string())
+                pending[future] = recipients
+            collect(wait(pending).done)
+        return refused
+
+    def _record(self, recipients, refused):
+        """Checkpoint the recipients the MTA accepted.
+
+        :param recipients: The recipients of one delivery.
+        :type recipients: sequence
+        :param refused: The delivery failures, as defined by
+            `smtplib.SMTP.sendmail`.
+        :type refused: dictionary
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.record([
+                recipient for recipient in recipients
+                if recipient not in refused
+                ])
 
     def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
         """Low-level delivery to a set of recipients.
@@ -67,10 +151,25 @@ class BaseDelivery:
         """
         # Do the actual sending.
         sender = self._get_sender(mlist, msg, msgdata)
-        message_id = msg['message-id']
+        return self._send(
+            sender, recipients, msg['message-id'], msg.as_string())
+
+    def _send(self, sender, recipients, message_id, msgtext):
+        """Send a message, turning SMTP errors into delivery failures.
+
+        :param sender: The envelope sender.
+        :type sender: string
+        :param recipients: The recipients of this message.
+        :type recipients: sequence
+        :param message_id: The Message-ID of the message, for logging.
+        :type message_id: string
+        :param msgtext: The message text.
+        :type msgtext: string
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`
+        :rtype: dictionary
+        """
         try:
-            refused = self._connection.sendmail(
-                sender, recipients, msg.as_string())
+            refused = self._sendmail(sender, recipients, msgtext)
         except smtplib.SMTPRecipientsRefused as error:
             log.error('%s recipients refused: %s', message_id, error)
             refused = error.recipients
@@ -93,6 +192,24 @@ class BaseDelivery:
                 for recipient in recipients)
         return refused
 
+    def _sendmail(self, sender, recipients, msgtext):
+        """Send the message, over a pooled connection if there is a pool.
+
+        :param sender: The envelope sender.
+        :type sender: string
+        :param recipients: The recipients of this message.
+        :type recipients: sequence
+        :param msgtext: The message text.
+        :type msgtext: string
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`
+        :rtype: dictionary
+        """
+        pool = ConnectionPool.current()
+        if pool is None:
+            return self._connection.sendmail(sender, recipients, msgtext)
+        with pool.connection() as connection:
+            return connection.sendmail(sender, recipients, msgtext)
+
     def _get_sender(self, mlist, msg, msgdata):
         """Return the envelope sender to use.
 
@@ -144,13 +261,22 @@ class IndividualDelivery(BaseDelivery):
         delivery address in the return envelope so there can be no ambiguity
         in bounce processing.
         """
-        refused = {}
+        return self._deliver_all(
+            mlist, self._individual_messages(mlist, msg, msgdata))
+
+    def _individual_messages(self, mlist, msg, msgdata):
+        """Craft the message for every recipient.
+
+        :return: The (message, metadata, recipients) triples to deliver.
+        :rtype: iterator
+        """
+        render = self._get_renderer(mlist, msg, msgdata)
         recipients = msgdata.get('recipients', set())
+        # Look up all the recipients' memberships at once, along with their
+        # addresses, users and preferences.
+        members = mlist.members.get_members(recipients)
         for recipient in recipients:
             log.debug('IndividualDelivery to: %s', recipient)
-            # Make a copy of the original messages and operator on it, since
-            # we're going to munge it repeatedly for each recipient.
-            message_copy = copy.deepcopy(msg)
             msgdata_copy = msgdata.copy()
             # Squirrel the current recipient away in the message metadata.
             # That way the subclass's _get_sender() override can encode the
@@ -158,13 +284,33 @@ class IndividualDelivery(BaseDelivery):
             msgdata_copy['recipient'] = recipient
             # See if the recipient is a member of the mailing list, and if so,
             # squirrel this information away for use by other modules, such as
-            # the header/footer decorator.  XXX 2012-03-05 this is probably
-            # highly inefficient on the database.
-            member = mlist.members.get_member(recipient)
-            msgdata_copy['member'] = member
-            for callback in self.callbacks:
-                callback(mlist, message_copy, msgdata_copy)
-            status = self._deliver_to_recipients(
-                mlist, message_copy, msgdata_copy, [recipient])
-            refused.update(status)
-        return refused
+            # the header/footer decorator.
+            msgdata_copy['member'] = members.get(recipient)
+            yield render(mlist, msg, msgdata_copy), msgdata_copy, [recipient]
+
+    def _get_renderer(self, mlist, msg, msgdata):
+        """Return the function crafting each recipient's message.
+
+        The function is called with the mailing list, the original message
+        and the recipient's copy of the message metadata, and returns the
+        recipient's message.  This one runs all the callbacks on a copy of
+        the message.
+
+        :param mlist: The mailing list being delivered to.
+        :type mlist: `IMailingList`
+        :param msg: The original message being delivered.
+        :type msg: `Message`
+        :param msgdata: Additional message metadata for this delivery.
+        :type msgdata: dictionary
+        :return: The function.
+        :rtype: callable
+        """
+        return self._render
+
+    def _render(self, mlist, msg, msgdata):
+        # Make a copy of the original messages and operator on it, since
+        # we're going to munge it repeatedly for each recipient.
+        message_copy = copy.deepcopy(msg)
+        for callback in self.callbacks:
+            callback(mlist, message_copy, msgdata)
+        return message_copy
@@ -23,37 +23,29 @@ __all__ = [
 
 
 from mailman.mta.base import BaseDelivery
+from mailman.mta.chunking import TLDChunking
 
 
-# A mapping of top-level domains to bucket numbers.  The zeroth bucket is
-# reserved for everything else.  At one time, these were the most common
-# domains.
-CHUNKMAP = dict(
-    com=1,
-    net=2,
-    org=2,
-    edu=3,
-    us=3,
-    ca=3,
-    )
 
-
-
 class BulkDelivery(BaseDelivery):
     """Deliver messages to the MSA in as few sessions as possible."""
 
-    def __init__(self, max_recipients=None):
+    def __init__(self, max_recipients=None, chunking=None):
         """See `BaseDelivery`.
 
         :param max_recipients: The maximum number of recipients per delivery
             chunk.  None, zero or less means to group all recipients into one
             big chunk.
         :type max_recipients: integer
+        :param chunking: The strategy splitting the recipients into chunks.
+            None means to group them by a few common top-level domains.
+        :type chunking: `IChunkingStrategy`
         """
         super(BulkDelivery, self).__init__()
         self._max_recipients = (max_recipients
                                 if max_recipients is not None
                                 else 0)
+        self._chunking = (TLDChunking() if chunking is None else chunking)
 
     def chunkify(self, recipients):
         """Split a set of recipients into chunks.
@@ -68,40 +60,21 @@ class BulkDelivery(BaseDelivery):
             contain fewer, and no packing is guaranteed.
         :rtype: list of sets of strings
         """
-        if self._max_recipients <= 0:
-            yield set(recipients)
-            return
-        # This algorithm was originally suggested by Chuq Von Rospach.  Start
-        # by splitting the recipient addresses into top-level domain buckets,
-        # using the "most common" domains.  Everything else ends up in the
-        # zeroth bucket.
-        by_bucket = {}
-        for address in recipients:
-            localpart, at, domain = address.partition('@')
-            domain_parts = domain.split('.')
-            bucket_number = CHUNKMAP.get(domain_parts[-1], 0)
-            by_bucket.setdefault(bucket_number, set()).add(address)
-        # Fill chunks by sorting the tld values by length.
-        chunk = set()
-        for tld_chunk in sorted(by_bucket.values(), key=len, reverse=True):
-            while tld_chunk:
-                chunk.add(tld_chunk.pop())
-                if len(chunk) == self._max_recipients:
-                    yield chunk
-                    chunk = set()
-            # Every tld bucket starts a new chunk, but only if non-empty
-            if len(chunk) > 0:
-                yield chunk
-                chunk = set()
-        # Be sure to include the last chunk, but only if it's non-empty.
-        if len(chunk) > 0:
-            yield chunk
+        return self._chunking.chunkify(recipients, self._max_recipients)
 
     def deliver(self, mlist, msg, msgdata):
         """See `IMailTransportAgentDelivery`."""
-        refused = {}
-        for recipients in self.chunkify(msgdata.get('recipients', set())):
-            chunk_refused = self._deliver_to_recipients(
-                mlist, msg, msgdata, recipients)
-            refused.update(chunk_refused)
+        chunks = []
+        def deliveries():
+            for recipients in self.chunkify(msgdata.get('recipients', set())):
+                chunks.append(recipients)
+                yield msg, msgdata, recipients
+        refused = self._deliver_all(mlist, deliveries())
+        # Let the strategy learn from how each chunk went.
+        for recipients in chunks:
+            self._chunking.learn(recipients, {
+                recipient: refused[recipient]
+                for recipient in recipients
+                if recipient in refused
+                })
         return refused
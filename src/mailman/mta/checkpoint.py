@@ -0,0 +1,100 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Checkpoints of the recipients a queued message was delivered to.
+
+When the outgoing runner is killed in the middle of delivering a message, the
+message's backup file is recovered and the message is delivered again.
+Without a checkpoint, that means delivering it again to everybody who
+already got it.
+
+The checkpoint is a file next to the queue file, named after the queue
+file's digest so that it survives the recovery.  The recipients of every
+chunk the MTA accepted are appended to it, one per line, and the file is
+removed along with the queue file when the runner is done with it.
+"""
+
+__all__ = [
+    'DeliveryCheckpoint',
+    ]
+
+
+
+class DeliveryCheckpoint:
+    """The recipients a queued message was already delivered to."""
+
+    def __init__(self, path):
+        """Create a checkpoint.
+
+        :param path: The path of the checkpoint file.  It doesn't have to
+            exist yet.
+        :type path: str
+        """
+        self.path = path
+        self._fp = None
+
+    def delivered(self):
+        """Return the recipients recorded so far.
+
+        :return: The recipients' email addresses.
+        :rtype: set
+        """
+        try:
+            with open(self.path, encoding='utf-8') as fp:
+                lines = fp.read().split('\n')
+        except FileNotFoundError:
+            return set()
+        # The last line is either empty, or it was cut short when the
+        # process was killed in the middle of writing it.
+        return set(lines[:-1])
+
+    def undelivered(self, recipients):
+        """Leave out the recipients who were already delivered to.
+
+        :param recipients: The recipients of the message.
+        :type recipients: sequence of email address strings
+        :return: The recipients who weren't delivered to yet, in the same
+            order.
+        :rtype: list
+        """
+        delivered = self.delivered()
+        return [address for address in recipients
+                if address not in delivered]
+
+    def record(self, recipients):
+        """Record that the message was delivered to some recipients.
+
+        The recipients are written out before this returns, so they are not
+        lost if the process is killed.  They are not synced to disk, which
+        would cost far more than delivering to them again after a crash of
+        the whole system.
+
+        :param recipients: The recipients the MTA accepted.
+        :type recipients: sequence of email address strings
+        """
+        if len(recipients) == 0:
+            return
+        if self._fp is None:
+            self._fp = open(self.path, 'a', encoding='utf-8')
+        self._fp.write(''.join(address + '\n' for address in recipients))
+        self._fp.flush()
+
+    def close(self):
+        """Close the checkpoint file, if it was opened."""
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
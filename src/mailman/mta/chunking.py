@@ -0,0 +1,199 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Strategies for splitting bulk deliveries into chunks."""
+
+__all__ = [
+    'DomainChunking',
+    'TLDChunking',
+    'get_chunking',
+    ]
+
+
+from mailman.config import config
+from mailman.interfaces.mta import IChunkingStrategy
+from mailman.utilities.modules import call_name
+from zope.interface import implementer
+
+
+# A mapping of top-level domains to bucket numbers.  The zeroth bucket is
+# reserved for everything else.  At one time, these were the most common
+# domains.
+CHUNKMAP = dict(
+    com=1,
+    net=2,
+    org=2,
+    edu=3,
+    us=3,
+    ca=3,
+    )
+
+# The reply code of a server which has had too many recipients.
+TOO_MANY_RECIPIENTS = 452
+
+# The strategies in use, by their dotted names.
+_strategies = {}
+
+
+
+def _domain(address):
+    return address.rpartition('@')[2].lower()
+
+
+
+@implementer(IChunkingStrategy)
+class TLDChunking:
+    """Group recipients by a few common top-level domains.
+
+    This algorithm was originally suggested by Chuq Von Rospach.
+    """
+
+    def chunkify(self, recipients, max_recipients):
+        """See `IChunkingStrategy`."""
+        if max_recipients <= 0:
+            yield set(recipients)
+            return
+        # Start by splitting the recipient addresses into top-level domain
+        # buckets, using the "most common" domains.  Everything else ends up
+        # in the zeroth bucket.
+        by_bucket = {}
+        for address in recipients:
+            localpart, at, domain = address.partition('@')
+            domain_parts = domain.split('.')
+            bucket_number = CHUNKMAP.get(domain_parts[-1], 0)
+            by_bucket.setdefault(bucket_number, set()).add(address)
+        # Fill chunks by sorting the tld values by length.
+        chunk = set()
+        for tld_chunk in sorted(by_bucket.values(), key=len, reverse=True):
+            while tld_chunk:
+                chunk.add(tld_chunk.pop())
+                if len(chunk) == max_recipients:
+                    yield chunk
+                    chunk = set()
+            # Every tld bucket starts a new chunk, but only if non-empty
+            if len(chunk) > 0:
+                yield chunk
+                chunk = set()
+        # Be sure to include the last chunk, but only if it's non-empty.
+        if len(chunk) > 0:
+            yield chunk
+
+    def learn(self, recipients, refused):
+        """See `IChunkingStrategy`."""
+
+
+
+@implementer(IChunkingStrategy)
+class DomainChunking:
+    """Group recipients by their domain, and pack the chunks.
+
+    Recipients in the same domain share chunks, so that the MTA can deliver
+    them in as few transactions with the remote server as possible.  Domains
+    with more recipients than fit in a chunk fill as many chunks as they
+    need, and what's left of them is packed together with other domains into
+    chunks which are as full as possible, without splitting any domain's
+    remainder across chunks.
+
+    When the server refuses some of a chunk's recipients with a 452 (too many
+    recipients) reply after accepting the others, the number it accepted
+    becomes the limit for the refused recipients' domains, and later chunks
+    with those domains are kept within it.
+    """
+
+    def __init__(self):
+        # The learned limits, by domain.
+        self.limits = {}
+
+    def _limit(self, domain, max_recipients):
+        limit = self.limits.get(domain)
+        if max_recipients <= 0:
+            return limit
+        if limit is None:
+            return max_recipients
+        return min(limit, max_recipients)
+
+    def chunkify(self, recipients, max_recipients):
+        """See `IChunkingStrategy`."""
+        by_domain = {}
+        for address in recipients:
+            by_domain.setdefault(_domain(address), []).append(address)
+        # Fill whole chunks with the biggest domains first.
+        remainders = []
+        for domain in sorted(by_domain,
+                             key=lambda domain: (-len(by_domain[domain]),
+                                                 domain)):
+            addresses = sorted(by_domain[domain])
+            limit = self._limit(domain, max_recipients)
+            if limit is not None:
+                while len(addresses) >= limit:
+                    yield set(addresses[:limit])
+                    del addresses[:limit]
+            if len(addresses) > 0:
+                remainders.append((len(addresses), domain, addresses))
+        # Pack the rest, largest first, into the first chunk with room for
+        # them.  The capacity of a chunk is lowered by the learned limits of
+        # the domains in it.
+        chunks = []
+        for size, domain, addresses in sorted(
+                remainders, key=lambda remainder: (-remainder[0],
+                                                   remainder[1])):
+            limit = self._limit(domain, max_recipients)
+            for chunk in chunks:
+                capacity = chunk[0]
+                if limit is not None:
+                    capacity = (limit if capacity is None
+                                else min(capacity, limit))
+                if capacity is None or len(chunk[1]) + size <= capacity:
+                    chunk[0] = capacity
+                    chunk[1].update(addresses)
+                    break
+            else:
+                chunks.append([limit, set(addresses)])
+        for capacity, chunk in chunks:
+            yield chunk
+
+    def learn(self, recipients, refused):
+        """See `IChunkingStrategy`."""
+        domains = set(
+            _domain(address) for address, (code, response) in refused.items()
+            if code == TOO_MANY_RECIPIENTS)
+        accepted = len(recipients) - len(refused)
+        # When nobody was accepted, the server is short of something other
+        # than room for recipients.
+        if len(domains) == 0 or accepted <= 0:
+            return
+        for domain in domains:
+            limit = self.limits.get(domain)
+            self.limits[domain] = (accepted if limit is None
+                                   else min(limit, accepted))
+
+
+
+def get_chunking():
+    """Return the configured chunking strategy.
+
+    The same strategy is returned for as long as it is configured, so that
+    it keeps what it learned between deliveries.
+
+    :return: The strategy named by the `[mta]chunking` setting.
+    :rtype: `IChunkingStrategy`
+    """
+    name = config.mta.chunking
+    strategy = _strategies.get(name)
+    if strategy is None:
+        strategy = _strategies[name] = call_name(name)
+    return strategy
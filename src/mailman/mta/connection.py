@@ -19,18 +19,35 @@
 
 __all__ = [
     'Connection',
+    'ConnectionPool',
     ]
 
 
+import re
+import time
 import logging
 import smtplib
+import threading
 
+from contextlib import contextmanager
 from lazr.config import as_boolean
 from mailman.config import config
 
 
 log = logging.getLogger('mailman.smtp')
 
+# The active connection pool, if any.
+_current_pool = None
+
+# The number of pipelined commands to send before reading their replies.
+# Sending any more might fill up the socket buffers in both directions.
+PIPELINE_DEPTH = 100
+# The size of the BDAT chunks.
+CHUNK_SIZE = 1024 * 1024
+
+CRLF = '\r\n'
+_EOLS = re.compile(r'(?:\r\n|\n|\r(?!\n))')
+
 
 
 class Connection:
@@ -62,6 +79,8 @@ class Connection:
         self._password = smtp_pass
         self._session_count = None
         self._connection = None
+        self._pipelining = as_boolean(config.mta.use_pipelining)
+        self._chunking_threshold = int(config.mta.chunking_threshold)
 
     def _connect(self):
         """Open a new connection."""
@@ -84,8 +103,12 @@ class Connection:
         try:
             log.debug('envsender: %s, recipients: %s, size(msgtext): %s',
                       envsender, recipients, len(msgtext))
-            results = self._connection.sendmail(envsender, recipients, msgtext)
-        except smtplib.SMTPException:
+            if self._use_extensions(msgtext):
+                results = self._transact(envsender, recipients, msgtext)
+            else:
+                results = self._connection.sendmail(
+                    envsender, recipients, msgtext)
+        except (smtplib.SMTPException, OSError):
             # For safety, close this connection.  The next send attempt will
             # automatically re-open it.  Pass the exception on up.
             self.quit()
@@ -99,12 +122,222 @@ class Connection:
             self.quit()
         return results
 
+    def _use_extensions(self, msgtext):
+        """Should the message be sent with PIPELINING or CHUNKING?"""
+        self._connection.ehlo_or_helo_if_needed()
+        features = self._connection.esmtp_features
+        return ((self._pipelining and 'pipelining' in features) or
+                (0 < self._chunking_threshold <= len(msgtext) and
+                 'chunking' in features))
+
+    def _transact(self, envsender, recipients, msgtext):
+        """Send a message with the ESMTP extensions the server offers.
+
+        This mimics `smtplib.SMTP.sendmail` and reports failures the same
+        way, but with PIPELINING the MAIL and RCPT commands are sent in
+        batches instead of one at a time, and with CHUNKING big messages are
+        sent with BDAT instead of DATA.
+        """
+        connection = self._connection
+        features = connection.esmtp_features
+        if isinstance(msgtext, str):
+            msgtext = _EOLS.sub(CRLF, msgtext).encode('ascii')
+        options = ('' if 'size' not in features
+                   else ' SIZE={}'.format(len(msgtext)))
+        envelope = [(None, 'mail FROM:{}{}'.format(
+            smtplib.quoteaddr(envsender), options))]
+        envelope.extend(
+            (recipient, 'rcpt TO:{}'.format(smtplib.quoteaddr(recipient)))
+            for recipient in recipients)
+        depth = (PIPELINE_DEPTH
+                 if self._pipelining and 'pipelining' in features
+                 else 1)
+        refused = {}
+        for start in range(0, len(envelope), depth):
+            batch = envelope[start:start + depth]
+            connection.send(
+                ''.join(command + CRLF for recipient, command in batch))
+            # The replies come back in the order of the commands.  On any
+            # error which ends the transaction, the caller closes the
+            # connection, so the remaining replies need not be read.
+            for recipient, command in batch:
+                code, response = connection.getreply()
+                if recipient is None:
+                    if code != 250:
+                        raise smtplib.SMTPSenderRefused(
+                            code, response, envsender)
+                elif code not in (250, 251):
+                    refused[recipient] = (code, response)
+                    if code == 421:
+                        raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if (0 < self._chunking_threshold <= len(msgtext) and
+                'chunking' in features):
+            for start in range(0, len(msgtext), CHUNK_SIZE):
+                chunk = msgtext[start:start + CHUNK_SIZE]
+                last = (' LAST' if start + CHUNK_SIZE >= len(msgtext) else '')
+                command = 'BDAT {}{}{}'.format(len(chunk), last, CRLF)
+                connection.send(command.encode('ascii') + chunk)
+                code, response = connection.getreply()
+                if code != 250:
+                    raise smtplib.SMTPDataError(code, response)
+        else:
+            code, response = connection.data(msgtext)
+            if code != 250:
+                raise smtplib.SMTPDataError(code, response)
+        return refused
+
+    def check(self):
+        """Check that the open connection to the SMTP server still works.
+
+        A connection which doesn't answer a NOOP command is closed, so that
+        the next `sendmail()` opens a new one.
+        """
+        if self._connection is None:
+            return
+        try:
+            code, response = self._connection.noop()
+        except (smtplib.SMTPException, OSError) as error:
+            code, response = None, error
+        if code != 250:
+            log.debug('Dropping broken connection to %s:%s: %s',
+                      self._host, self._port, response)
+            self._connection.close()
+            self._connection = None
+
     def quit(self):
         """Mimic `smtplib.SMTP.quit`."""
         if self._connection is None:
             return
         try:
             self._connection.quit()
-        except smtplib.SMTPException:
-            pass
+        except (smtplib.SMTPException, OSError):
+            self._connection.close()
         self._connection = None
+
+
+
+class ConnectionPool:
+    """Connections to the SMTP server which are kept open between messages.
+
+    While the pool is active, i.e. inside a `with` statement, deliveries
+    borrow their connections from the pool instead of opening their own.
+    Connections go back to the pool when a delivery is done with them.  They
+    still only carry the configured number of sessions before they are
+    reopened.
+    """
+
+    def __init__(self, host, port, sessions_per_connection,
+                 smtp_user=None, smtp_pass=None,
+                 idle_timeout=0, check_interval=0):
+        """Create a connection pool.
+
+        :param host: The host name of the SMTP server to connect to.
+        :type host: string
+        :param port: The port number of the SMTP server to connect to.
+        :type port: integer
+        :param sessions_per_connection: The number of SMTP sessions per
+            connection; see `Connection`.
+        :type sessions_per_connection: integer
+        :param smtp_user: Optional SMTP authentication user name.
+        :type smtp_user: str
+        :param smtp_pass: Optional SMTP authentication password.
+        :type smtp_pass: str
+        :param idle_timeout: Connections which have been idle for at least
+            this many seconds are closed by `prune()`.
+        :type idle_timeout: float
+        :param check_interval: Connections which have been idle for longer
+            than this many seconds are checked before they are reused.
+        :type check_interval: float
+        """
+        self._host = host
+        self._port = port
+        self._sessions_per_connection = sessions_per_connection
+        self._username = smtp_user
+        self._password = smtp_pass
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        # (time returned, connection) pairs, most recently returned last.
+        self._idle = []
+        self._lock = threading.Lock()
+        self._previous = None
+
+    @staticmethod
+    def current():
+        """Return the active connection pool, or None."""
+        return _current_pool
+
+    def __enter__(self):
+        global _current_pool
+        self._previous = _current_pool
+        _current_pool = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _current_pool
+        _current_pool = self._previous
+        self._previous = None
+        # Do not suppress exceptions.
+        return False
+
+    def __len__(self):
+        """The number of idle connections in the pool."""
+        return len(self._idle)
+
+    def get(self):
+        """Borrow a connection from the pool.
+
+        :return: The most recently used idle connection, or a new connection
+            if there are none.
+        :rtype: `Connection`
+        """
+        with self._lock:
+            if len(self._idle) > 0:
+                returned_at, connection = self._idle.pop()
+            else:
+                connection = None
+        if connection is None:
+            return Connection(self._host, self._port,
+                              self._sessions_per_connection,
+                              self._username, self._password)
+        if time.time() - returned_at > self.check_interval:
+            connection.check()
+        return connection
+
+    def put(self, connection):
+        """Return a borrowed connection to the pool.
+
+        :param connection: The connection returned by `get()`.
+        :type connection: `Connection`
+        """
+        with self._lock:
+            self._idle.append((time.time(), connection))
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` statement."""
+        connection = self.get()
+        try:
+            yield connection
+        finally:
+            self.put(connection)
+
+    def prune(self):
+        """Close the connections which have been idle for too long."""
+        deadline = time.time() - self.idle_timeout
+        with self._lock:
+            stale = [connection for returned_at, connection in self._idle
+                     if returned_at <= deadline]
+            self._idle = [(returned_at, connection)
+                          for returned_at, connection in self._idle
+                          if returned_at > deadline]
+        for connection in stale:
+            connection.quit()
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for returned_at, connection in idle:
+            connection.quit()
@@ -30,9 +30,13 @@ from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.mta import SomeRecipientsFailed
 from mailman.mta.decorating import DecoratingMixin
 from mailman.mta.personalized import PersonalizedMixin
+from mailman.mta.rendering import RenderingMixin
 from mailman.mta.verp import VERPMixin
 from mailman.mta.base import IndividualDelivery
 from mailman.mta.bulk import BulkDelivery
+from mailman.mta.checkpoint import DeliveryCheckpoint
+from mailman.mta.chunking import get_chunking
+from mailman.mta.throttle import get_throttle
 from mailman.utilities.string import expand
 
 
@@ -41,7 +45,7 @@ log = logging.getLogger('mailman.smtp')
 
 
 
-class Deliver(VERPMixin, DecoratingMixin, PersonalizedMixin,
+class Deliver(RenderingMixin, VERPMixin, DecoratingMixin, PersonalizedMixin,
               IndividualDelivery):
     """Deliver one message to one recipient.
 
@@ -51,6 +55,8 @@ class Deliver(VERPMixin, DecoratingMixin, PersonalizedMixin,
     * VERP
     * Full Personalization
     * Header/Footer decoration
+
+    The message is rendered only once for all the recipients, when possible.
     """
 
     def __init__(self):
@@ -70,6 +76,33 @@ def deliver(mlist, msg, msgdata):
     if not recipients:
         # Could be None, could be an empty sequence.
         return
+    # Big deliveries are checkpointed as they go, so that when this is a
+    # delivery which was cut short, the recipients who already got the
+    # message don't get it again.
+    checkpoint = None
+    threshold = int(config.mta.checkpoint_threshold)
+    if (threshold > 0 and len(recipients) >= threshold and
+            msgdata.get('_checkpoint') is not None):
+        checkpoint = DeliveryCheckpoint(msgdata['_checkpoint'])
+        undelivered = checkpoint.undelivered(recipients)
+        if len(undelivered) < len(recipients):
+            log.info('%s already delivered to %d recipients',
+                     msg.get('message-id', 'n/a'),
+                     len(recipients) - len(undelivered))
+            if len(undelivered) == 0:
+                return
+            recipients = msgdata['recipients'] = undelivered
+    # Hold back the recipients in domains which are being throttled, instead
+    # of using up SMTP sessions on them.
+    throttle = get_throttle()
+    recipients, deferred = throttle.admit(recipients)
+    if len(deferred) > 0:
+        log.info('%s deferred %d recipients in throttled domains',
+                 msg.get('message-id', 'n/a'),
+                 sum(len(addresses) for addresses in deferred.values()))
+        if len(recipients) == 0:
+            raise SomeRecipientsFailed([], [], deferred)
+        msgdata['recipients'] = recipients
     # Which delivery agent should we use?  Several situations can cause us to
     # use individual delivery.  If not specified, use bulk delivery.  See the
     # to-outgoing handler for when the 'verp' key is set in the metadata.
@@ -78,7 +111,7 @@ def deliver(mlist, msg, msgdata):
     elif mlist.personalize != Personalization.none:
         agent = Deliver()
     else:
-        agent = BulkDelivery(int(config.mta.max_recipients))
+        agent = BulkDelivery(int(config.mta.max_recipients), get_chunking())
     log.debug('Using agent: %s', agent)
     # Keep track of the original recipients and the original sender for
     # logging purposes.
@@ -86,9 +119,15 @@ def deliver(mlist, msg, msgdata):
     original_sender = msgdata.get('original-sender', msg.sender)
     # Let the agent attempt to deliver to the recipients.  Record all failures
     # for re-delivery later.
+    agent.checkpoint = checkpoint
     t0 = time.time()
-    refused = agent.deliver(mlist, msg, msgdata)
+    try:
+        refused = agent.deliver(mlist, msg, msgdata)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
     t1 = time.time()
+    throttle.record(recipients, refused)
     # Log this posting.
     size = getattr(msg, 'original_size', msgdata.get('original_size'))
     if size is None:
@@ -151,5 +190,6 @@ def deliver(mlist, msg, msgdata):
                 )
             log.info('%s', expand(template, substitutions))
     # Return the results
-    if temporary_failures or permanent_failures:
-        raise SomeRecipientsFailed(temporary_failures, permanent_failures)
+    if temporary_failures or permanent_failures or deferred:
+        raise SomeRecipientsFailed(
+            temporary_failures, permanent_failures, deferred)
@@ -51,8 +51,12 @@ class PersonalizedMixin:
         if mlist.personalize != Personalization.full:
             return
         recipient = msgdata['recipient']
-        user_manager = getUtility(IUserManager)
-        user = user_manager.get_user(recipient)
+        member = msgdata.get('member')
+        if member is not None and member.address.email == recipient.lower():
+            # The user has already been looked up along with the member.
+            user = member.address.user
+        else:
+            user = getUtility(IUserManager).get_user(recipient)
         if user is None:
             msg.replace_header('To', recipient)
         else:
@@ -0,0 +1,272 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Render a message once for all the recipients of an individual delivery.
+
+Individual delivery normally copies the message for every recipient, runs
+the callbacks on the copy and flattens it again.  Most of the message is the
+same for everybody though.  Only the To and X-Mailman-Copy headers and the
+`$user_*` substitutions in the header and footer decorations differ.
+
+So instead, the message is decorated and flattened once, with placeholders
+for those details, and each recipient's text is made by splicing their own
+details into the flattened template.  When a placeholder doesn't end up in
+the text as is, e.g. because the decorated part is base64 encoded, or when a
+recipient's details might change how the message is encoded, the message is
+rendered in full as before.
+"""
+
+__all__ = [
+    'MessageTemplate',
+    'RenderedMessage',
+    'RenderingMixin',
+    ]
+
+
+import re
+import copy
+import uuid
+import email
+
+from lazr.config import as_boolean
+from mailman.config import config
+from mailman.email.message import Message
+from mailman.handlers.decorate import member_substitutions
+
+
+# The decoration substitutions which are different for every member.
+MEMBER_KEYS = ('user_address', 'user_delivered_to', 'user_language',
+               'user_name', 'user_optionsurl')
+# The headers which are different for every recipient.
+RECIPIENT_HEADERS = ('To', 'X-Mailman-Copy')
+# Decorated parts with these transfer encodings hold the placeholders as is.
+LITERAL_ENCODINGS = ('', '7bit', '8bit', 'binary')
+
+
+
+def _spliceable(value):
+    """Can a value be spliced into the text of a decorated part?
+
+    The placeholders are ASCII, so an ASCII value doesn't change the charset
+    the decorated text is encoded in.  Decorations are also stripped of
+    trailing whitespace on every line, and empty decorations are left out.
+    """
+    if not isinstance(value, str) or value == '' or value.endswith(' '):
+        return False
+    try:
+        value.encode('ascii')
+    except UnicodeError:
+        return False
+    return '\r' not in value and '\n' not in value
+
+
+
+class MessageTemplate:
+    """A flattened message with slots for each recipient's details."""
+
+    def __init__(self, message, parts, to, fold):
+        """Create a template.
+
+        :param message: The decorated message, with placeholders.
+        :type message: `Message`
+        :param parts: The literal text of the flattened message, alternating
+            with the names of the slots between them.
+        :type parts: list
+        :param to: The original To header, or None if there isn't one.
+        :type to: str
+        :param fold: The function flattening a header.
+        :type fold: callable
+        """
+        self.message = message
+        self._parts = parts
+        self._slots = set(parts[1::2])
+        self._to = to
+        self._fold = fold
+
+    @classmethod
+    def build(cls, mlist, msg, msgdata, decorate):
+        """Decorate and flatten a message, with placeholders.
+
+        :param mlist: The mailing list being delivered to.
+        :type mlist: `IMailingList`
+        :param msg: The original message being delivered.
+        :type msg: `Message`
+        :param msgdata: Additional message metadata for this delivery.
+        :type msgdata: dictionary
+        :param decorate: The callback decorating the message.
+        :type decorate: callable
+        :return: The template, or None if the message can't be templated.
+        :rtype: `MessageTemplate`
+        """
+        prefix = uuid.uuid4().hex
+        placeholders = {
+            name: '@@{}:{}@@'.format(prefix, name)
+            for name in MEMBER_KEYS + RECIPIENT_HEADERS
+            }
+        message = copy.deepcopy(msg)
+        template_data = msgdata.copy()
+        template_data['member'] = None
+        decoration = {key: placeholders[key] for key in MEMBER_KEYS}
+        # Explicit decoration data wins over the member's, as usual.
+        decoration.update(msgdata.get('decoration-data', {}))
+        template_data['decoration-data'] = decoration
+        # Do to the headers what the callbacks would do, in the same order,
+        # so that they end up in the same places.
+        del message['x-mailman-copy']
+        message['X-Mailman-Copy'] = placeholders['X-Mailman-Copy']
+        decorate(mlist, message, template_data)
+        to = message['to']
+        if to is not None:
+            message.replace_header('To', placeholders['To'])
+        # Find the placeholders in the decorated parts.  They must be
+        # flattened as they are, and nothing else can hide any.
+        expected = 1 + (to is not None)
+        for part in message.walk():
+            if part.is_multipart() or part.get_content_maintype() != 'text':
+                continue
+            encoding = part.get('content-transfer-encoding', '').lower()
+            if encoding in LITERAL_ENCODINGS:
+                payload = part.get_payload()
+                if isinstance(payload, str):
+                    expected += payload.count(prefix)
+            elif prefix.encode('ascii') in part.get_payload(decode=True):
+                return None
+        text = message.as_string()
+        if text.count(prefix) != expected:
+            return None
+        fold = message.policy.clone(max_line_length=0).fold
+        slots = {placeholders[key]: key for key in MEMBER_KEYS}
+        for name in RECIPIENT_HEADERS:
+            slots[fold(name, placeholders[name])] = name
+        parts = re.split(
+            '({})'.format('|'.join(re.escape(slot) for slot in slots)), text)
+        parts[1::2] = [slots[slot] for slot in parts[1::2]]
+        return cls(message, parts, to, fold)
+
+    def render(self, mlist, msgdata, header_callbacks):
+        """Render the message for one recipient.
+
+        :param mlist: The mailing list being delivered to.
+        :type mlist: `IMailingList`
+        :param msgdata: The recipient's copy of the message metadata.
+        :type msgdata: dictionary
+        :param header_callbacks: The callbacks which set the recipient's To
+            and X-Mailman-Copy headers.
+        :type header_callbacks: sequence
+        :return: The recipient's message, or None if it can't be rendered
+            from the template.
+        :rtype: `RenderedMessage`
+        """
+        values = {}
+        member_keys = self._slots.intersection(MEMBER_KEYS)
+        if member_keys:
+            member = msgdata.get('member')
+            if member is None:
+                return None
+            substitutions = member_substitutions(
+                member, msgdata.get('recipient'))
+            for key in member_keys:
+                if not _spliceable(substitutions[key]):
+                    return None
+                values[key] = substitutions[key]
+        headers = Message()
+        if self._to is not None:
+            headers['To'] = self._to
+        for callback in header_callbacks:
+            callback(mlist, headers, msgdata)
+        for name in RECIPIENT_HEADERS:
+            values[name] = ''.join(self._fold(name, value)
+                                   for value in headers.get_all(name, []))
+        # The decorated message must not be decorated again.
+        msgdata['nodecorate'] = True
+        parts = list(self._parts)
+        parts[1::2] = [values[slot] for slot in parts[1::2]]
+        return RenderedMessage(''.join(parts), self.message, headers)
+
+
+
+class RenderedMessage:
+    """A recipient's message, rendered from a template.
+
+    Flattening it just returns the rendered text.  Its headers are those of
+    the template, except for the recipient's own To and X-Mailman-Copy
+    headers.  Anything else is answered by a message parsed from the text
+    the first time it is needed.
+    """
+
+    def __init__(self, text, template, headers):
+        self._text = text
+        self._template = template
+        self._headers = headers
+        self._message = None
+
+    def as_string(self):
+        return self._text
+
+    __str__ = as_string
+
+    def _source(self, name):
+        if name.lower() in ('to', 'x-mailman-copy'):
+            return self._headers
+        return self._template
+
+    def get(self, name, failobj=None):
+        return self._source(name).get(name, failobj)
+
+    def get_all(self, name, failobj=None):
+        return self._source(name).get_all(name, failobj)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self._source(name)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._message is None:
+            self._message = email.message_from_string(self._text, Message)
+        return getattr(self._message, name)
+
+
+
+class RenderingMixin:
+    """Render the message once for all the recipients.
+
+    This works with the VERP, decorating and personalizing callbacks.  Any
+    other set of callbacks gets every recipient's message rendered in full.
+    """
+
+    def _get_renderer(self, mlist, msg, msgdata):
+        """See `IndividualDelivery`."""
+        render = super(RenderingMixin, self)._get_renderer(
+            mlist, msg, msgdata)
+        callbacks = [self.avoid_duplicates, self.decorate, self.personalize_to]
+        if (not as_boolean(config.mta.render_once) or
+                self.callbacks != callbacks):
+            return render
+        template = MessageTemplate.build(mlist, msg, msgdata, self.decorate)
+        if template is None:
+            return render
+        header_callbacks = [self.avoid_duplicates, self.personalize_to]
+        def render_from_template(mlist, msg, msgdata):
+            rendered = template.render(mlist, msgdata, header_callbacks)
+            if rendered is None:
+                return render(mlist, msg, msgdata)
+            return rendered
+        return render_from_template
@@ -0,0 +1,142 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the delivery checkpoints."""
+
+__all__ = [
+    'TestCheckpointedDelivery',
+    'TestDeliveryCheckpoint',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.interfaces.mta import SomeRecipientsFailed
+from mailman.mta.checkpoint import DeliveryCheckpoint
+from mailman.mta.deliver import deliver
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+
+
+
+class TestDeliveryCheckpoint(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self._path = os.path.join(tempdir, 'checkpoint.dlv')
+
+    def test_missing_file(self):
+        checkpoint = DeliveryCheckpoint(self._path)
+        self.assertEqual(checkpoint.delivered(), set())
+        checkpoint.record([])
+        checkpoint.close()
+        self.assertFalse(os.path.exists(self._path))
+
+    def test_record(self):
+        checkpoint = DeliveryCheckpoint(self._path)
+        checkpoint.record(['anne@example.com', 'bart@example.com'])
+        # The recipients are written out right away.
+        self.assertEqual(DeliveryCheckpoint(self._path).delivered(),
+                         {'anne@example.com', 'bart@example.com'})
+        checkpoint.record(['cris@example.com'])
+        checkpoint.close()
+        self.assertEqual(
+            DeliveryCheckpoint(self._path).undelivered([
+                'dave@example.com', 'bart@example.com', 'elly@example.com']),
+            ['dave@example.com', 'elly@example.com'])
+
+    def test_cut_short(self):
+        # A recipient whose line was cut short doesn't count as delivered.
+        with open(self._path, 'w') as fp:
+            fp.write('anne@example.com\nbart@exam')
+        self.assertEqual(DeliveryCheckpoint(self._path).delivered(),
+                         {'anne@example.com'})
+
+
+
+class TestCheckpointedDelivery(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        self._path = os.path.join(tempdir, 'checkpoint.dlv')
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._recipients = ['{}@example.net'.format(n) for n in range(6)]
+        patcher = patch('mailman.mta.connection.smtplib.SMTP')
+        self._smtp = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self._smtp.noop.return_value = (250, b'OK')
+        self._sent = []
+        self._smtp.sendmail.side_effect = self._sendmail
+
+    def _sendmail(self, sender, recipients, msgtext):
+        self._sent.extend(recipients)
+        if '5@example.net' in recipients:
+            return {'5@example.net': (450, b'Mailbox busy')}
+        return {}
+
+    def _deliver(self, **settings):
+        msgdata = dict(recipients=self._recipients, _checkpoint=self._path)
+        settings.setdefault('checkpoint_threshold', 2)
+        with configuration('mta', max_recipients=2, **settings):
+            deliver(self._mlist, self._msg, msgdata)
+
+    def test_record_accepted_recipients(self):
+        with self.assertRaises(SomeRecipientsFailed):
+            self._deliver()
+        self.assertEqual(sorted(self._sent), self._recipients)
+        # The refused recipient wasn't delivered to.
+        self.assertEqual(DeliveryCheckpoint(self._path).delivered(),
+                         set(self._recipients[:5]))
+
+    def test_record_concurrent_deliveries(self):
+        with self.assertRaises(SomeRecipientsFailed):
+            self._deliver(max_delivery_threads=2)
+        self.assertEqual(DeliveryCheckpoint(self._path).delivered(),
+                         set(self._recipients[:5]))
+
+    def test_resume(self):
+        # The checkpoint of a delivery which was cut short.
+        DeliveryCheckpoint(self._path).record(self._recipients[:4])
+        with self.assertRaises(SomeRecipientsFailed) as cm:
+            self._deliver()
+        self.assertEqual(sorted(self._sent), self._recipients[4:])
+        self.assertEqual(cm.exception.temporary_failures, ['5@example.net'])
+
+    def test_resume_with_nothing_left(self):
+        DeliveryCheckpoint(self._path).record(self._recipients)
+        self._deliver()
+        self.assertEqual(self._sent, [])
+
+    def test_below_threshold(self):
+        DeliveryCheckpoint(self._path).record(self._recipients[:4])
+        with self.assertRaises(SomeRecipientsFailed):
+            self._deliver(checkpoint_threshold=7)
+        self.assertEqual(sorted(self._sent), self._recipients)
@@ -0,0 +1,170 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the bulk delivery chunking strategies."""
+
+__all__ = [
+    'TestDomainChunking',
+    'TestLearning',
+    ]
+
+
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.interfaces.mta import IChunkingStrategy
+from mailman.mta.bulk import BulkDelivery
+from mailman.mta.chunking import DomainChunking, TLDChunking, get_chunking
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from unittest.mock import patch
+from zope.interface.verify import verifyObject
+
+
+
+class TestDomainChunking(unittest.TestCase):
+    def setUp(self):
+        self._chunking = DomainChunking()
+
+    def _chunkify(self, recipients, max_recipients):
+        return [sorted(chunk) for chunk in
+                self._chunking.chunkify(recipients, max_recipients)]
+
+    def test_interfaces(self):
+        verifyObject(IChunkingStrategy, DomainChunking())
+        verifyObject(IChunkingStrategy, TLDChunking())
+
+    def test_group_by_domain(self):
+        recipients = ['{}@{}'.format(name, domain)
+                      for name in ('anne', 'bart', 'cris')
+                      for domain in ('a.example.com', 'b.example.com')]
+        self.assertEqual(self._chunkify(recipients, 3), [
+            ['anne@a.example.com', 'bart@a.example.com', 'cris@a.example.com'],
+            ['anne@b.example.com', 'bart@b.example.com', 'cris@b.example.com'],
+            ])
+
+    def test_pack_remainders(self):
+        recipients = (['{}@example.com'.format(n) for n in range(5)] +
+                      ['{}@example.org'.format(n) for n in range(2)] +
+                      ['{}@example.net'.format(n) for n in range(1)] +
+                      ['{}@example.edu'.format(n) for n in range(1)])
+        chunks = self._chunkify(recipients, 3)
+        self.assertEqual(chunks, [
+            ['0@example.com', '1@example.com', '2@example.com'],
+            ['0@example.edu', '3@example.com', '4@example.com'],
+            ['0@example.net', '0@example.org', '1@example.org'],
+            ])
+
+    def test_domains_are_case_insensitive(self):
+        chunks = self._chunkify(
+            ['anne@EXAMPLE.com', 'bart@example.COM', 'cris@example.org'], 2)
+        self.assertEqual(chunks, [
+            ['anne@EXAMPLE.com', 'bart@example.COM'],
+            ['cris@example.org'],
+            ])
+
+    def test_no_maximum(self):
+        recipients = ['anne@example.com', 'bart@example.org']
+        self.assertEqual(self._chunkify(recipients, 0), [sorted(recipients)])
+
+    def test_learned_limit(self):
+        recipients = ['{}@example.com'.format(n) for n in range(5)]
+        self._chunking.learn(set(recipients), {
+            '3@example.com': (452, b'Too many recipients'),
+            '4@example.com': (452, b'Too many recipients'),
+            })
+        self.assertEqual(self._chunking.limits, {'example.com': 3})
+        chunks = self._chunkify(recipients + ['anne@example.org'], 500)
+        self.assertEqual(chunks, [
+            ['0@example.com', '1@example.com', '2@example.com'],
+            ['3@example.com', '4@example.com', 'anne@example.org'],
+            ])
+        # The limit applies without a maximum too.
+        self.assertEqual(len(self._chunkify(recipients, 0)), 2)
+
+    def test_learned_limit_caps_packed_chunks(self):
+        self._chunking.limits['example.com'] = 2
+        recipients = ['anne@example.org', 'bart@example.org',
+                      'anne@example.com']
+        self.assertEqual(self._chunkify(recipients, 10), [
+            ['anne@example.org', 'bart@example.org'],
+            ['anne@example.com'],
+            ])
+
+    def test_nothing_learned(self):
+        recipients = {'anne@example.com', 'bart@example.com'}
+        # Permanent failures say nothing about the limit.
+        self._chunking.learn(recipients, {
+            'anne@example.com': (550, b'No such user')})
+        # Nor does a server which accepted nobody.
+        self._chunking.learn(recipients, {
+            'anne@example.com': (452, b'Insufficient storage'),
+            'bart@example.com': (452, b'Insufficient storage'),
+            })
+        self.assertEqual(self._chunking.limits, {})
+
+
+
+class TestLearning(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+
+""")
+        self._recipients = ['{}@example.net'.format(n) for n in range(5)]
+
+    def test_configured_strategy(self):
+        self.assertIsInstance(get_chunking(), DomainChunking)
+        # The same strategy is used for every delivery.
+        self.assertIs(get_chunking(), get_chunking())
+        with configuration('mta', chunking='mailman.mta.chunking.TLDChunking'):
+            self.assertIsInstance(get_chunking(), TLDChunking)
+
+    def test_learn_from_delivery(self):
+        chunking = DomainChunking()
+        sent = []
+        def sendmail(sender, recipients, msgtext):
+            sent.append(sorted(recipients))
+            refused = {recipient: (452, b'Too many recipients')
+                       for recipient in sorted(recipients)[2:]}
+            # Like smtplib, return the refused recipients when some of
+            # them were accepted.
+            return refused
+        with patch('mailman.mta.connection.smtplib.SMTP') as SMTP:
+            SMTP.return_value.sendmail.side_effect = sendmail
+            SMTP.return_value.noop.return_value = (250, b'OK')
+            agent = BulkDelivery(5, chunking)
+            refused = agent.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+            self.assertEqual(len(refused), 3)
+            self.assertEqual(chunking.limits, {'example.net': 2})
+            # The next delivery fits the learned limit.
+            del sent[:]
+            refused = BulkDelivery(5, chunking).deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        self.assertEqual(sent, [
+            ['0@example.net', '1@example.net'],
+            ['2@example.net', '3@example.net'],
+            ['4@example.net'],
+            ])
@@ -19,15 +19,24 @@
 
 __all__ = [
     'TestConnection',
+    'TestConnectionPool',
+    'TestExtensions',
     ]
 
 
 import unittest
 
+from mailman.app.lifecycle import create_list
 from mailman.config import config
-from mailman.mta.connection import Connection
-from mailman.testing.layers import SMTPLayer
-from smtplib import SMTPAuthenticationError
+from mailman.mta.bulk import BulkDelivery
+from mailman.mta.connection import Connection, ConnectionPool
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer, SMTPLayer
+from smtplib import (
+    SMTPAuthenticationError, SMTPDataError, SMTPRecipientsRefused,
+    SMTPSenderRefused, SMTPServerDisconnected)
+from unittest.mock import patch
 
 
 
@@ -63,3 +72,183 @@ Subject: aardvarks
 """)
         self.assertEqual(self.layer.smtpd.get_authentication_credentials(),
                          'AHRlc3R1c2VyAHRlc3RwYXNz')
+
+
+
+class TestConnectionPool(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        patcher = patch('mailman.mta.connection.smtplib.SMTP')
+        self._smtp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self._smtp = self._smtp_class.return_value
+        self._smtp.sendmail.return_value = {}
+        self._smtp.noop.return_value = (250, b'OK')
+        self._pool = ConnectionPool('localhost', 25, 0, check_interval=60)
+
+    def _send(self):
+        with self._pool.connection() as connection:
+            return connection.sendmail(
+                'anne@example.com', ['bart@example.com'], 'Subject: hi\n\n')
+
+    def test_connections_are_reused(self):
+        self._send()
+        self._send()
+        self.assertEqual(self._smtp_class.call_count, 1)
+        self.assertEqual(self._smtp.sendmail.call_count, 2)
+        self.assertEqual(len(self._pool), 1)
+
+    def test_sessions_per_connection(self):
+        # Pooled connections are still recycled after the configured number
+        # of sessions.
+        self._pool = ConnectionPool('localhost', 25, 2)
+        for i in range(3):
+            self._send()
+        self.assertEqual(self._smtp.connect.call_count, 2)
+        self.assertEqual(self._smtp.quit.call_count, 1)
+
+    def test_prune(self):
+        self._send()
+        self._pool.idle_timeout = 60
+        self._pool.prune()
+        self.assertEqual(len(self._pool), 1)
+        self._pool.idle_timeout = 0
+        self._pool.prune()
+        self.assertEqual(len(self._pool), 0)
+        self.assertEqual(self._smtp.quit.call_count, 1)
+
+    def test_close(self):
+        self._send()
+        self._pool.close()
+        self.assertEqual(len(self._pool), 0)
+        self.assertEqual(self._smtp.quit.call_count, 1)
+
+    def test_health_check(self):
+        # Connections which have been idle for a while are checked before
+        # they are reused, and broken ones are reopened.
+        self._pool.check_interval = 0
+        self._send()
+        self._smtp.noop.side_effect = SMTPServerDisconnected('gone')
+        self._send()
+        self.assertEqual(self._smtp.noop.call_count, 1)
+        self.assertEqual(self._smtp.close.call_count, 1)
+        self.assertEqual(self._smtp.connect.call_count, 2)
+
+    def test_no_health_check_for_busy_connections(self):
+        self._send()
+        self._send()
+        self.assertEqual(self._smtp.noop.call_count, 0)
+
+    def test_deliveries_use_the_active_pool(self):
+        mlist = create_list('test@example.com')
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        msgdata = dict(recipients=['bart@example.com'])
+        self.assertIsNone(ConnectionPool.current())
+        with self._pool:
+            self.assertIs(ConnectionPool.current(), self._pool)
+            BulkDelivery().deliver(mlist, msg, msgdata)
+            BulkDelivery().deliver(mlist, msg, msgdata)
+        self.assertIsNone(ConnectionPool.current())
+        self.assertEqual(self._smtp_class.call_count, 1)
+        self.assertEqual(self._smtp.sendmail.call_count, 2)
+        self.assertEqual(len(self._pool), 1)
+
+
+
+class TestExtensions(unittest.TestCase):
+    """Test the use of ESMTP PIPELINING and CHUNKING."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        patcher = patch('mailman.mta.connection.smtplib.SMTP')
+        self._smtp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self._smtp = self._smtp_class.return_value
+        self._smtp.esmtp_features = dict(pipelining='', size='1000000')
+        self._smtp.data.return_value = (250, b'OK')
+        self._recipients = ['anne@example.com', 'bart@example.com',
+                            'cris@example.com']
+        self._msgtext = 'Subject: hi\n\n.A message.\n'
+
+    def _sendmail(self, *replies):
+        self._smtp.getreply.side_effect = list(replies)
+        connection = Connection('localhost', 25, 0)
+        return connection.sendmail(
+            'test-bounces@example.com', self._recipients, self._msgtext)
+
+    def _sent(self):
+        return [call[0][0] for call in self._smtp.send.call_args_list]
+
+    def test_pipelining(self):
+        refused = self._sendmail(
+            (250, b'OK'), (250, b'OK'), (550, b'No such user'), (250, b'OK'))
+        self.assertEqual(refused, {'bart@example.com': (550, b'No such user')})
+        self.assertFalse(self._smtp.sendmail.called)
+        # The whole envelope went out in one go.
+        self.assertEqual(self._sent(), [
+            'mail FROM:<test-bounces@example.com> SIZE=28\r\n'
+            'rcpt TO:<anne@example.com>\r\n'
+            'rcpt TO:<bart@example.com>\r\n'
+            'rcpt TO:<cris@example.com>\r\n'])
+        self._smtp.data.assert_called_once_with(
+            b'Subject: hi\r\n\r\n.A message.\r\n')
+
+    def test_pipeline_depth(self):
+        with patch('mailman.mta.connection.PIPELINE_DEPTH', 3):
+            refused = self._sendmail(*[(250, b'OK')] * 4)
+        self.assertEqual(refused, {})
+        self.assertEqual(len(self._sent()), 2)
+
+    def test_sender_refused(self):
+        with self.assertRaises(SMTPSenderRefused) as cm:
+            self._sendmail((553, b'Bad sender'))
+        self.assertEqual(cm.exception.smtp_code, 553)
+        # The connection is closed after a failure.
+        self.assertEqual(self._smtp.quit.call_count, 1)
+
+    def test_all_recipients_refused(self):
+        with self.assertRaises(SMTPRecipientsRefused) as cm:
+            self._sendmail((250, b'OK'), *[(550, b'No such user')] * 3)
+        self.assertEqual(sorted(cm.exception.recipients), self._recipients)
+        self.assertFalse(self._smtp.data.called)
+
+    def test_data_error(self):
+        self._smtp.data.return_value = (554, b'Spam')
+        with self.assertRaises(SMTPDataError):
+            self._sendmail(*[(250, b'OK')] * 4)
+
+    def test_chunking(self):
+        self._smtp.esmtp_features = dict(chunking='')
+        with configuration('mta', chunking_threshold=10), \
+                patch('mailman.mta.connection.CHUNK_SIZE', 20):
+            refused = self._sendmail(*[(250, b'OK')] * 6)
+        self.assertEqual(refused, {})
+        self.assertFalse(self._smtp.data.called)
+        # Without PIPELINING, every envelope command is sent on its own.
+        # The body goes out in chunks, unquoted.
+        self.assertEqual(self._sent()[4:], [
+            b'BDAT 20\r\nSubject: hi\r\n\r\n.A me',
+            b'BDAT 8 LAST\r\nssage.\r\n',
+            ])
+
+    def test_small_messages_are_not_chunked(self):
+        self._smtp.esmtp_features = dict(chunking='')
+        self._smtp.sendmail.return_value = {}
+        with configuration('mta', chunking_threshold=1000):
+            self._sendmail()
+        self._smtp.sendmail.assert_called_once_with(
+            'test-bounces@example.com', self._recipients, self._msgtext)
+
+    def test_pipelining_disabled(self):
+        self._smtp.sendmail.return_value = {}
+        with configuration('mta', use_pipelining='no'):
+            self._sendmail()
+        self.assertEqual(self._smtp.sendmail.call_count, 1)
+        self.assertFalse(self._smtp.send.called)
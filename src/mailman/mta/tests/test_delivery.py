@@ -18,11 +18,14 @@
 """Test various aspects of email delivery."""
 
 __all__ = [
+    'TestConcurrentDelivery',
     'TestIndividualDelivery',
+    'TestRenderOnce',
     ]
 
 
 import os
+import re
 import shutil
 import tempfile
 import unittest
@@ -30,10 +33,16 @@ import unittest
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.interfaces.mailinglist import Personalization
+from mailman.mta.bulk import BulkDelivery
+from mailman.mta.connection import ConnectionPool
 from mailman.mta.deliver import Deliver
+from mailman.mta.rendering import RenderedMessage
 from mailman.testing.helpers import (
-    specialized_message_from_string as mfs, subscribe)
+    configuration, specialized_message_from_string as mfs, subscribe)
 from mailman.testing.layers import ConfigLayer
+from smtplib import SMTPRecipientsRefused
+from sqlalchemy import event
+from unittest.mock import patch
 
 
 
@@ -132,3 +141,236 @@ name     : Anne Person
 options  : http://example.com/anne@example.org
 
 """)
+
+
+    def test_queries_per_message(self):
+        # The number of database queries doesn't grow with the number of
+        # recipients.
+        self._mlist.personalize = Personalization.full
+        recipients = ['anne@example.org']
+        for name in ('Bart', 'Cris', 'Dave', 'Elle', 'Fred'):
+            member = subscribe(self._mlist, name)
+            recipients.append(member.address.email)
+        config.db.commit()
+        queries = []
+        def count(*args):
+            queries.append(args)
+        counts = []
+        for count_recipients in (2, 6):
+            msgdata = dict(recipients=recipients[:count_recipients])
+            # Reload the mailing list before counting.
+            self._mlist.list_id
+            del queries[:]
+            event.listen(config.db.engine, 'before_cursor_execute', count)
+            try:
+                DeliverTester().deliver(self._mlist, self._msg, msgdata)
+            finally:
+                event.remove(config.db.engine, 'before_cursor_execute', count)
+            counts.append(len(queries))
+        self.assertEqual(len(_deliveries), 8)
+        self.assertEqual(counts[0], counts[1])
+        _mlist, _msg, _msgdata, _recipients = _deliveries[-1]
+        self.assertEqual(_msg['to'], 'Fred Person <fperson@example.com>')
+
+
+
+class TestConcurrentDelivery(unittest.TestCase):
+    """Test delivery over several SMTP sessions at the same time."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        patcher = patch('mailman.mta.connection.smtplib.SMTP')
+        self._smtp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self._smtp = self._smtp_class.return_value
+        self._smtp.sendmail.side_effect = self._sendmail
+        self._smtp.noop.return_value = (250, b'OK')
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+""")
+        self._recipients = ['person_{:02d}@example.org'.format(i)
+                            for i in range(20)]
+
+    def _sendmail(self, sender, recipients, msgtext):
+        # Every fifth person's mailbox is full.
+        refused = {recipient: (552, b'Mailbox full')
+                   for recipient in recipients
+                   if int(recipient[7:9]) % 5 == 0}
+        if len(refused) == len(recipients):
+            raise SMTPRecipientsRefused(refused)
+        return refused
+
+    def _deliver(self, agent):
+        return agent.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+
+    def test_bulk_chunks(self):
+        serial = self._deliver(BulkDelivery(max_recipients=3))
+        self._smtp.reset_mock()
+        with configuration('mta', max_delivery_threads=4):
+            concurrent = self._deliver(BulkDelivery(max_recipients=3))
+        self.assertEqual(concurrent, serial)
+        self.assertEqual(sorted(concurrent), self._recipients[::5])
+        # The message went out once per chunk.
+        self.assertEqual(self._smtp.sendmail.call_count, 7)
+        delivered = [recipient
+                     for call in self._smtp.sendmail.call_args_list
+                     for recipient in call[0][1]]
+        self.assertEqual(sorted(delivered), self._recipients)
+        # The connections of the private pool are closed afterward.
+        self.assertIsNone(ConnectionPool.current())
+        self.assertEqual(self._smtp.quit.call_count,
+                         self._smtp.connect.call_count)
+
+    def test_individual_deliveries(self):
+        self._mlist.personalize = Personalization.individual
+        with configuration('mta', max_delivery_threads=4):
+            refused = self._deliver(Deliver())
+        self.assertEqual(sorted(refused), self._recipients[::5])
+        self.assertEqual(self._smtp.sendmail.call_count, 20)
+        # Every recipient got their own copy.
+        delivered = sorted(call[0][1][0]
+                           for call in self._smtp.sendmail.call_args_list)
+        self.assertEqual(delivered, self._recipients)
+
+    def test_active_pool(self):
+        self._smtp.sendmail.side_effect = None
+        self._smtp.sendmail.return_value = {}
+        pool = ConnectionPool('localhost', 25, 0)
+        with configuration('mta', max_delivery_threads=4), pool:
+            self._deliver(BulkDelivery(max_recipients=1))
+        # The connections are left open in the active pool.
+        self.assertGreater(len(pool), 0)
+        self.assertEqual(self._smtp.quit.call_count, 0)
+        pool.close()
+
+
+
+class TestRenderOnce(unittest.TestCase):
+    """Test rendering personalized messages from a template."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._mlist.personalize = Personalization.full
+        subscribe(self._mlist, 'Anne', email='anne@example.org')
+        subscribe(self._mlist, 'Bart', email='bart@example.org')
+        self._recipients = ['anne@example.org', 'bart@example.org',
+                            'cris@example.org']
+        self._template_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._template_dir)
+        for name, text in (('header', 'Hello $user_name\n'),
+                           ('footer', 'You are $user_address '
+                                      '($user_delivered_to, $user_language)\n'
+                                      'Options: $user_optionsurl\n')):
+            path = os.path.join(
+                self._template_dir, 'site', 'en', name + '.txt')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as fp:
+                fp.write(text)
+        config.push('templates', """
+        [paths.testing]
+        template_dir: {0}
+        """.format(self._template_dir))
+        self.addCleanup(config.pop, 'templates')
+        self._mlist.header_uri = 'mailman:///header.txt'
+        self._mlist.footer_uri = 'mailman:///footer.txt'
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+A message.
+""")
+        self._msgdata = dict(recipients=self._recipients, verp=True,
+                             **{'add-dup-header': {'bart@example.org'}})
+        self.maxDiff = None
+
+    def _deliver(self, render_once):
+        del _deliveries[:]
+        with configuration('mta', render_once=render_once):
+            DeliverTester().deliver(
+                self._mlist, self._msg, self._msgdata.copy())
+        messages = {}
+        for mlist, msg, msgdata, recipients in _deliveries:
+            # Fresh MIME boundaries are made up every time.
+            text = re.sub('={15}[0-9]+==', '=BOUNDARY=', msg.as_string())
+            messages[recipients[0]] = (msg, text)
+        del _deliveries[:]
+        return messages
+
+    def _check(self, rendered):
+        expected = self._deliver('no')
+        messages = self._deliver('yes')
+        self.assertEqual(sorted(messages), self._recipients)
+        for recipient in self._recipients:
+            msg, text = messages[recipient]
+            self.assertMultiLineEqual(text, expected[recipient][1])
+            self.assertEqual(isinstance(msg, RenderedMessage),
+                             recipient in rendered, recipient)
+        return messages
+
+    def test_text_plain(self):
+        messages = self._check(rendered=self._recipients[:2])
+        msg, text = messages['bart@example.org']
+        self.assertEqual(msg['to'], 'Bart Person <bart@example.org>')
+        self.assertEqual(msg['x-mailman-copy'], 'yes')
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertIn('Hello Bart Person\n', text)
+        self.assertEqual(msg.get_content_type(), 'text/plain')
+        msg, text = messages['anne@example.org']
+        self.assertIsNone(msg['x-mailman-copy'])
+
+    def test_multipart_mixed(self):
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+--BOUNDARY
+Content-Type: text/plain
+
+A message.
+--BOUNDARY--
+""")
+        self._check(rendered=self._recipients[:2])
+
+    def test_wrapped(self):
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+MIME-Version: 1.0
+Content-Type: text/html
+
+<p>A message.</p>
+""")
+        self._check(rendered=self._recipients[:2])
+
+    def test_non_ascii_details(self):
+        # A non-ASCII name might change the message's character set.
+        user = self._mlist.members.get_member('bart@example.org').user
+        user.display_name = 'B\xe4rt Person'
+        self._check(rendered=self._recipients[:1])
+
+    def test_encoded_decoration(self):
+        # The decorated body of this message is base64 encoded.
+        self._msg.set_payload('A m\xebssage.\n'.encode('utf-8'), 'utf-8')
+        self._check(rendered=[])
+
+    def test_no_decoration(self):
+        self._mlist.header_uri = None
+        self._mlist.footer_uri = None
+        self._check(rendered=self._recipients)
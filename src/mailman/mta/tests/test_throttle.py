@@ -0,0 +1,179 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the outgoing rate limits and circuit breakers."""
+
+__all__ = [
+    'TestDeliverThrottled',
+    'TestThrottle',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime, timedelta
+from mailman.app.lifecycle import create_list
+from mailman.interfaces.mta import SomeRecipientsFailed
+from mailman.mta.deliver import deliver
+from mailman.mta.throttle import Throttle, collect, get_throttle
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
+from unittest.mock import patch
+
+
+START = datetime(2015, 1, 1, 12, 0, 0)
+TEMPORARY = (451, b'Try again later')
+
+
+
+def _seconds(seconds):
+    return START + timedelta(seconds=seconds)
+
+
+
+class TestThrottle(unittest.TestCase):
+    def test_no_limits(self):
+        throttle = Throttle()
+        recipients = ['anne@example.com', 'bart@example.org']
+        admitted, deferred = throttle.admit(recipients, START)
+        self.assertEqual(sorted(admitted), recipients)
+        self.assertEqual(deferred, {})
+        self.assertEqual(throttle.domains, {})
+
+    def test_rate_limit(self):
+        throttle = Throttle(rate=2, burst=3)
+        recipients = ['{}@example.com'.format(n) for n in range(5)]
+        admitted, deferred = throttle.admit(
+            recipients + ['anne@example.org'], START)
+        self.assertEqual(sorted(admitted), [
+            '0@example.com', '1@example.com', '2@example.com',
+            'anne@example.org'])
+        # There are tokens for them a second later.
+        self.assertEqual(deferred, {
+            _seconds(1): ['3@example.com', '4@example.com'],
+            })
+        # Another message can't have them earlier.
+        admitted, deferred = throttle.admit(['5@example.com'], _seconds(0.25))
+        self.assertEqual(admitted, [])
+        self.assertEqual(deferred, {_seconds(1.25): ['5@example.com']})
+        # But by then, the deferred recipients can go.
+        admitted, deferred = throttle.admit(
+            ['3@example.com', '4@example.com'], _seconds(1))
+        self.assertEqual(admitted, ['3@example.com', '4@example.com'])
+        self.assertEqual(throttle.domains['example.com'].deferred, 3)
+
+    def test_circuit_breaker(self):
+        throttle = Throttle(failure_threshold=2,
+                            open_period=timedelta(minutes=5))
+        recipients = ['anne@example.com', 'bart@example.com',
+                      'cris@example.org']
+        refused = {'anne@example.com': TEMPORARY,
+                   'bart@example.com': TEMPORARY}
+        throttle.record(recipients, refused, START)
+        self.assertEqual(throttle.admit(recipients, START)[1], {})
+        throttle.record(recipients, refused, START)
+        # The circuit for example.com is open now, but example.org is fine.
+        self.assertEqual(list(throttle.domains), ['example.com'])
+        state = throttle.domains['example.com']
+        self.assertEqual(state.status(START), 'open')
+        admitted, deferred = throttle.admit(recipients, _seconds(60))
+        self.assertEqual(admitted, ['cris@example.org'])
+        self.assertEqual(deferred, {
+            _seconds(300): ['anne@example.com', 'bart@example.com'],
+            })
+        # After the open period, a trial delivery is let through.  When it
+        # fails, the circuit opens again right away.
+        self.assertEqual(state.status(_seconds(300)), 'half-open')
+        admitted, deferred = throttle.admit(recipients, _seconds(300))
+        self.assertEqual(len(admitted), 3)
+        throttle.record(admitted, refused, _seconds(300))
+        self.assertEqual(state.open_until, _seconds(600))
+        # When it succeeds, the circuit closes.
+        throttle.record(admitted, {'anne@example.com': TEMPORARY},
+                        _seconds(600))
+        self.assertEqual(state.status(_seconds(600)), 'closed')
+        self.assertEqual(state.failures, 0)
+        throttle.prune(_seconds(600))
+        self.assertEqual(throttle.domains, {})
+
+    def test_permanent_failures_close_the_circuit(self):
+        throttle = Throttle(failure_threshold=1,
+                            open_period=timedelta(minutes=5))
+        throttle.record(['anne@example.com'],
+                        {'anne@example.com': (550, b'No such user')}, START)
+        self.assertEqual(throttle.domains, {})
+
+    def test_collect(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        throttle_1 = Throttle(rate=1, burst=10)
+        throttle_1.admit(['{}@example.com'.format(n) for n in range(4)])
+        throttle_1.save(os.path.join(tempdir, 'out.0.throttle'))
+        throttle_2 = Throttle(burst=10, failure_threshold=1,
+                              open_period=timedelta(minutes=5))
+        throttle_2.record(['anne@example.com'],
+                          {'anne@example.com': TEMPORARY})
+        throttle_2.save(os.path.join(tempdir, 'out.1.throttle'))
+        domains = collect(tempdir)
+        self.assertEqual(list(domains), ['example.com'])
+        state = domains['example.com']
+        self.assertAlmostEqual(state['tokens'], 6, places=2)
+        self.assertEqual(state['failures'], 1)
+        self.assertEqual(state['circuit'], 'open')
+        self.assertEqual(collect(os.path.join(tempdir, 'missing')), {})
+
+
+
+class TestDeliverThrottled(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+
+    def test_deferred(self):
+        recipients = ['anne@example.com', 'bart@example.com',
+                      'cris@example.com', 'dave@example.org']
+        with configuration('mta', domain_rate=1, domain_burst=2), \
+                patch('mailman.mta.connection.smtplib.SMTP') as SMTP:
+            SMTP.return_value.sendmail.return_value = {}
+            SMTP.return_value.noop.return_value = (250, b'OK')
+            with self.assertRaises(SomeRecipientsFailed) as cm:
+                deliver(self._mlist, self._msg, dict(recipients=recipients))
+            self.assertEqual(get_throttle().domains['example.com'].deferred,
+                             1)
+        error = cm.exception
+        self.assertEqual(error.temporary_failures, [])
+        self.assertEqual(error.permanent_failures, [])
+        self.assertEqual(error.deferred, {
+            now() + timedelta(seconds=1): ['cris@example.com'],
+            })
+        # Only the admitted recipients were handed to the MTA.
+        delivered = SMTP.return_value.sendmail.call_args[0][1]
+        self.assertEqual(
+            sorted(delivered),
+            ['anne@example.com', 'bart@example.com', 'dave@example.org'])
@@ -0,0 +1,327 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rate limiting and circuit breaking of outgoing mail, by recipient domain.
+
+Every recipient domain has a token bucket, which fills up at `domain_rate`
+tokens per second, up to `domain_burst` tokens.  Every recipient handed to
+the MTA takes a token, and recipients for which there is no token are
+deferred until there will be.
+
+Every recipient domain also has a circuit breaker.  When all of a domain's
+recipients fail temporarily in `circuit_failures` deliveries in a row, the
+circuit opens and the domain's recipients are deferred for
+`circuit_open_period`.  After that, the next delivery is let through as a
+trial.  The circuit closes again when it succeeds, and opens for another
+period when it doesn't.
+
+The state of the throttle is kept by each outgoing runner process, which
+periodically saves it in the stats directory for the REST API to pick up.
+"""
+
+__all__ = [
+    'DomainState',
+    'Throttle',
+    'collect',
+    'get_throttle',
+    ]
+
+
+import os
+import json
+import math
+
+from datetime import timedelta
+from lazr.config import as_timedelta
+from mailman.config import config
+from mailman.utilities.datetime import now
+from mailman.utilities.filesystem import makedirs
+
+
+# The extension of the files the throttle states are saved in.
+EXTENSION = '.throttle'
+
+# The throttles in use, by their settings.
+_throttles = {}
+
+
+
+def _domain(address):
+    return address.rpartition('@')[2].lower()
+
+
+def _is_temporary(code):
+    # See `mailman.mta.deliver.deliver()` about 552.
+    return code < 500 or code == 552
+
+
+
+class DomainState:
+    """The rate limit and circuit breaker of one recipient domain."""
+
+    def __init__(self, tokens, updated):
+        # The tokens in the bucket, as of the time it was last updated.
+        self.tokens = tokens
+        self.updated = updated
+        # The number of deliveries in a row which failed temporarily.
+        self.failures = 0
+        # While the circuit is open, the time it will let a trial through.
+        self.open_until = None
+        # The number of recipients deferred so far.
+        self.deferred = 0
+
+    def status(self, when):
+        """The state of the circuit breaker.
+
+        :param when: The current time.
+        :type when: `datetime`
+        :return: 'closed', 'open' or 'half-open'.
+        :rtype: str
+        """
+        if self.open_until is None:
+            return 'closed'
+        if when < self.open_until:
+            return 'open'
+        return 'half-open'
+
+    def as_dict(self, when):
+        return dict(
+            tokens=self.tokens,
+            failures=self.failures,
+            circuit=self.status(when),
+            open_until=(None if self.open_until is None
+                        else self.open_until.isoformat()),
+            deferred=self.deferred,
+            )
+
+
+
+class Throttle:
+    """The rate limits and circuit breakers of all recipient domains."""
+
+    def __init__(self, rate=0, burst=1, failure_threshold=0,
+                 open_period=timedelta(0)):
+        """Create a throttle.
+
+        :param rate: The number of recipients per second to let through to
+            each domain.  Zero means there is no limit.
+        :type rate: float
+        :param burst: The number of recipients which can be let through to a
+            domain at once.
+        :type burst: int
+        :param failure_threshold: The number of deliveries in a row with
+            only temporary failures after which a domain's circuit opens.
+            Zero means the circuits never open.
+        :type failure_threshold: int
+        :param open_period: How long a domain's circuit stays open.
+        :type open_period: `timedelta`
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.failure_threshold = failure_threshold
+        self.open_period = open_period
+        self.domains = {}
+
+    def _get_state(self, domain, when, create=True):
+        state = self.domains.get(domain)
+        if state is None:
+            if not create:
+                return None
+            state = self.domains[domain] = DomainState(self.burst, when)
+        elif self.rate > 0:
+            elapsed = max(0, (when - state.updated).total_seconds())
+            state.tokens = min(self.burst, state.tokens + elapsed * self.rate)
+            state.updated = when
+        return state
+
+    def admit(self, recipients, when=None):
+        """Decide which recipients can be delivered to now.
+
+        :param recipients: The recipients of a message.
+        :type recipients: sequence of email address strings
+        :param when: The current time.  Defaults to now.
+        :type when: `datetime`
+        :return: The recipients to deliver to now, and the deferred
+            recipients by the time they are due.
+        :rtype: list, and dict of lists
+        """
+        when = (now() if when is None else when)
+        by_domain = {}
+        for address in recipients:
+            by_domain.setdefault(_domain(address), []).append(address)
+        admitted = []
+        deferred = {}
+        for domain in sorted(by_domain):
+            addresses = by_domain[domain]
+            state = self._get_state(domain, when, create=(self.rate > 0))
+            if state is None:
+                admitted.extend(addresses)
+                continue
+            if state.open_until is not None and when < state.open_until:
+                due = state.open_until
+                rest = addresses
+            elif self.rate <= 0:
+                admitted.extend(addresses)
+                continue
+            else:
+                count = min(len(addresses), int(state.tokens))
+                state.tokens -= count
+                admitted.extend(addresses[:count])
+                rest = addresses[count:]
+                if len(rest) == 0:
+                    continue
+                # Wait for as many tokens as the bucket holds, to the
+                # second.  Whoever doesn't fit is deferred again then.
+                wanted = min(len(rest), self.burst) - state.tokens
+                due = when + timedelta(
+                    seconds=max(1, math.ceil(wanted / self.rate)))
+            state.deferred += len(rest)
+            deferred.setdefault(due, []).extend(rest)
+        return admitted, deferred
+
+    def record(self, recipients, refused, when=None):
+        """Learn from a delivery.
+
+        :param recipients: The recipients the message was delivered to.
+        :type recipients: sequence of email address strings
+        :param refused: The refused recipients, as defined by
+            `smtplib.SMTP.sendmail`.
+        :type refused: dictionary
+        :param when: The current time.  Defaults to now.
+        :type when: `datetime`
+        """
+        if self.failure_threshold <= 0:
+            return
+        when = (now() if when is None else when)
+        failed = {}
+        for address in recipients:
+            domain = _domain(address)
+            result = refused.get(address)
+            temporary = (result is not None and _is_temporary(result[0]))
+            failed[domain] = failed.get(domain, True) and temporary
+        for domain, all_failed in failed.items():
+            state = self._get_state(domain, when, create=all_failed)
+            if state is None:
+                continue
+            if all_failed:
+                state.failures += 1
+                if state.failures >= self.failure_threshold:
+                    state.open_until = when + self.open_period
+            else:
+                state.failures = 0
+                state.open_until = None
+
+    def prune(self, when=None):
+        """Forget the domains which are not being held back.
+
+        :param when: The current time.  Defaults to now.
+        :type when: `datetime`
+        """
+        when = (now() if when is None else when)
+        for domain in list(self.domains):
+            state = self._get_state(domain, when)
+            if (state.tokens >= self.burst and state.failures == 0 and
+                    state.open_until is None):
+                del self.domains[domain]
+
+    def as_dict(self, when=None):
+        """Return the state of the throttle as a JSON compatible dictionary.
+
+        :param when: The current time.  Defaults to now.
+        :type when: `datetime`
+        :return: The state of each domain, by domain.
+        :rtype: dict
+        """
+        when = (now() if when is None else when)
+        return {domain: self._get_state(domain, when).as_dict(when)
+                for domain in self.domains}
+
+    def save(self, path):
+        """Save the state of the throttle, replacing the file atomically.
+
+        :param path: The path of the file.
+        :type path: str
+        """
+        makedirs(os.path.dirname(path), 0o770)
+        tmpfile = path + '.tmp'
+        with open(tmpfile, 'w') as fp:
+            json.dump(self.as_dict(), fp)
+        os.rename(tmpfile, path)
+
+
+
+def collect(directory):
+    """Collect the throttle states saved by all the outgoing runners.
+
+    Each runner has its own throttle.  When several of them hold back the
+    same domain, the most restrictive state wins.
+
+    :param directory: The stats directory.
+    :type directory: str
+    :return: The state of each domain, by domain.
+    :rtype: dict
+    """
+    domains = {}
+    try:
+        filenames = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return domains
+    for filename in filenames:
+        if not filename.endswith(EXTENSION):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as fp:
+                states = json.load(fp)
+        except (OSError, ValueError):
+            # The runner went away, or the file is corrupt.
+            continue
+        for domain, state in states.items():
+            merged = domains.get(domain)
+            if merged is None:
+                domains[domain] = state
+                continue
+            merged['tokens'] = min(merged['tokens'], state['tokens'])
+            merged['failures'] = max(merged['failures'], state['failures'])
+            merged['deferred'] += state['deferred']
+            if (state['open_until'] is not None and
+                    (merged['open_until'] is None or
+                     state['open_until'] > merged['open_until'])):
+                merged['circuit'] = state['circuit']
+                merged['open_until'] = state['open_until']
+    return domains
+
+
+
+def get_throttle():
+    """Return the throttle of this process.
+
+    The same throttle is returned for as long as its settings don't change,
+    so that the outgoing runner shares it between deliveries.
+
+    :return: The throttle configured in the `[mta]` section.
+    :rtype: `Throttle`
+    """
+    settings = (
+        float(config.mta.domain_rate),
+        int(config.mta.domain_burst),
+        int(config.mta.circuit_failures),
+        as_timedelta(config.mta.circuit_open_period),
+        )
+    throttle = _throttles.get(settings)
+    if throttle is None:
+        throttle = _throttles[settings] = Throttle(*settings)
+    return throttle
@@ -21,12 +21,19 @@ __all__ = [
     'AQueue',
     'AQueueFile',
     'AllQueues',
+    'OutgoingThrottle',
+    'QueueMetrics',
     ]
 
 
+import time
+
 from mailman.config import config
 from mailman.app.inject import inject_text
+from mailman.core.queueindex import parse_filebase
+from mailman.core.queuestats import RunnerStats, collect, render_text
 from mailman.interfaces.listmanager import IListManager
+from mailman.mta.throttle import collect as collect_throttle
 from mailman.rest.helpers import (
     CollectionMixin, bad_request, created, etag, no_content, not_found, okay,
     paginate)
@@ -35,6 +42,15 @@ from zope.component import getUtility
 
 
 
+def _oldest_age(switchboard):
+    """The number of seconds the oldest due file has been waiting."""
+    now = time.time()
+    due = [parse_filebase(filebase)[0]
+           for filebase in switchboard.get_files(until=now)]
+    return (max(0, now - min(due)) if len(due) > 0 else 0)
+
+
+
 class _QueuesBase(CollectionMixin):
     """Shared base class for queues."""
 
@@ -42,11 +58,14 @@ class _QueuesBase(CollectionMixin):
         """See `CollectionMixin`."""
         switchboard = config.switchboards[name]
         files = switchboard.files
+        stats = collect(config.STATS_DIR).get(name, RunnerStats(name))
         return dict(
             name=switchboard.name,
             directory=switchboard.queue_directory,
             count=len(files),
             files=files,
+            oldest_age=_oldest_age(switchboard),
+            statistics=stats.as_dict(),
             self_link=self.path_to('queues/{}'.format(name)),
             )
 
@@ -126,3 +145,44 @@ class AllQueues(_QueuesBase):
         resource = self._make_collection(request)
         resource['self_link'] = self.path_to('queues')
         okay(response, etag(resource))
+
+
+
+
+class QueueMetrics:
+    """The statistics of all queues, for monitoring systems to scrape."""
+
+    def on_get(self, request, response):
+        """<api>/system/metrics"""
+        depths = {}
+        for name in sorted(config.switchboards):
+            switchboard = config.switchboards[name]
+            depths[name] = (len(switchboard.files), _oldest_age(switchboard))
+        response.content_type = 'text/plain; version=0.0.4'
+        okay(response, render_text(depths, collect(config.STATS_DIR)))
+
+
+
+
+class OutgoingThrottle(CollectionMixin):
+    """The recipient domains the outgoing runners are holding back."""
+
+    def __init__(self):
+        self._domains = collect_throttle(config.STATS_DIR)
+
+    def _resource_as_dict(self, domain):
+        """See `CollectionMixin`."""
+        resource = dict(self._domains[domain])
+        resource['domain'] = domain
+        return resource
+
+    @paginate
+    def _get_collection(self, request):
+        """See `CollectionMixin`."""
+        return sorted(self._domains)
+
+    def on_get(self, request, response):
+        """<api>/system/throttle"""
+        resource = self._make_collection(request)
+        resource['self_link'] = self.path_to('system/throttle')
+        okay(response, etag(resource))
@@ -37,7 +37,8 @@ from mailman.rest.helpers import (
 from mailman.rest.lists import AList, AllLists, Styles
 from mailman.rest.members import AMember, AllMembers, FindMembers
 from mailman.rest.preferences import ReadOnlyPreferences
-from mailman.rest.queues import AQueue, AQueueFile, AllQueues
+from mailman.rest.queues import (
+    AQueue, AQueueFile, AllQueues, OutgoingThrottle, QueueMetrics)
 from mailman.rest.templates import TemplateFinder
 from mailman.rest.users import AUser, AllUsers
 from zope.component import getUtility
@@ -169,6 +170,14 @@ class TopLevel:
             if len(segments) <= 2:
                 return SystemConfiguration(*segments[1:]), []
             return BadRequest(), []
+        elif segments[0] == 'metrics':
+            if len(segments) > 1:
+                return BadRequest(), []
+            return QueueMetrics(), []
+        elif segments[0] == 'throttle':
+            if len(segments) > 1:
+                return BadRequest(), []
+            return OutgoingThrottle(), []
         else:
             return NotFound(), []
 
@@ -22,11 +22,17 @@ __all__ = [
     ]
 
 
+import os
 import unittest
 
+from base64 import b64encode
+from datetime import timedelta
+from httplib2 import Http
 from mailman.app.lifecycle import create_list
 from mailman.config import config
+from mailman.core.queuestats import RunnerStats
 from mailman.database.transaction import transaction
+from mailman.mta.throttle import Throttle
 from mailman.testing.helpers import call_api, get_queue_messages
 from mailman.testing.layers import RESTLayer
 from urllib.error import HTTPError
@@ -106,3 +112,57 @@ class TestQueues(unittest.TestCase):
         content, response = call_api(location, method='DELETE')
         self.assertEqual(response.status, 204)
         self.assertEqual(len(config.switchboards['bad'].files), 0)
+
+    def test_statistics(self):
+        # The statistics saved by the runners show up in the queue resource.
+        stats = RunnerStats('in')
+        stats.count('processed', 3)
+        stats.observe('dequeue_latency', 0.2)
+        stats.save(os.path.join(config.STATS_DIR, 'in.0.json'))
+        stats.save(os.path.join(config.STATS_DIR, 'in.1.json'))
+        content, response = call_api('http://localhost:9001/3.0/queues/in')
+        statistics = content['statistics']
+        self.assertEqual(statistics['processed'], 6)
+        self.assertEqual(statistics['shunted'], 0)
+        self.assertEqual(statistics['dequeue_latency']['count'], 2)
+        self.assertEqual(content['oldest_age'], 0)
+
+    def test_metrics(self):
+        # The statistics of all queues are available as plain text.
+        stats = RunnerStats('in')
+        stats.count('shunted')
+        stats.save(os.path.join(config.STATS_DIR, 'in.0.json'))
+        call_api('http://localhost:9001/3.0/queues/bad', {
+            'list_id': 'test.example.com',
+            'text': TEXT})
+        userpass = '{}:{}'.format(
+            config.webservice.admin_user, config.webservice.admin_pass)
+        headers = {
+            'Authorization': 'Basic {}'.format(
+                b64encode(userpass.encode('utf-8')).decode('ascii')),
+            }
+        response, raw_content = Http().request(
+            'http://localhost:9001/3.0/system/metrics', 'GET', None, headers)
+        self.assertEqual(response.status, 200)
+        self.assertTrue(response['content-type'].startswith('text/plain'))
+        lines = raw_content.decode('utf-8').splitlines()
+        self.assertIn('mailman_queue_depth{queue="bad"} 1', lines)
+        self.assertIn('mailman_queue_depth{queue="in"} 0', lines)
+        self.assertIn('mailman_queue_shunted_total{queue="in"} 1', lines)
+        self.assertIn('# TYPE mailman_queue_dispose_time_seconds histogram',
+                      lines)
+
+    def test_throttle(self):
+        # The domains held back by the outgoing runners can be inspected.
+        throttle = Throttle(failure_threshold=1,
+                            open_period=timedelta(minutes=5))
+        throttle.record(['anne@example.org'],
+                        {'anne@example.org': (451, b'Try again later')})
+        throttle.save(os.path.join(config.STATS_DIR, 'out.0.throttle'))
+        content, response = call_api(
+            'http://localhost:9001/3.0/system/throttle')
+        self.assertEqual(content['total_size'], 1)
+        entry = content['entries'][0]
+        self.assertEqual(entry['domain'], 'example.org')
+        self.assertEqual(entry['circuit'], 'open')
+        self.assertEqual(entry['failures'], 1)
@@ -36,8 +36,8 @@ elog = logging.getLogger('mailman.error')
 class BounceRunner(Runner):
     """The bounce runner."""
 
-    def __init__(self, name, slice=None):
-        super(BounceRunner, self).__init__(name, slice)
+    def __init__(self, name, slice=None, numslices=None):
+        super(BounceRunner, self).__init__(name, slice, numslices)
         self._processor = getUtility(IBounceProcessor)
 
     def _dispose(self, mlist, msg, msgdata):
@@ -36,11 +36,13 @@ from mailman.core.i18n import _
 from mailman.core.runner import Runner
 from mailman.email.message import Message, MultipartDigestMessage
 from mailman.handlers.decorate import decorate
-from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+from mailman.interfaces.member import DeliveryMode
+from mailman.interfaces.recipients import IRecipientsCache
 from mailman.utilities.i18n import make
 from mailman.utilities.mailbox import Mailbox
 from mailman.utilities.string import oneline, wrap
 from urllib.error import URLError
+from zope.component import getUtility
 
 
 log = logging.getLogger('mailman.error')
@@ -349,21 +351,18 @@ class DigestRunner(Runner):
         # When someone turns off digest delivery, they will get one last
         # digest to ensure that there will be no gaps in the messages they
         # receive.
-        digest_members = set(mlist.digest_members.members)
-        for member in digest_members:
-            if member.delivery_status is not DeliveryStatus.enabled:
-                continue
-            # Send the digest to the case-preserved address of the digest
+        for email_address, delivery_mode in (
+                getUtility(IRecipientsCache).get_digest_recipients(mlist)):
+            # The digest is sent to the case-preserved address of the digest
             # members.
-            email_address = member.address.original_email
-            if member.delivery_mode == DeliveryMode.plaintext_digests:
+            if delivery_mode == DeliveryMode.plaintext_digests:
                 rfc1153_recipients.add(email_address)
-            elif member.delivery_mode == DeliveryMode.mime_digests:
+            elif delivery_mode == DeliveryMode.mime_digests:
                 mime_recipients.add(email_address)
             else:
                 raise AssertionError(
                     'Digest member "{0}" unexpected delivery mode: {1}'.format(
-                        email_address, member.delivery_mode))
+                        email_address, delivery_mode))
         # Add also the folks who are receiving one last digest.
         for address, delivery_mode in mlist.last_digest_recipients:
             if delivery_mode == DeliveryMode.plaintext_digests:
@@ -156,13 +156,13 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
 
     is_queue_runner = False
 
-    def __init__(self, name, slice=None):
+    def __init__(self, name, slice=None, numslices=None):
         localaddr = config.mta.lmtp_host, int(config.mta.lmtp_port)
         # Do not call Runner's constructor because there's no QDIR to create
         qlog.debug('LMTP server listening on %s:%s',
                    localaddr[0], localaddr[1])
         smtpd.SMTPServer.__init__(self, localaddr, remoteaddr=None)
-        super(LMTPRunner, self).__init__(name, slice)
+        super(LMTPRunner, self).__init__(name, slice, numslices)
 
     def handle_accept(self):
         conn, addr = self.accept()
@@ -22,6 +22,9 @@ __all__ = [
     ]
 
 
+import os
+import time
+import signal
 import socket
 import logging
 
@@ -34,6 +37,9 @@ from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.mta import SomeRecipientsFailed
 from mailman.interfaces.pending import IPendings
 from mailman.interfaces.subscriptions import ISubscriptionService
+from mailman.mta.checkpoint import DeliveryCheckpoint
+from mailman.mta.connection import ConnectionPool
+from mailman.mta.throttle import EXTENSION, get_throttle
 from mailman.utilities.datetime import now
 from mailman.utilities.modules import find_name
 from uuid import UUID
@@ -53,8 +59,8 @@ debug_log = logging.getLogger('mailman.debug')
 class OutgoingRunner(Runner):
     """The outgoing runner."""
 
-    def __init__(self, slice=None, numslices=1):
-        super(OutgoingRunner, self).__init__(slice, numslices)
+    def __init__(self, name, slice=None, numslices=None):
+        super(OutgoingRunner, self).__init__(name, slice, numslices)
         # We look this function up only at startup time.
         self._func = find_name(config.mta.outgoing)
         # This prevents smtp server connection problems from filling up the
@@ -62,9 +68,34 @@ class OutgoingRunner(Runner):
         # set if there was a socket.error.
         self._logged = False
         self._retryq = config.switchboards['retry']
+        # The connections to the MTA are kept open between messages.
+        self._pool = ConnectionPool(
+            config.mta.smtp_host, int(config.mta.smtp_port),
+            int(config.mta.max_sessions_per_connection),
+            (config.mta.smtp_user if config.mta.smtp_user else None),
+            (config.mta.smtp_pass if config.mta.smtp_pass else None),
+            as_timedelta(config.mta.connection_idle_timeout).total_seconds(),
+            as_timedelta(
+                config.mta.connection_check_interval).total_seconds())
+        self._close_connections = False
+        # The throttle's state is saved along with the runner's statistics.
+        self._throttle_file = os.path.join(
+            config.STATS_DIR, '{}.{}{}'.format(
+                name, (0 if slice is None else slice), EXTENSION))
+        self._throttle_saved = None
+
+    def signal_handler(self, signum, frame):
+        super(OutgoingRunner, self).signal_handler(signum, frame)
+        if signum == signal.SIGHUP:
+            # The MTA may have been reconfigured.  The connections can't be
+            # closed right here, since one of them may be in use.
+            self._close_connections = True
 
     def _dispose(self, mlist, msg, msgdata):
-        # See if we should retry delivery of this message again.
+        # See if we should retry delivery of this message again.  The
+        # switchboard normally holds on to deferred messages until they are
+        # due, but queue files written by older versions are named after the
+        # time they were enqueued.
         deliver_after = msgdata.get('deliver_after', datetime.fromtimestamp(0))
         if now() < deliver_after:
             return True
@@ -91,10 +122,22 @@ class OutgoingRunner(Runner):
         else:
             # VERP every 'interval' number of times.
             msgdata['verp'] = (mlist.post_id % interval == 0)
+        # The work units of streamed postings only name a range of the
+        # regular members.  Once their recipients are worked out, they stay
+        # put through retries and deferrals.
+        if 'recipient_range' in msgdata and 'recipients' not in msgdata:
+            first, last = msgdata['recipient_range']
+            excluded = msgdata.get('excluded_recipients', set())
+            msgdata['recipients'] = set(
+                address.email for address, delivery_mode
+                in mlist.regular_members.get_deliverable_addresses(
+                    first, last)
+                if address.email not in excluded)
         try:
             debug_log.debug('[outgoing] {0}: {1}'.format(
                 self._func, msg.get('message-id', 'n/a')))
-            self._func(mlist, msg, msgdata)
+            with self._pool:
+                self._func(mlist, msg, msgdata)
             self._logged = False
         except socket.error:
             # There was a problem connecting to the SMTP server.  Log this
@@ -107,8 +150,21 @@ class OutgoingRunner(Runner):
                 log.error('Cannot connect to SMTP server %s on port %s',
                           config.mta.smtp_host, port)
                 self._logged = True
+            # The message is queued again under a new name, so its
+            # checkpoint goes away.  Leave out whoever it was delivered to.
+            if msgdata.get('recipients') and '_checkpoint' in msgdata:
+                msgdata['recipients'] = DeliveryCheckpoint(
+                    msgdata['_checkpoint']).undelivered(msgdata['recipients'])
             return True
         except SomeRecipientsFailed as error:
+            # Recipients in throttled domains were not tried at all.  They
+            # wait in the retry queue until they are due, without counting
+            # as failures.
+            for deliver_after, recipients in sorted(error.deferred.items()):
+                deferred_msgdata = msgdata.copy()
+                deferred_msgdata['recipients'] = recipients
+                deferred_msgdata['deliver_after'] = deliver_after
+                self._retryq.enqueue(msg, deferred_msgdata)
             processor = getUtility(IBounceProcessor)
             # BAW: msg is the original message that failed delivery, not a
             # bounce message.  This may be confusing if this is what's sent to
@@ -140,8 +196,8 @@ class OutgoingRunner(Runner):
                 for email in error.permanent_failures:
                     processor.register(mlist, email, msg, BounceContext.normal)
                 # Move temporary failures to the qfiles/retry queue which will
-                # occasionally move them back here for another shot at
-                # delivery.
+                # move them back here for another shot at delivery once the
+                # retry interval has passed.
                 if error.temporary_failures:
                     current_time = now()
                     recipients = error.temporary_failures
@@ -164,6 +220,42 @@ class OutgoingRunner(Runner):
                     msgdata['last_recip_count'] = len(recipients)
                     msgdata['deliver_until'] = deliver_until
                     msgdata['recipients'] = recipients
+                    msgdata['deliver_after'] = current_time + as_timedelta(
+                        config.mta.delivery_retry_interval)
                     self._retryq.enqueue(msg, msgdata)
         # We've successfully completed handling of this message.
         return False
+
+    def _do_periodic(self):
+        """See `IRunner`."""
+        if self._close_connections:
+            self._close_connections = False
+            self._pool.close()
+        else:
+            self._pool.prune()
+        self._save_throttle()
+
+    def _save_throttle(self):
+        """Save the state of the throttle if it wasn't saved for a while."""
+        if self.stats_interval <= 0:
+            return
+        when = time.time()
+        if (self._throttle_saved is not None and
+                when - self._throttle_saved < self.stats_interval):
+            return
+        throttle = get_throttle()
+        throttle.prune()
+        try:
+            throttle.save(self._throttle_file)
+        except OSError as error:
+            log.error('Cannot save the outgoing throttle: %s', error)
+        self._throttle_saved = when
+
+    def _clean_up(self):
+        """See `IRunner`."""
+        self._pool.close()
+        try:
+            os.remove(self._throttle_file)
+        except FileNotFoundError:
+            pass
+        super(OutgoingRunner, self)._clean_up()
@@ -39,9 +39,9 @@ class RESTRunner(Runner):
     # won't actually stop the TCPServer started by .serve_forever().
     is_queue_runner = False
 
-    def __init__(self, name, slice=None):
+    def __init__(self, name, slice=None, numslices=None):
         """See `IRunner`."""
-        super(RESTRunner, self).__init__(name, slice)
+        super(RESTRunner, self).__init__(name, slice, numslices)
         # Both the REST server and the signal handlers must run in the main
         # thread; the former because of SQLite requirements (objects created
         # in one thread cannot be shared with the other threads), and the
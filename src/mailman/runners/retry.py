@@ -22,8 +22,6 @@ __all__ = [
     ]
 
 
-import time
-
 from mailman.config import config
 from mailman.core.runner import Runner
 
@@ -33,10 +31,8 @@ class RetryRunner(Runner):
     """Retry delivery."""
 
     def _dispose(self, mlist, msg, msgdata):
-        # Move the message to the out queue for another try.
+        # The switchboard only hands us messages whose retry time has come, so
+        # move the message to the out queue for another try right away.
+        msgdata.pop('deliver_after', None)
         config.switchboards['out'].enqueue(msg, msgdata)
         return False
-
-    def _snooze(self, filecnt):
-        # We always want to snooze.
-        time.sleep(self.sleep_float)
@@ -18,14 +18,17 @@
 """Test the outgoing runner."""
 
 __all__ = [
+    'TestConnectionPool',
     'TestOnce',
     'TestSocketError',
     'TestSomeRecipientsFailed',
+    'TestStreaming',
     'TestVERPSettings',
     ]
 
 
 import os
+import signal
 import socket
 import logging
 import unittest
@@ -42,12 +45,14 @@ from mailman.interfaces.member import MemberRole
 from mailman.interfaces.mta import SomeRecipientsFailed
 from mailman.interfaces.pending import IPendings
 from mailman.interfaces.usermanager import IUserManager
+from mailman.mta.checkpoint import DeliveryCheckpoint
 from mailman.runners.outgoing import OutgoingRunner
 from mailman.testing.helpers import (
-    LogFileMark, get_queue_messages, make_testable_runner,
+    LogFileMark, configuration, get_queue_messages, make_testable_runner,
     specialized_message_from_string as message_from_string)
 from mailman.testing.layers import ConfigLayer, SMTPLayer
 from mailman.utilities.datetime import factory, now
+from unittest.mock import patch
 from zope.component import getUtility
 
 
@@ -319,14 +324,34 @@ Message-Id: <first>
             line[-53:-1],
             'Cannot connect to SMTP server localhost on port 2112')
 
+    def test_requeue_undelivered_recipients(self):
+        # When the message is queued again, the recipients it was already
+        # delivered to are left out.
+        recipients = ['anne@example.com', 'bart@example.com',
+                      'cris@example.com']
+        filebase = self._outq.enqueue(self._msg, {}, listid='test.example.com',
+                                      recipients=recipients)
+        checkpoint = DeliveryCheckpoint(
+            self._outq._checkpoint_file(filebase))
+        checkpoint.record(recipients[:2])
+        checkpoint.close()
+        self._runner.run()
+        items = get_queue_messages('out')
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].msgdata['recipients'], ['cris@example.com'])
+        # The checkpoint went away along with the original queue file.
+        self.assertFalse(os.path.exists(checkpoint.path))
+
 
 
 temporary_failures = []
 permanent_failures = []
+deferred = {}
 
 
 def raise_SomeRecipientsFailed(mlist, msg, msgdata):
-    raise SomeRecipientsFailed(temporary_failures, permanent_failures)
+    raise SomeRecipientsFailed(temporary_failures, permanent_failures,
+                               deferred)
 
 
 class TestSomeRecipientsFailed(unittest.TestCase):
@@ -338,6 +363,7 @@ class TestSomeRecipientsFailed(unittest.TestCase):
         global temporary_failures, permanent_failures
         del temporary_failures[:]
         del permanent_failures[:]
+        deferred.clear()
         self._processor = getUtility(IBounceProcessor)
         # Push a config where actual delivery is handled by a dummy function.
         # We generally don't care what this does, since we're just testing the
@@ -449,6 +475,10 @@ Message-Id: <first>
                          as_timedelta(config.mta.delivery_retry_period))
         self.assertEqual(items[0].msgdata['deliver_until'], deliver_until)
         self.assertEqual(items[0].msgdata['recipients'], ['cris@example.com'])
+        # The message is retried after the retry interval.
+        deliver_after = (datetime(2005, 8, 1, 7, 49, 23) +
+                         as_timedelta(config.mta.delivery_retry_interval))
+        self.assertEqual(items[0].msgdata['deliver_after'], deliver_after)
 
     def test_two_temporary_failures(self):
         # The first time there are temporary failures, the message just gets
@@ -489,6 +519,29 @@ Message-Id: <first>
         self.assertEqual(items[0].msgdata['recipients'],
                          ['gwen@example.com', 'herb@example.com'])
 
+    def test_deferred_recipients(self):
+        # Recipients deferred by the throttle wait in the retry queue until
+        # they are due, without counting as failures.
+        soon = datetime(2005, 8, 1, 7, 49, 33)
+        later = datetime(2005, 8, 1, 7, 54, 23)
+        deferred[soon] = ['anne@example.com']
+        deferred[later] = ['bart@example.org', 'cris@example.org']
+        temporary_failures.append('dave@example.com')
+        self._outq.enqueue(self._msg, {}, listid='test.example.com')
+        self._runner.run()
+        items = sorted(get_queue_messages('retry'),
+                       key=lambda item: item.msgdata['recipients'])
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].msgdata['recipients'], ['anne@example.com'])
+        self.assertEqual(items[0].msgdata['deliver_after'], soon)
+        self.assertNotIn('last_recip_count', items[0].msgdata)
+        self.assertEqual(items[1].msgdata['recipients'],
+                         ['bart@example.org', 'cris@example.org'])
+        self.assertEqual(items[1].msgdata['deliver_after'], later)
+        # The temporary failure is retried as usual.
+        self.assertEqual(items[2].msgdata['recipients'], ['dave@example.com'])
+        self.assertEqual(items[2].msgdata['last_recip_count'], 1)
+
     def test_no_progress_on_retries_within_retry_period(self):
         # Temporary failures cause queuing for a retry later on, unless no
         # progress is being made on the retries and we've tried for the
@@ -534,3 +587,110 @@ Message-Id: <first>
         self.assertEqual(
             line[-63:-1],
             'Discarding message with persistent temporary failures: <first>')
+
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Test the connections kept open by the outgoing runner."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._outq = config.switchboards['out']
+        patcher = patch('mailman.mta.connection.smtplib.SMTP')
+        self._smtp_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self._smtp = self._smtp_class.return_value
+        self._smtp.sendmail.return_value = {}
+
+    def _enqueue(self, *message_ids):
+        for message_id in message_ids:
+            msg = message_from_string("""\
+From: anne@example.com
+To: test@example.com
+Message-Id: {}
+
+""".format(message_id))
+            self._outq.enqueue(msg, recipients=['bart@example.com'],
+                               listid='test.example.com')
+
+    def test_connection_kept_open(self):
+        self._enqueue('<ant>', '<bee>')
+        runner = make_testable_runner(OutgoingRunner, 'out')
+        runner.run()
+        self.assertEqual(self._smtp.sendmail.call_count, 2)
+        self.assertEqual(self._smtp.connect.call_count, 1)
+        # The connection is closed when the runner exits.
+        self.assertEqual(self._smtp.quit.call_count, 1)
+
+    @configuration('mta', connection_idle_timeout='0s')
+    def test_connection_closed_after_each_message(self):
+        self._enqueue('<ant>', '<bee>')
+        runner = make_testable_runner(OutgoingRunner, 'out')
+        runner.run()
+        self.assertEqual(self._smtp.sendmail.call_count, 2)
+        self.assertEqual(self._smtp.connect.call_count, 2)
+
+    def test_sighup_closes_connections(self):
+        self._enqueue('<ant>')
+        runner = make_testable_runner(OutgoingRunner, 'out')
+        runner._one_iteration()
+        self.assertEqual(self._smtp.quit.call_count, 0)
+        runner.signal_handler(signal.SIGHUP, None)
+        # The connections are closed once the runner gets around to it.
+        self.assertEqual(self._smtp.quit.call_count, 0)
+        runner._do_periodic()
+        self.assertEqual(self._smtp.quit.call_count, 1)
+
+
+
+class TestStreaming(unittest.TestCase):
+    """Test the delivery of the work units of streamed postings."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        global captured_mlist, captured_msg, captured_msgdata
+        config.push('fake outgoing', """
+        [mta]
+        outgoing: mailman.runners.tests.test_outgoing.capture
+        """)
+        self.addCleanup(config.pop, 'fake outgoing')
+        captured_mlist = None
+        captured_msg = None
+        captured_msgdata = None
+        self._mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        self._ids = []
+        for name in ('anne', 'bart', 'cris', 'dave'):
+            address = user_manager.create_address(
+                '{}@example.com'.format(name))
+            self._ids.append(self._mlist.subscribe(address).id)
+        self._outq = config.switchboards['out']
+        self._runner = make_testable_runner(OutgoingRunner, 'out')
+        self._msg = message_from_string("""\
+From: anne@example.com
+To: test@example.com
+Message-Id: <first>
+
+""")
+
+    def test_recipients_of_the_range(self):
+        # The unit's recipients are the regular members in its range, except
+        # for whoever was left out.
+        self._outq.enqueue(self._msg, {}, listid='test.example.com',
+                           recipient_range=(self._ids[0], self._ids[2]),
+                           excluded_recipients=set(('anne@example.com',)))
+        self._runner.run()
+        self.assertEqual(captured_msgdata['recipients'],
+                         set(('bart@example.com', 'cris@example.com')))
+
+    def test_retried_unit(self):
+        # Once the recipients are worked out, they stay put.
+        self._outq.enqueue(self._msg, {}, listid='test.example.com',
+                           recipient_range=(self._ids[0], self._ids[3]),
+                           recipients=['dave@example.com'])
+        self._runner.run()
+        self.assertEqual(captured_msgdata['recipients'],
+                         ['dave@example.com'])
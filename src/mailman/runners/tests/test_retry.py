@@ -24,6 +24,7 @@ __all__ = [
 
 import unittest
 
+from datetime import timedelta
 from mailman.app.lifecycle import create_list
 from mailman.config import config
 from mailman.runners.retry import RetryRunner
@@ -31,6 +32,7 @@ from mailman.testing.helpers import (
     get_queue_messages, make_testable_runner,
     specialized_message_from_string as message_from_string)
 from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
 
 
 
@@ -56,3 +58,21 @@ Message-Id: <first>
         self._retryq.enqueue(self._msg, self._msgdata)
         self._runner.run()
         self.assertEqual(len(get_queue_messages('out')), 1)
+
+    def test_message_not_due(self):
+        # Messages are left in the retry queue until it's time to retry them.
+        self._msgdata['deliver_after'] = now() + timedelta(minutes=15)
+        self._retryq.enqueue(self._msg, self._msgdata)
+        self._runner.run()
+        self.assertEqual(len(get_queue_messages('out')), 0)
+        self.assertEqual(len(get_queue_messages('retry')), 1)
+
+    def test_message_due(self):
+        # Once it's time to retry the message, it is moved to the out queue,
+        # which delivers it right away.
+        self._msgdata['deliver_after'] = now() - timedelta(minutes=15)
+        self._retryq.enqueue(self._msg, self._msgdata)
+        self._runner.run()
+        items = get_queue_messages('out')
+        self.assertEqual(len(items), 1)
+        self.assertNotIn('deliver_after', items[0].msgdata)
@@ -86,7 +86,8 @@ def make_testable_runner(runner_class, name=None, predicate=None):
         class name.
     :type name: string or None
     :param predicate: Optional alternative predicate for deciding when to stop
-        the runner.  When None (the default) it stops when the queue is empty.
+        the runner.  When None (the default) it stops when the queue has no
+        more files which are due.
     :type predicate: callable that gets one argument, the queue runner.
     :return: A runner instance.
     """
@@ -105,9 +106,11 @@ def make_testable_runner(runner_class, name=None, predicate=None):
             self.__class__.__name__ = runner_class.__name__
 
         def _do_periodic(self):
-            """Stop when the queue is empty."""
+            """Stop when the queue has no more files which are due."""
+            super(EmptyingRunner, self)._do_periodic()
             if predicate is None:
-                self._stop = (len(self.switchboard.files) == 0)
+                self._stop = (len(
+                    self.switchboard.get_files(until=time.time())) == 0)
             else:
                 self._stop = predicate(self)
 
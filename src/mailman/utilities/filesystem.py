@@ -18,13 +18,21 @@
 """Filesystem utilities."""
 
 __all__ = [
+    'fsync_directory',
     'makedirs',
+    'sync_filesystem',
     'umask',
     ]
 
 
 import os
 import errno
+import ctypes
+import ctypes.util
+
+
+# The C library, loaded on first use by sync_filesystem().
+_libc = None
 
 
 
@@ -73,3 +81,53 @@ def makedirs(path, mode=0o2775):
             os.chmod(dirpath, mode)
         except OSError:
             pass
+
+
+
+def fsync_directory(path):
+    """Flush a directory's entries to disk.
+
+    This makes files which were recently created in, renamed into, or removed
+    from the directory durable.
+
+    :param path: The directory to sync.
+    :type path: string
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+
+def sync_filesystem(path):
+    """Flush all pending writes on the file system containing a path.
+
+    This is only supported where the C library provides `syncfs()`, i.e. on
+    Linux.
+
+    :param path: A file or directory on the file system to sync.
+    :type path: string
+    :return: True if the file system was synced, False if this is not
+        supported and the caller must sync individual files instead.
+    :rtype: bool
+    """
+    global _libc
+    if _libc is None:
+        library = ctypes.util.find_library('c')
+        try:
+            _libc = ctypes.CDLL(library, use_errno=True)
+        except OSError:
+            _libc = False
+    syncfs = getattr(_libc, 'syncfs', None)
+    if syncfs is None:
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if syncfs(fd) != 0:
+            error_number = ctypes.get_errno()
+            raise OSError(error_number, os.strerror(error_number), path)
+    finally:
+        os.close(fd)
+    return True
@@ -0,0 +1,136 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A compact set of recipients.
+
+The recipients of a big delivery are kept in the message metadata all the
+way from the pipeline to the outgoing runner, and through every retry.  To
+keep the queue files small, big recipient sets are stored as a table of
+addresses grouped by domain, so that every domain is only stored once, which
+is then compressed.  The table is only expanded back to addresses when they
+are needed, i.e. when the message is delivered.
+"""
+
+__all__ = [
+    'CompactRecipients',
+    ]
+
+
+import zlib
+
+from collections.abc import Set
+
+
+# Separates a domain from its local parts, and the local parts from each
+# other, in the table.  Neither can contain a NUL.
+SEPARATOR = '\0'
+
+
+
+def _from_bytes(data):
+    # For pickle.
+    return CompactRecipients.from_bytes(data)
+
+
+
+class CompactRecipients(Set):
+    """An immutable set of email addresses, compressed until it is used."""
+
+    def __init__(self, addresses=()):
+        """Create the set.
+
+        :param addresses: The email addresses.
+        :type addresses: iterable of strings
+        """
+        addresses = frozenset(addresses)
+        domains = {}
+        for address in addresses:
+            local_part, at, domain = address.rpartition('@')
+            if len(at) == 0:
+                # There was no at-sign in the email address.
+                local_part, domain = address, ''
+            # The domains are stored along with their at-sign, so that the
+            # addresses can be put back together by just appending them.
+            domains.setdefault(at + domain, []).append(local_part)
+        lines = []
+        for domain in sorted(domains):
+            lines.append(SEPARATOR.join([domain] + sorted(domains[domain])))
+        self._data = zlib.compress(
+            '\n'.join(lines).encode('utf-8', 'surrogateescape'))
+        self._addresses = addresses
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Recreate the set from its compressed form.
+
+        The addresses aren't expanded until they are needed.
+
+        :param data: The compressed table of addresses, as in `data`.
+        :type data: bytes
+        :return: The set.
+        :rtype: `CompactRecipients`
+        """
+        recipients = cls.__new__(cls)
+        recipients._data = data
+        recipients._addresses = None
+        return recipients
+
+    @property
+    def data(self):
+        """The compressed table of addresses.
+
+        :rtype: bytes
+        """
+        return self._data
+
+    @property
+    def addresses(self):
+        """The email addresses, expanded the first time they are needed.
+
+        :rtype: frozenset of strings
+        """
+        if self._addresses is None:
+            text = zlib.decompress(self._data).decode(
+                'utf-8', 'surrogateescape')
+            addresses = set()
+            for line in (text.split('\n') if len(text) > 0 else []):
+                domain, *local_parts = line.split(SEPARATOR)
+                addresses.update(
+                    local_part + domain for local_part in local_parts)
+            self._addresses = frozenset(addresses)
+        return self._addresses
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        # The results of set operations are used right away.
+        return set(iterable)
+
+    def __contains__(self, address):
+        return address in self.addresses
+
+    def __iter__(self):
+        return iter(self.addresses)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __reduce__(self):
+        return _from_bytes, (self._data,)
+
+    def __repr__(self):
+        return '<CompactRecipients of {0} bytes at {1:#x}>'.format(
+            len(self._data), id(self))
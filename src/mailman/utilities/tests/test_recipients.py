@@ -0,0 +1,79 @@
+# Copyright (C) 2015 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the compact recipient sets."""
+
+__all__ = [
+    'TestCompactRecipients',
+    ]
+
+
+import pickle
+import unittest
+
+from mailman.utilities.recipients import CompactRecipients
+
+
+
+class TestCompactRecipients(unittest.TestCase):
+    def setUp(self):
+        self._addresses = set(
+            '{}@{}'.format(name, domain)
+            for name in ('anne', 'bart', 'cris', 'dave')
+            for domain in ('example.com', 'example.org', 'Example.Net'))
+        self._addresses.update(['root', 'zoë@example.com'])
+
+    def test_round_trip(self):
+        recipients = CompactRecipients(self._addresses)
+        self.assertEqual(recipients, self._addresses)
+        copy = CompactRecipients.from_bytes(recipients.data)
+        self.assertEqual(copy, self._addresses)
+        self.assertEqual(len(copy), len(self._addresses))
+        self.assertEqual(sorted(copy), sorted(self._addresses))
+
+    def test_expanded_when_used(self):
+        data = CompactRecipients(self._addresses).data
+        recipients = CompactRecipients.from_bytes(data)
+        self.assertIsNone(recipients._addresses)
+        self.assertIn('bart@example.org', recipients)
+        self.assertNotIn('bart@example.edu', recipients)
+        self.assertIsNotNone(recipients._addresses)
+
+    def test_domains_are_stored_once(self):
+        addresses = ['{}@lists.example.com'.format(n) for n in range(1000)]
+        recipients = CompactRecipients(addresses)
+        self.assertLess(len(recipients.data), len(''.join(addresses)) / 10)
+
+    def test_empty(self):
+        recipients = CompactRecipients()
+        self.assertEqual(len(recipients), 0)
+        self.assertEqual(CompactRecipients.from_bytes(recipients.data), set())
+
+    def test_set_operations(self):
+        recipients = CompactRecipients(['anne@example.com', 'bart@example.com'])
+        difference = recipients - {'anne@example.com'}
+        self.assertIs(type(difference), set)
+        self.assertEqual(difference, {'bart@example.com'})
+        self.assertEqual(recipients | {'cris@example.com'}, {
+            'anne@example.com', 'bart@example.com', 'cris@example.com'})
+
+    def test_pickle(self):
+        recipients = CompactRecipients(self._addresses)
+        copy = pickle.loads(pickle.dumps(recipients))
+        self.assertIsInstance(copy, CompactRecipients)
+        self.assertEqual(copy.data, recipients.data)
+        self.assertEqual(copy, self._addresses)